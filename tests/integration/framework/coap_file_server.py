@@ -14,21 +14,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import contextlib
-from typing import NamedTuple, Optional
+import mmap
+import os
+import selectors
+from typing import Dict, NamedTuple, Optional, Tuple
 import socket
 import struct
 import threading
-import zlib
-
 import time
+import zlib
 
 from .lwm2m import coap
 from .lwm2m.path import CoapPath
 from .lwm2m.messages import *
 
+# amount of data fed to zlib.crc32 at a time when computing ETags
+ETAG_CHUNK_SIZE = 1024 * 1024
+
+
+def _crc32_etag(data: memoryview) -> bytes:
+    crc = 0
+    for offset in range(0, len(data), ETAG_CHUNK_SIZE):
+        crc = zlib.crc32(data[offset:offset + ETAG_CHUNK_SIZE], crc)
+    return struct.pack('>I', crc)
+
 
 class CoapFileServer:
-    Resource = NamedTuple('Resource', [('etag', bytes), ('data', bytes)])
+    Resource = NamedTuple('Resource', [('etag', bytes), ('data', memoryview)])
 
     def __init__(self, coap_server: coap.Server, binding='U'):
         self._resources = {}
@@ -36,17 +48,66 @@ class CoapFileServer:
         self.requests = []
         self.should_ignore_request = lambda _: False
         self.binding = binding
+        # (device, inode, size, mtime) -> ETag, so that serving the same
+        # file again does not require reading all of it
+        self._file_etags = {}  # type: Dict[Tuple[int, int, int, int], bytes]
+        # path -> mapping backing the data of a set_file_resource() resource
+        self._mappings = {}  # type: Dict[str, mmap.mmap]
+
+    def _remove_resource(self, path: str) -> None:
+        resource = self._resources.pop(path)
+        mapping = self._mappings.pop(path, None)
+        if mapping is not None:
+            # the mapping cannot be closed while a view of it exists
+            resource.data.release()
+            mapping.close()
 
     def set_resource(self,
                      path: str,
                      data: Optional[bytes],
                      etag: Optional[bytes] = None):
         if data is not None:
+            data = memoryview(data)
             if etag is None:
-                etag = struct.pack('>I', zlib.crc32(data))
+                etag = _crc32_etag(data)
+            if path in self._resources:
+                self._remove_resource(path)
             self._resources[path] = self.Resource(etag=etag, data=data)
         else:
-            del self._resources[path]
+            self._remove_resource(path)
+
+    def set_file_resource(self,
+                          path: str,
+                          filename: str,
+                          etag: Optional[bytes] = None):
+        """
+        Serves contents of FILENAME at PATH. The file is mapped into memory
+        instead of being read, so that even very large files (e.g. firmware
+        images) are only paged in as blocks are requested. Each block is
+        still copied when its response is built, as coap.Packet keeps its
+        own copy of the content. The mapping is closed when the resource is
+        replaced or removed; the file must not be truncated until then.
+        """
+        with open(filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                # empty files cannot be mapped
+                mapping = None
+                data = memoryview(b'')
+            else:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                data = memoryview(mapping)
+
+        if etag is None:
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            etag = self._file_etags.get(key)
+            if etag is None:
+                etag = self._file_etags[key] = _crc32_etag(data)
+        if path in self._resources:
+            self._remove_resource(path)
+        self._resources[path] = self.Resource(etag=etag, data=data)
+        if mapping is not None:
+            self._mappings[path] = mapping
 
     def get_resource_uri(self, path: CoapPath):
         if path not in self._resources:
@@ -74,30 +135,22 @@ class CoapFileServer:
 
         return self._server.recv(timeout_s=timeout_s)
 
-    def handle_recvd_request(self, req):
-        self.requests.append(req)
-
-        if self.should_ignore_request(req):
-            return
-
+    def _make_response(self, req) -> Optional[coap.Packet]:
         if req.type != coap.Type.CONFIRMABLE:
-            return
+            return None
 
         if req.code.cls == 0:
             if req.code != coap.Code.REQ_GET:
-                self._server.send(Lwm2mErrorResponse.matching(req)(
-                    code=coap.Code.RES_METHOD_NOT_ALLOWED).fill_placeholders())
-                return
+                return Lwm2mErrorResponse.matching(req)(
+                    code=coap.Code.RES_METHOD_NOT_ALLOWED).fill_placeholders()
         else:
-            self._server.send(Lwm2mReset.matching(req).fill_placeholders())
-            return
+            return Lwm2mReset.matching(req)().fill_placeholders()
 
         # Confirmable GET request
         path = req.get_uri_path()
         if path not in self._resources:
-            self._server.send(Lwm2mErrorResponse.matching(req)(
-                code=coap.Code.RES_NOT_FOUND).fill_placeholders())
-            return
+            return Lwm2mErrorResponse.matching(req)(
+                code=coap.Code.RES_NOT_FOUND).fill_placeholders()
 
         # CON GET to a known path
         block2 = req.get_options(coap.Option.BLOCK2)
@@ -114,37 +167,237 @@ class CoapFileServer:
                                         block_size=block2.block_size())
         content = resource.data[data_offset:data_offset + block2.block_size()]
 
-        self._server.send(Lwm2mContent.matching(req)(content=content,
-                                                     options=[res_block2, coap.Option.ETAG(resource.etag)]))
+        return Lwm2mContent.matching(req)(content=content,
+                                          options=[res_block2, coap.Option.ETAG(resource.etag)])
+
+    def handle_recvd_request(self, req):
+        self.requests.append(req)
 
+        if self.should_ignore_request(req):
+            return
+
+        response = self._make_response(req)
+        if response is not None:
+            self._server.send(response)
 
     def handle_request(self, timeout_s=5.0):
         self.handle_recvd_request(self._recv_request(timeout_s=timeout_s))
 
 
+class FileClient:
+    """
+    Per-peer state and statistics of a MultiClientCoapFileServer.
+    """
+
+    def __init__(self, addr, now: float):
+        self.addr = addr
+        self.first_request_at = now
+        self.last_request_at = now
+        self.requests = 0
+        self.retransmissions = 0
+        self.blocks_sent = 0
+        self.bytes_sent = 0
+        # path -> next Block2 number expected from this peer
+        self.next_block = {}  # type: Dict[str, int]
+        self.out_of_order_blocks = 0
+        # (msg_id, serialized response) of the last Confirmable request, so
+        # that its retransmissions are answered without re-encoding
+        self.last_exchange = None  # type: Optional[Tuple[int, bytes]]
+
+    def __repr__(self):
+        return 'FileClient(%r, blocks_sent=%d, bytes_sent=%d)' % (
+            self.addr, self.blocks_sent, self.bytes_sent)
+
+    def throughput(self) -> float:
+        """
+        Average payload bytes per second sent to this peer so far.
+        """
+        elapsed = self.last_request_at - self.first_request_at
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+
+class MultiClientCoapFileServer(CoapFileServer):
+    """
+    CoapFileServer that serves any number of clients downloading at the same
+    time from a single unconnected UDP socket, e.g. to simulate a firmware
+    distribution point. Resources are shared by all clients; Block2 progress,
+    retransmission handling and statistics are tracked per peer in CLIENTS.
+
+    Only plain CoAP is supported: a DTLS session is bound to a single peer.
+    Requests are not recorded in REQUESTS unless RECORD_REQUESTS is set, as
+    there may be millions of them.
+    """
+
+    # maximum number of datagrams handled by a single handle_request() call
+    BATCH_SIZE = 64
+
+    def __init__(self, coap_server: coap.Server = None, binding='U',
+                 record_requests=False):
+        coap_server = coap_server or coap.Server()
+        if isinstance(coap_server, coap.DtlsServer):
+            raise ValueError('DTLS is not supported by MultiClientCoapFileServer')
+        super().__init__(coap_server, binding)
+        self.record_requests = record_requests
+        self.clients = {}  # type: Dict[Tuple[str, int], FileClient]
+        self.blocks_sent = 0
+        self.bytes_sent = 0
+        self.started_at = None
+
+    def throughput(self) -> float:
+        """
+        Average payload bytes per second sent to all clients so far.
+        """
+        if self.started_at is None or not self.clients:
+            return 0.0
+        elapsed = max(client.last_request_at for client in self.clients.values()) - self.started_at
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def forget_idle_clients(self, max_idle_s: float) -> None:
+        now = time.monotonic()
+        for addr, client in list(self.clients.items()):
+            if now - client.last_request_at > max_idle_s:
+                del self.clients[addr]
+
+    def _handle_datagram(self, data: bytes, addr) -> None:
+        now = time.monotonic()
+        if self.started_at is None:
+            self.started_at = now
+        client = self.clients.get(addr)
+        if client is None:
+            client = self.clients[addr] = FileClient(addr, now)
+        client.last_request_at = now
+        client.requests += 1
+
+        try:
+            req = coap.Packet.parse(data)
+        except (ValueError, IndexError, struct.error):
+            return
+
+        if self.record_requests:
+            self.requests.append(req)
+        if self.should_ignore_request(req):
+            return
+
+        sock = self._server._raw_udp_socket
+        if (req.type == coap.Type.CONFIRMABLE and client.last_exchange is not None
+                and client.last_exchange[0] == req.msg_id):
+            client.retransmissions += 1
+            sock.sendto(client.last_exchange[1], addr)
+            return
+
+        response = self._make_response(req)
+        if response is None:
+            return
+
+        serialized = response.fill_placeholders().serialize()
+        if req.type == coap.Type.CONFIRMABLE:
+            client.last_exchange = (req.msg_id, serialized)
+        sock.sendto(serialized, addr)
+
+        if response.code == coap.Code.RES_CONTENT:
+            path = req.get_uri_path()
+            seq_num = response.get_options(coap.Option.BLOCK2)[0].seq_num()
+            if seq_num != client.next_block.get(path, 0):
+                client.out_of_order_blocks += 1
+            client.next_block[path] = seq_num + 1
+            client.blocks_sent += 1
+            client.bytes_sent += len(response.content)
+            self.blocks_sent += 1
+            self.bytes_sent += len(response.content)
+
+    def handle_request(self, timeout_s=5.0):
+        """
+        Waits up to TIMEOUT_S for a request, then handles it together with
+        up to BATCH_SIZE - 1 more that are already queued on the socket.
+        """
+        sock = self._server._raw_udp_socket
+        orig_timeout_s = sock.gettimeout()
+        try:
+            sock.settimeout(timeout_s)
+            data, addr = sock.recvfrom(65536)
+            self._handle_datagram(data, addr)
+
+            sock.setblocking(False)
+            for _ in range(self.BATCH_SIZE - 1):
+                try:
+                    data, addr = sock.recvfrom(65536)
+                except BlockingIOError:
+                    break
+                self._handle_datagram(data, addr)
+        finally:
+            sock.settimeout(orig_timeout_s)
+
+
 class CoapFileServerThread(threading.Thread):
-    def __init__(self, coap_server: coap.Server = None):
+    """
+    Runs a CoapFileServer in the background. The thread sleeps in a selector
+    until the server socket becomes readable, and only then takes the mutex
+    to handle the request, so requests are answered as soon as they arrive
+    and the file_server context manager is never blocked by an idle wait.
+    """
+
+    def __init__(self, coap_server: coap.Server = None,
+                 file_server: CoapFileServer = None):
         super().__init__()
 
         self._mutex = threading.RLock()
-        self._file_server = CoapFileServer(coap_server or coap.Server())
+        self._file_server = file_server or CoapFileServer(coap_server or coap.Server())
         self._shutdown = False
+        # written to whenever the loop needs to re-check its state, e.g.
+        # because the server socket was replaced by reset()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+
+    def _wake_up(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # already pending
+
+    def _server_socket(self):
+        with self._mutex:
+            server = self._file_server._server
+            return server._raw_udp_socket if server.socket is not None else None
 
     def run(self):
-        while not self._shutdown:
-            try:
-                with self._mutex:
-                    self._file_server.handle_request()
-            except socket.timeout:
-                pass
-            time.sleep(0.01)  # yield to the scheduler
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wakeup_recv, selectors.EVENT_READ)
+            registered_sock = None
+
+            while not self._shutdown:
+                sock = self._server_socket()
+                if sock is not registered_sock:
+                    if registered_sock is not None:
+                        with contextlib.suppress(KeyError, ValueError):
+                            selector.unregister(registered_sock)
+                    registered_sock = None
+                    if sock is not None and sock.fileno() >= 0:
+                        selector.register(sock, selectors.EVENT_READ)
+                        registered_sock = sock
+
+                for key, _ in selector.select():
+                    if key.fileobj is self._wakeup_recv:
+                        with contextlib.suppress(BlockingIOError):
+                            self._wakeup_recv.recv(4096)
+                    elif not self._shutdown:
+                        try:
+                            with self._mutex:
+                                self._file_server.handle_request()
+                        except socket.timeout:
+                            pass
 
     def join(self):
         self._shutdown = True
+        self._wake_up()
         super().join()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
 
     @property
     @contextlib.contextmanager
     def file_server(self):
-        with self._mutex:
-            yield self._file_server
+        try:
+            with self._mutex:
+                yield self._file_server
+        finally:
+            self._wake_up()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import http
+import http.server
+import os
+import re
+import socketserver
+import ssl
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# amount of data sent at once when throttling or sending in-memory resources
+CHUNK_SIZE = 64 * 1024
+
+HttpRequest = collections.namedtuple('HttpRequest', ('path', 'headers', 'status', 'range'))
+HttpRequest.__doc__ = """
+Request received by FirmwareHttpServer. RANGE is the (first, last) byte
+range requested with a Range header, or None.
+"""
+
+
+class FirmwareResource:
+    """
+    Content served by FirmwareHttpServer: either in-memory DATA or the file
+    FILENAME, which is sent with sendfile() straight from the page cache.
+    The strong ETag is computed once, when the resource is created.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, filename: Optional[str] = None,
+                 etag: Optional[str] = None,
+                 content_type: str = 'application/octet-stream'):
+        if (data is None) == (filename is None):
+            raise ValueError('exactly one of data and filename must be given')
+
+        self.data = memoryview(data) if data is not None else None
+        self.filename = filename
+        self.content_type = content_type
+        if filename is not None:
+            self.size = os.stat(filename).st_size
+        else:
+            self.size = len(self.data)
+        self.etag = etag if etag is not None else '"%d"' % (self._crc32(),)
+
+    def _crc32(self) -> int:
+        if self.data is not None:
+            return zlib.crc32(self.data)
+        crc = 0
+        with open(self.filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+        return crc
+
+
+class _Fault:
+    def __init__(self, after_bytes: int, cut: bool):
+        self.after_bytes = after_bytes
+        self.cut = cut
+
+
+class FirmwareRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args, **kwargs):
+        # don't display logs
+        pass
+
+    def _parse_range(self, size: int) -> Optional[Tuple[int, int]]:
+        match = re.fullmatch(r'bytes=([0-9]*)-([0-9]*)', self.headers['Range'].strip())
+        if match is None or not (match.group(1) or match.group(2)):
+            raise ValueError('unsupported Range: %s' % (self.headers['Range'],))
+        if not match.group(1):
+            # suffix range: last N bytes
+            first = max(size - int(match.group(2)), 0)
+            last = size - 1
+        else:
+            first = int(match.group(1))
+            last = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if first >= size or first > last:
+            raise IndexError('range not satisfiable')
+        return first, last
+
+    def _finish_request(self, status: int, byte_range=None) -> None:
+        self.server.record(HttpRequest(self.path, self.headers, status, byte_range))
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        server = self.server
+        resource = server.get_resource(self.path)
+        if resource is None:
+            self.send_error(http.HTTPStatus.NOT_FOUND)
+            return self._finish_request(http.HTTPStatus.NOT_FOUND)
+
+        if_match = self.headers['If-Match']
+        if if_match is not None and if_match.strip() not in ('*', resource.etag):
+            self.send_error(http.HTTPStatus.PRECONDITION_FAILED)
+            return self._finish_request(http.HTTPStatus.PRECONDITION_FAILED)
+
+        first, last = 0, resource.size - 1
+        byte_range = None
+        if self.headers['Range'] is not None:
+            try:
+                byte_range = first, last = self._parse_range(resource.size)
+            except ValueError:
+                # RFC 7233, 3.1: an unsupported Range is ignored
+                pass
+            except IndexError:
+                self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', 'bytes */%d' % (resource.size,))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return self._finish_request(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        status = http.HTTPStatus.PARTIAL_CONTENT if byte_range else http.HTTPStatus.OK
+        self.send_response(status)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('ETag', resource.etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, resource.size))
+        self.end_headers()
+        self._finish_request(status, byte_range)
+
+        if send_body:
+            self.wfile.flush()
+            self._send_body(resource, first, last + 1, server.take_fault())
+
+    def _send_body(self, resource: FirmwareResource, offset: int, end: int,
+                   fault: Optional[_Fault]) -> None:
+        server = self.server
+        limit = end
+        if fault is not None:
+            limit = min(end, offset + fault.after_bytes)
+
+        started_at = time.monotonic()
+        sent = 0
+        with open(resource.filename, 'rb') if resource.filename else _nullcontext() as f:
+            while offset < limit:
+                count = limit - offset
+                if server.bytes_per_s is not None:
+                    count = min(count, CHUNK_SIZE)
+                if f is not None:
+                    # uses os.sendfile() for plain TCP sockets
+                    count = self.connection.sendfile(f, offset, count)
+                    if not count:
+                        break
+                else:
+                    self.connection.sendall(resource.data[offset:offset + count])
+                offset += count
+                sent += count
+                server.add_bytes_sent(count)
+
+                if server.bytes_per_s is not None:
+                    delay = started_at + sent / server.bytes_per_s - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+        if fault is not None and offset < end:
+            server.on_fault(fault)
+            if not fault.cut:
+                # stall until released, then finish the response
+                server.wait_for_release()
+                self._send_body(resource, offset, end, None)
+                return
+            self.close_connection = True
+
+
+# contextlib.nullcontext() is only available since Python 3.7
+class _nullcontext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *_):
+        return False
+
+
+class FirmwareHttpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Threaded HTTP(S) server for firmware packages and other downloads.
+
+    Each connection is handled in its own thread. Files are sent with
+    socket.sendfile() (os.sendfile() on plain connections). Range requests
+    (including resumption with If-Match) are supported; a mismatching
+    If-Match yields 412 Precondition Failed.
+
+    Downloads can be slowed down (BYTES_PER_S, applied to each response) or
+    interrupted deterministically: cut_next_after() closes the connection
+    after a given number of body bytes of the next response, and
+    stall_next_after() stops sending until release() is called, which makes
+    it possible to e.g. restart the client while it is guaranteed to be in
+    the middle of a download, without relying on timing.
+
+    If CERTFILE and KEYFILE are given, HTTPS is used.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, listen_port: int = 0, certfile: Optional[str] = None,
+                 keyfile: Optional[str] = None, bytes_per_s: Optional[float] = None):
+        super().__init__(('', listen_port), FirmwareRequestHandler)
+        self.use_tls = certfile is not None
+        if self.use_tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+
+        self.bytes_per_s = bytes_per_s
+        self.requests = []  # type: List[HttpRequest]
+        self.bytes_sent = 0
+
+        self._lock = threading.Lock()
+        self._resources = {}  # type: Dict[str, FirmwareResource]
+        self._faults = collections.deque()
+        self._fault_hit = threading.Event()
+        self._released = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.release()
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients disconnecting in the middle of a download are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def get_uri(self, path: str) -> str:
+        return '%s://127.0.0.1:%d%s' % ('https' if self.use_tls else 'http',
+                                        self.server_address[1], path)
+
+    def set_resource(self, path: str, data: Optional[bytes] = None,
+                     filename: Optional[str] = None, etag: Optional[str] = None,
+                     **kwargs) -> str:
+        """
+        Serves DATA or the contents of FILENAME at PATH and returns its URI.
+        Passing neither removes the resource.
+        """
+        with self._lock:
+            if data is None and filename is None:
+                del self._resources[path]
+                return self.get_uri(path)
+            resource = FirmwareResource(data=data, filename=filename, etag=etag, **kwargs)
+            self._resources[path] = resource
+        return self.get_uri(path)
+
+    def get_resource(self, path: str) -> Optional[FirmwareResource]:
+        with self._lock:
+            return self._resources.get(path)
+
+    def record(self, request: HttpRequest) -> None:
+        with self._lock:
+            self.requests.append(request)
+
+    def add_bytes_sent(self, count: int) -> None:
+        with self._lock:
+            self.bytes_sent += count
+
+    def cut_next_after(self, num_bytes: int) -> None:
+        with self._lock:
+            self._faults.append(_Fault(num_bytes, cut=True))
+
+    def stall_next_after(self, num_bytes: int) -> None:
+        with self._lock:
+            self._released.clear()
+            self._faults.append(_Fault(num_bytes, cut=False))
+
+    def take_fault(self) -> Optional[_Fault]:
+        with self._lock:
+            return self._faults.popleft() if self._faults else None
+
+    def on_fault(self, fault: _Fault) -> None:
+        self._fault_hit.set()
+
+    def wait_for_fault(self, timeout_s: Optional[float] = None) -> bool:
+        """
+        Waits until a response is cut or stalled, and returns False if that
+        did not happen within TIMEOUT_S.
+        """
+        hit = self._fault_hit.wait(timeout_s)
+        self._fault_hit.clear()
+        return hit
+
+    def release(self) -> None:
+        """
+        Lets stalled responses continue.
+        """
+        self._released.set()
+
+    def wait_for_release(self) -> None:
+        self._released.wait()
@@ -16,8 +16,17 @@
 
 import binascii
 import enum
+import io
+import mmap
+import os
+import shutil
 import struct
-from typing import Optional
+import tempfile
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
+
+# amount of data processed at once by the streaming functions
+CHUNK_SIZE = 1024 * 1024
+HEADER_SIZE = struct.calcsize('>8sHHI')
 
 
 @enum.unique
@@ -32,18 +41,139 @@ class FirmwareUpdateForcedError(enum.IntEnum):
     DoNothing = 7
 
 
+def make_firmware_header(crc: int,
+                         magic: bytes = b'ANJAY_FW',
+                         force_error: FirmwareUpdateForcedError = FirmwareUpdateForcedError.NoError,
+                         version: int = 1) -> bytes:
+    assert len(magic) == 8
+    return struct.pack('>8sHHI', magic, version, force_error, crc)
+
+
 def make_firmware_package(binary: bytes,
                           magic: bytes = b'ANJAY_FW',
                           crc: Optional[int] = None,
                           force_error: FirmwareUpdateForcedError = FirmwareUpdateForcedError.NoError,
                           version: int = 1):
-    assert len(magic) == 8
-
     if crc is None:
         crc = binascii.crc32(binary)
 
-    meta = struct.pack('>8sHHI', magic, version, force_error, crc)
-    return meta + binary
+    return make_firmware_header(crc, magic, force_error, version) + binary
+
+
+def iter_file_chunks(in_file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    return iter(lambda: in_file.read(chunk_size), b'')
+
+
+def filler_chunks(size: int, line: bytes = b'#' * 79 + b'\n',
+                  chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields SIZE bytes made of repeated LINEs (comment lines by default, so
+    that the result can be appended to a shell script), in chunks of at
+    most CHUNK_SIZE bytes.
+    """
+    block = line * max(chunk_size // len(line), 1)
+    while size > 0:
+        chunk = block[:size]
+        yield chunk
+        size -= len(chunk)
+
+
+def _is_seekable(f) -> bool:
+    try:
+        return f.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _crc32_of_file(in_file: BinaryIO) -> int:
+    size = os.fstat(in_file.fileno()).st_size - in_file.tell()
+    if size <= 0:
+        return binascii.crc32(b'')
+    with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        crc = 0
+        data = memoryview(view)
+        try:
+            for offset in range(in_file.tell(), len(data), CHUNK_SIZE):
+                crc = binascii.crc32(data[offset:offset + CHUNK_SIZE], crc)
+        finally:
+            data.release()
+        return crc
+
+
+def write_firmware_package(out_file: BinaryIO,
+                           binary: Union[bytes, BinaryIO, Iterable[bytes]],
+                           magic: bytes = b'ANJAY_FW',
+                           crc: Optional[int] = None,
+                           force_error: FirmwareUpdateForcedError = FirmwareUpdateForcedError.NoError,
+                           version: int = 1) -> int:
+    """
+    Streaming version of make_firmware_package(): writes the package to
+    OUT_FILE without keeping the whole BINARY in memory. BINARY may be
+    a bytes object, a binary file or an iterable of byte chunks. Returns the
+    CRC written to the header.
+
+    If CRC is not given, it is computed incrementally, and the header is
+    written in one of the following ways:
+
+    - if OUT_FILE is seekable, a placeholder is written first and replaced
+      once all data was written,
+    - otherwise, if BINARY is a regular file, its CRC is computed in a first
+      pass over a memory mapping of it,
+    - otherwise, the data is spooled to a temporary file while its CRC is
+      computed.
+    """
+    if isinstance(binary, (bytes, bytearray, memoryview)):
+        binary = [binary]
+    elif isinstance(binary, io.IOBase):
+        if crc is None and not _is_seekable(out_file) and _is_seekable(binary):
+            try:
+                crc = _crc32_of_file(binary)
+            except (OSError, ValueError, io.UnsupportedOperation):
+                # not a regular file after all
+                pass
+        binary = iter_file_chunks(binary)
+
+    if crc is not None:
+        out_file.write(make_firmware_header(crc, magic, force_error, version))
+        for chunk in binary:
+            out_file.write(chunk)
+        return crc
+
+    if _is_seekable(out_file):
+        start = out_file.tell()
+        out_file.write(b'\0' * HEADER_SIZE)
+        crc = 0
+        for chunk in binary:
+            crc = binascii.crc32(chunk, crc)
+            out_file.write(chunk)
+        end = out_file.tell()
+        out_file.seek(start)
+        out_file.write(make_firmware_header(crc, magic, force_error, version))
+        out_file.seek(end)
+        return crc
+
+    with tempfile.TemporaryFile() as spool:
+        crc = 0
+        for chunk in binary:
+            crc = binascii.crc32(chunk, crc)
+            spool.write(chunk)
+        spool.seek(0)
+        out_file.write(make_firmware_header(crc, magic, force_error, version))
+        out_file.flush()
+        shutil.copyfileobj(spool, out_file, CHUNK_SIZE)
+    return crc
+
+
+def make_firmware_package_file(path: str,
+                               binary: Union[bytes, BinaryIO, Iterable[bytes]],
+                               **kwargs) -> int:
+    """
+    Writes a firmware package with BINARY to a file at PATH (see
+    write_firmware_package() for KWARGS). Packages of any size can be
+    created this way, e.g. with BINARY generated by filler_chunks().
+    """
+    with open(path, 'wb') as out_file:
+        return write_firmware_package(out_file, binary, **kwargs)
 
 
 if __name__ == '__main__':
@@ -73,13 +203,25 @@ if __name__ == '__main__':
                         type=int,
                         help='Set firmware package version.',
                         default=1)
+    parser.add_argument('-p', '--pad',
+                        type=int,
+                        help='Append given number of bytes of shell comment lines to the input.',
+                        default=0)
 
     args = parser.parse_args()
     args.force_error = FirmwareUpdateForcedError.__members__[args.force_error]
 
     with open(args.in_file, 'rb') as in_file, open(args.out_file, 'wb') as out_file:
-        out_file.write(make_firmware_package(in_file.read(),
-                                             magic=args.magic.encode('ascii'),
-                                             crc=args.crc,
-                                             force_error=args.force_error,
-                                             version=args.version))
+        binary = in_file
+        if args.pad:
+            def padded():
+                yield from iter_file_chunks(in_file)
+                yield from filler_chunks(args.pad)
+
+            binary = padded()
+
+        write_firmware_package(out_file, binary,
+                               magic=args.magic.encode('ascii'),
+                               crc=args.crc,
+                               force_error=args.force_error,
+                               version=args.version)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+from typing import Callable, List, Optional
+
+from . import coap
+from .coap.packet import ANY
+from .messages import get_lwm2m_msg, Lwm2mMsg
+
+DEFAULT_BLOCK_SIZE = 1024
+
+# options that describe a single block rather than the whole request
+_PER_BLOCK_OPTIONS = (coap.Option.BLOCK1, coap.Option.BLOCK2,
+                      coap.Option.SIZE1, coap.Option.SIZE2)
+
+
+def _strip_options(options, *to_strip):
+    return [opt for opt in options
+            if not any(opt.matches(s) for s in to_strip)]
+
+
+def _get_block_option(pkt: coap.Packet, option) -> Optional[coap.Option]:
+    opts = pkt.get_options(option)
+    return opts[0] if opts else None
+
+
+def _is_success(msg: coap.Packet) -> bool:
+    return msg.code.cls == 2
+
+
+class BlockwiseTransfer:
+    """
+    Performs a single block-wise exchange (RFC 7959) of REQUEST:
+
+    - if the request content is larger than BLOCK_SIZE, it is split into
+      a sequence of Block1 requests; if the peer answers with a smaller block
+      size, the remaining data is sent using that size,
+    - if the response carries a Block2 option with the M bit set, the rest of
+      the response is retrieved block by block and reassembled. If
+      BLOCK_SIZE is given explicitly, it is also used to request a preferred
+      Block2 size in the first request. If CHECK_ETAG is set, all blocks must
+      carry the same ETag as the first one, otherwise ValueError is raised.
+
+    WINDOW is the maximum number of block requests in flight. The default of 1
+    means strictly sequential transfer, which is what Anjay expects - it
+    rejects any block other than the next one (see block_write.py and
+    block_response.py). Larger windows are useful with peers that can handle
+    blocks out of order; when the peer includes Size2 in the first Block2
+    response, no requests past the end of the resource are made.
+
+    SUBMIT is a function that sends a request and returns a Future resolved
+    with its response, e.g. Lwm2mServer.request_async. WAIT is a function
+    that waits for a list of such Futures, e.g. Lwm2mServer.gather. CANCEL,
+    if given, is called with requests whose responses are no longer needed,
+    e.g. Lwm2mServer.cancel_request; these are block requests still in flight
+    when the transfer ends, or sent with a block size the peer changed.
+    """
+
+    def __init__(self, submit: Callable, wait: Callable,
+                 block_size: Optional[int] = None,
+                 window: int = 1,
+                 check_etag: bool = True,
+                 timeout_s: Optional[float] = None,
+                 cancel: Optional[Callable] = None):
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        # validates the size early
+        coap.Option.BLOCK1(seq_num=0, has_more=False, block_size=block_size or DEFAULT_BLOCK_SIZE)
+
+        self._submit = submit
+        self._wait = wait
+        self._cancel = cancel
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.negotiate_block2 = block_size is not None
+        self.window = window
+        self.check_etag = check_etag
+        self.timeout_s = timeout_s
+
+        self.requests_sent = 0
+
+    def _request(self, pkt: coap.Packet):
+        self.requests_sent += 1
+        return self._submit(pkt)
+
+    def _result(self, future) -> Lwm2mMsg:
+        return self._wait([future], self.timeout_s)[0]
+
+    def _cancel_in_flight(self, in_flight: collections.deque) -> None:
+        while in_flight:
+            block = in_flight.popleft()[-2]
+            if self._cancel is not None:
+                self._cancel(block)
+
+    @staticmethod
+    def _make_request(template: coap.Packet, options: List[coap.Option],
+                      content: bytes) -> coap.Packet:
+        return coap.Packet(type=template.type,
+                           code=template.code,
+                           msg_id=ANY,
+                           token=ANY,
+                           options=options,
+                           content=content)
+
+    def perform(self, request: coap.Packet) -> Lwm2mMsg:
+        """
+        Performs the whole exchange and returns the final response. If the
+        response was transferred in multiple Block2 blocks, the returned
+        message is the last block received, with CONTENT replaced by the
+        reassembled payload and block-related options removed.
+
+        Any unsuccessful response (or Reset) received in the middle of the
+        transfer is returned as-is.
+        """
+        request.fill_placeholders()
+        base_options = _strip_options(request.options, *_PER_BLOCK_OPTIONS)
+
+        if len(request.content) > self.block_size:
+            response = self._send_block1(request, base_options)
+        else:
+            options = list(request.options)
+            if self.negotiate_block2 and not request.get_options(coap.Option.BLOCK2):
+                options.append(coap.Option.BLOCK2(seq_num=0, has_more=False,
+                                                  block_size=self.block_size))
+            first = self._make_request(request, options, request.content)
+            first.msg_id = request.msg_id
+            first.token = request.token
+            response = self._result(self._request(first))
+
+        block2 = _get_block_option(response, coap.Option.BLOCK2)
+        if not _is_success(response) or block2 is None or not block2.has_more():
+            return response
+
+        return self._receive_block2(request, base_options, response)
+
+    def _send_block1(self, request: coap.Packet, base_options: List[coap.Option]) -> Lwm2mMsg:
+        data = request.content
+        block_size = self.block_size
+        # (offset, length, request, future) of blocks sent, in order
+        in_flight = collections.deque()
+        send_offset = 0
+        response = None
+
+        try:
+            while send_offset < len(data) or in_flight:
+                while len(in_flight) < self.window and send_offset < len(data):
+                    chunk = data[send_offset:send_offset + block_size]
+                    has_more = send_offset + len(chunk) < len(data)
+                    block = self._make_request(
+                        request,
+                        base_options + [coap.Option.BLOCK1(seq_num=send_offset // block_size,
+                                                           has_more=has_more,
+                                                           block_size=block_size)],
+                        chunk)
+                    if send_offset == 0:
+                        block.msg_id = request.msg_id
+                        block.token = request.token
+                    in_flight.append((send_offset, len(chunk), block, self._request(block)))
+                    send_offset += len(chunk)
+
+                offset, length, _, future = in_flight[0]
+                response = self._result(future)
+                in_flight.popleft()
+                if not _is_success(response):
+                    return response
+
+                end = offset + length
+                if end < len(data):
+                    if response.code != coap.Code.RES_CONTINUE:
+                        logging.debug('block-wise transfer: peer finished Block1 transfer '
+                                      'early with %s', response.code)
+                        return response
+
+                    ack = _get_block_option(response, coap.Option.BLOCK1)
+                    if ack is not None and ack.block_size() < block_size:
+                        # RFC 7959, 2.5: the peer asked for smaller blocks; any
+                        # blocks still in flight used the old size, so resend
+                        # everything after this one
+                        logging.debug('block-wise transfer: peer requested Block1 size %d',
+                                      ack.block_size())
+                        block_size = ack.block_size()
+                        self._cancel_in_flight(in_flight)
+                        send_offset = end
+        finally:
+            self._cancel_in_flight(in_flight)
+
+        return response
+
+    def _receive_block2(self, request: coap.Packet, base_options: List[coap.Option],
+                        first: Lwm2mMsg) -> Lwm2mMsg:
+        block2 = _get_block_option(first, coap.Option.BLOCK2)
+        block_size = block2.block_size()
+        etag = first.get_options(coap.Option.ETAG)
+
+        if block2.seq_num() != 0:
+            raise ValueError('block-wise transfer: first Block2 response has seq_num %d'
+                             % (block2.seq_num(),))
+        data = bytearray(first.content)
+        expected_offset = len(first.content)
+
+        total_size = None
+        size2 = first.get_options(coap.Option.SIZE2)
+        if size2:
+            total_size = size2[0].content_to_int()
+
+        continuation_options = _strip_options(base_options, coap.Option.OBSERVE)
+
+        def make_block_request(seq_num: int, size: int):
+            return self._make_request(
+                request,
+                continuation_options + [coap.Option.BLOCK2(seq_num=seq_num, has_more=False,
+                                                           block_size=size)],
+                b'')
+
+        # (seq_num, request, future) of blocks requested, in order
+        in_flight = collections.deque()
+        next_seq = expected_offset // block_size
+        last = first
+
+        try:
+            while True:
+                # with Size2 known, do not request blocks past the end,
+                # unless the peer keeps setting the M bit anyway
+                while (len(in_flight) < self.window
+                       and (total_size is None
+                            or next_seq * block_size < total_size
+                            or not in_flight)):
+                    block = make_block_request(next_seq, block_size)
+                    in_flight.append((next_seq, block, self._request(block)))
+                    next_seq += 1
+
+                seq_num, _, future = in_flight[0]
+                response = self._result(future)
+                in_flight.popleft()
+                if not _is_success(response):
+                    return response
+
+                block2 = _get_block_option(response, coap.Option.BLOCK2)
+                if block2 is None:
+                    raise ValueError('block-wise transfer: Block2 missing in response to block %d'
+                                     % (seq_num,))
+                if self.check_etag and response.get_options(coap.Option.ETAG) != etag:
+                    raise ValueError('block-wise transfer: ETag changed in block %d' % (seq_num,))
+
+                offset = block2.seq_num() * block2.block_size()
+                if offset != expected_offset:
+                    raise ValueError('block-wise transfer: expected data at offset %d, got %d'
+                                     % (expected_offset, offset))
+
+                data += response.content
+                expected_offset += len(response.content)
+                last = response
+
+                if not block2.has_more():
+                    # any requests still in flight are past the end of the
+                    # resource, and are cancelled below
+                    break
+
+                if block2.block_size() != block_size:
+                    block_size = block2.block_size()
+                    self._cancel_in_flight(in_flight)
+                    next_seq = expected_offset // block_size
+        finally:
+            self._cancel_in_flight(in_flight)
+
+        return get_lwm2m_msg(coap.Packet(type=last.type,
+                                         code=last.code,
+                                         msg_id=last.msg_id,
+                                         token=last.token,
+                                         options=_strip_options(last.options, *_PER_BLOCK_OPTIONS),
+                                         content=bytes(data)))
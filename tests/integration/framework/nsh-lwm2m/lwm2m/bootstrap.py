@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import collections
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+from . import coap
+from .messages import Lwm2mBootstrapFinish, Lwm2mDelete, Lwm2mMsg, Lwm2mWrite
+from .pump import gather
+from .tlv import TLV
+
+ResourceValue = Union[int, float, str, bytes]
+
+# maximum number of encoded device-specific values remembered per profile
+DEFAULT_VALUE_CACHE_SIZE = 1024
+
+
+class DeviceField:
+    """
+    Placeholder for a device-specific Resource value in a BootstrapProfile,
+    e.g. PSK identity, key or Server URI. NAME is the keyword argument used
+    to provide the value; DEFAULT, if not None, is used when it is missing.
+    """
+
+    def __init__(self, name: str, default: Optional[ResourceValue] = None):
+        self.name = name
+        self.default = default
+
+    def __repr__(self):
+        return 'DeviceField(%r)' % (self.name,)
+
+    def resolve(self, values: Dict[str, ResourceValue]) -> ResourceValue:
+        value = values.get(self.name, self.default)
+        if value is None:
+            raise ValueError('no value for device field %r' % (self.name,))
+        return value
+
+
+def _senml_record(name: str, value: ResourceValue) -> bytes:
+    record = collections.OrderedDict(n=name)
+    if isinstance(value, bool):
+        record['vb'] = value
+    elif isinstance(value, (int, float)):
+        record['v'] = value
+    elif isinstance(value, str):
+        record['vs'] = value
+    elif isinstance(value, bytes):
+        record['vd'] = base64.urlsafe_b64encode(value).rstrip(b'=').decode('ascii')
+    else:
+        raise ValueError('Unsupported resource value type: ' + type(value).__name__)
+    return json.dumps(record, separators=(',', ':')).encode('ascii')
+
+
+class _CompiledWrite:
+    """
+    Write payload split into SEGMENTS: byte strings that are the same for
+    every device, and (Resource ID, DeviceField) pairs that are encoded for
+    each device separately and spliced in between.
+    """
+
+    def __init__(self, path: str, segments: list, separator: bytes,
+                 prefix: bytes, suffix: bytes):
+        self.path = path
+        self.segments = segments
+        self.separator = separator
+        self.prefix = prefix
+        self.suffix = suffix
+
+
+class BootstrapProfile:
+    """
+    Provisioning profile: the sequence of Bootstrap-Delete and
+    Bootstrap-Write operations performed on every device, followed by
+    Bootstrap-Finish. Resource values may be DeviceField placeholders.
+
+    Payloads are encoded in CONTENT_FORMAT (LwM2M TLV or SenML JSON) once,
+    the first time the profile is used. Later, only the DeviceField values
+    are encoded for each device and spliced into the precompiled payloads;
+    encoded values are cached as well, so that values shared by many
+    devices (such as the Server URI) are encoded only once.
+    """
+
+    def __init__(self, content_format: int = coap.ContentFormat.APPLICATION_LWM2M_TLV,
+                 finish: bool = True,
+                 value_cache_size: int = DEFAULT_VALUE_CACHE_SIZE):
+        if content_format not in (coap.ContentFormat.APPLICATION_LWM2M_TLV,
+                                  coap.ContentFormat.APPLICATION_LWM2M_SENML_JSON):
+            raise ValueError('unsupported content format: %d' % (content_format,))
+
+        self.content_format = content_format
+        self.finish = finish
+        self.value_cache_size = value_cache_size
+        # ('delete', path) or ('write', path, [(rid, value)])
+        self._operations = []  # type: List[tuple]
+        self._compiled = None  # type: Optional[List[Union[str, _CompiledWrite]]]
+        self._value_cache = collections.OrderedDict()  # type: Dict[tuple, bytes]
+
+    @property
+    def fields(self) -> List[str]:
+        """
+        Names of all DeviceField placeholders used in the profile.
+        """
+        names = []
+        for op in self._operations:
+            if op[0] == 'write':
+                for _, value in op[2]:
+                    if isinstance(value, DeviceField) and value.name not in names:
+                        names.append(value.name)
+        return names
+
+    def delete(self, path: str = '/') -> 'BootstrapProfile':
+        self._operations.append(('delete', path))
+        self._compiled = None
+        return self
+
+    def write(self, oid: int, iid: int,
+              resources: Union[Dict[int, ResourceValue], List[Tuple[int, ResourceValue]]]) \
+            -> 'BootstrapProfile':
+        """
+        Adds a Bootstrap-Write of Object Instance /OID/IID. RESOURCES maps
+        Resource IDs to values or DeviceField placeholders; Resources are
+        encoded in the given order.
+        """
+        if isinstance(resources, dict):
+            resources = list(resources.items())
+        self._operations.append(('write', '/%d/%d' % (oid, iid), list(resources)))
+        self._compiled = None
+        return self
+
+    def _encode_value(self, path: str, rid: int, value: ResourceValue) -> bytes:
+        if self.content_format == coap.ContentFormat.APPLICATION_LWM2M_TLV:
+            return TLV.make_resource(rid, value).serialize()
+        return _senml_record('%s/%d' % (path, rid), value)
+
+    def _encode_cached(self, path: str, rid: int, value: ResourceValue) -> bytes:
+        key = (path, rid, type(value), value)
+        encoded = self._value_cache.get(key)
+        if encoded is None:
+            encoded = self._encode_value(path, rid, value)
+            self._value_cache[key] = encoded
+            if len(self._value_cache) > self.value_cache_size:
+                self._value_cache.popitem(last=False)
+        else:
+            self._value_cache.move_to_end(key)
+        return encoded
+
+    def _compile_write(self, path: str, resources: List[Tuple[int, ResourceValue]]) -> _CompiledWrite:
+        if self.content_format == coap.ContentFormat.APPLICATION_LWM2M_TLV:
+            separator, prefix, suffix = b'', b'', b''
+        else:
+            separator, prefix, suffix = b',', b'[', b']'
+
+        segments = []
+        static = []
+        for rid, value in resources:
+            if isinstance(value, DeviceField):
+                if static:
+                    segments.append(separator.join(static))
+                    static = []
+                segments.append((rid, value))
+            else:
+                static.append(self._encode_value(path, rid, value))
+        if static:
+            segments.append(separator.join(static))
+        return _CompiledWrite(path, segments, separator, prefix, suffix)
+
+    def compile(self) -> List[Union[str, _CompiledWrite]]:
+        """
+        Precompiles the profile. Called automatically on first use; calling
+        it explicitly moves the cost out of the provisioning loop.
+        """
+        if self._compiled is None:
+            compiled = []
+            for op in self._operations:
+                if op[0] == 'delete':
+                    compiled.append(op[1])
+                else:
+                    compiled.append(self._compile_write(op[1], op[2]))
+            self._compiled = compiled
+        return self._compiled
+
+    def _render(self, compiled: _CompiledWrite, values: Dict[str, ResourceValue]) -> bytes:
+        parts = []
+        for segment in compiled.segments:
+            if isinstance(segment, bytes):
+                parts.append(segment)
+            else:
+                rid, field = segment
+                parts.append(self._encode_cached(compiled.path, rid, field.resolve(values)))
+        return compiled.prefix + compiled.separator.join(parts) + compiled.suffix
+
+    def requests(self, **values: ResourceValue) -> List[Lwm2mMsg]:
+        """
+        Returns the requests that provision a device with given VALUES of
+        DeviceField placeholders, in the order they should be performed.
+        """
+        requests = []
+        for op in self.compile():
+            if isinstance(op, str):
+                requests.append(Lwm2mDelete(op))
+            else:
+                requests.append(Lwm2mWrite(op.path, self._render(op, values),
+                                           format=self.content_format))
+        if self.finish:
+            requests.append(Lwm2mBootstrapFinish())
+        return requests
+
+
+class BootstrapError(ValueError):
+    def __init__(self, request: Lwm2mMsg, response: Lwm2mMsg):
+        super().__init__('%s failed: %s' % (request.summary(), response.summary()))
+        self.request = request
+        self.response = response
+
+
+class BootstrapEngine:
+    """
+    Performs BootstrapProfile sequences using SERVER (an Lwm2mServer the
+    client requested Bootstrap from).
+
+    Requests are pipelined: up to WINDOW of them (all by default) are in
+    flight at once. They are still sent in order, and the client handles
+    them in order, so e.g. a Delete of / is performed before the Writes
+    that follow it. Bootstrap-Finish is only sent once all preceding
+    requests succeeded.
+    """
+
+    def __init__(self, server, window: Optional[int] = None,
+                 timeout_s: Optional[float] = -1):
+        if window is not None and window < 1:
+            raise ValueError('window must be at least 1')
+        self.server = server
+        self.window = window
+        self.timeout_s = timeout_s
+
+    def _timeout(self) -> Optional[float]:
+        if self.timeout_s is not None and self.timeout_s < 0:
+            return self.server.get_timeout()
+        return self.timeout_s
+
+    def provision(self, profile: BootstrapProfile, check: bool = True,
+                  **values: ResourceValue) -> List[Lwm2mMsg]:
+        """
+        Provisions the device with PROFILE and returns responses to all
+        requests sent. If CHECK is set, BootstrapError is raised on the
+        first unsuccessful response; otherwise the sequence is stopped
+        before Bootstrap-Finish and responses received so far are returned.
+        """
+        requests = profile.requests(**values)
+        timeout_s = self._timeout()
+        window = self.window or len(requests)
+
+        futures = collections.deque()
+        responses = []
+
+        def collect(count: int) -> bool:
+            for _ in range(count):
+                request, future = futures.popleft()
+                response = gather([future], timeout_s)[0]
+                responses.append(response)
+                if response.code.cls != 2:
+                    for pending_request, _ in futures:
+                        self.server.cancel_request(pending_request)
+                    futures.clear()
+                    if check:
+                        raise BootstrapError(request, response)
+                    return False
+            return True
+
+        for request in requests:
+            if isinstance(request, Lwm2mBootstrapFinish):
+                # only finish once everything else is confirmed
+                if not collect(len(futures)):
+                    return responses
+            elif len(futures) >= window and not collect(1):
+                return responses
+            futures.append((request, self.server.request_async(request)))
+
+        collect(len(futures))
+        return responses
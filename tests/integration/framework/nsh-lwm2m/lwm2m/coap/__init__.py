@@ -14,21 +14,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import oscore
 from . import utils
 
 from .code import Code
 from .content_format import ContentFormat
 from .option import Option, ContentFormatOption, AcceptOption
 from .packet import Packet
-from .server import Server, DtlsServer
+from .server import Server, DtlsServer, MultiDtlsServer
 from .type import Type
 
 __all__ = [
+    'oscore',
     'utils',
     'Code',
     'ContentFormat',
     'Option', 'ContentFormatOption', 'AcceptOption',
     'Packet',
-    'Server', 'DtlsServer',
+    'Server', 'DtlsServer', 'MultiDtlsServer',
     'Type'
 ]
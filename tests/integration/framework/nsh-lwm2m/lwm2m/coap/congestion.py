@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from .code import Code
+from .packet import Packet
+from .timer_wheel import TimerWheel
+from .type import Type
+
+# MAX_TRANSMIT_WAIT for default transmission parameters, see RFC 7252, 4.8.2
+DEFAULT_MAX_TRANSMIT_WAIT_S = 93.0
+
+_QueuedMessage = collections.namedtuple('_QueuedMessage', ('packet', 'data', 'queued_at'))
+
+
+class _PeerState:
+    def __init__(self):
+        # msg_id -> (token, expiry timer) of outstanding Confirmable requests
+        self.outstanding = {}
+        self.queue = collections.deque()
+        self.next_non_at = 0.0
+        self.backoff_until = 0.0
+        self.backoff_s = None
+        self.drain_timer = None
+
+
+class CongestionControl:
+    """
+    Basic congestion control for requests sent to a single peer, as described
+    in RFC 7252, 4.7:
+
+    - at most NSTART Confirmable requests may be outstanding at any time;
+      a request stops being outstanding once an ACK, Reset or a response
+      with a matching token arrives, or after MAX_TRANSMIT_WAIT_S,
+    - Non-confirmable requests are paced so that the data rate does not
+      exceed PROBING_RATE bytes per second,
+    - after a Reset to one of our requests or an ICMP error, sending is
+      paused for a back-off period that doubles with every consecutive
+      error (starting from BACKOFF_S) and is cleared by the next response.
+
+    Messages that cannot be sent right away are queued in order and sent
+    later, from within recv(). Queue depth, time spent in the queue and the
+    number of outstanding requests are recorded for inspection.
+    """
+
+    MAX_BACKOFF_S = 64.0
+    WAIT_TIMES_HISTORY = 1024
+
+    def __init__(self,
+                 transmit: Callable[[Packet, bytes], None],
+                 timers: TimerWheel,
+                 nstart: int = 1,
+                 probing_rate: float = 1.0,
+                 max_transmit_wait_s: float = DEFAULT_MAX_TRANSMIT_WAIT_S,
+                 backoff_s: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if nstart < 1:
+            raise ValueError('nstart must be at least 1')
+        if probing_rate <= 0:
+            raise ValueError('probing_rate must be positive')
+
+        self.nstart = nstart
+        self.probing_rate = probing_rate
+        self.max_transmit_wait_s = max_transmit_wait_s
+        self.initial_backoff_s = backoff_s
+        self._transmit = transmit
+        self._timers = timers
+        self._clock = clock
+        self._peers = {}  # type: Dict[Optional[Tuple[str, int]], _PeerState]
+
+        self.total_queued = 0
+        self.max_queue_depth = 0
+        self.max_outstanding = 0
+        self.wait_times_s = collections.deque(maxlen=self.WAIT_TIMES_HISTORY)
+
+    def _peer(self, peer) -> _PeerState:
+        state = self._peers.get(peer)
+        if state is None:
+            state = self._peers[peer] = _PeerState()
+        return state
+
+    def queue_depth(self, peer=None) -> int:
+        if peer is not None:
+            return len(self._peer(peer).queue)
+        return sum(len(state.queue) for state in self._peers.values())
+
+    def outstanding(self, peer=None) -> int:
+        if peer is not None:
+            return len(self._peer(peer).outstanding)
+        return sum(len(state.outstanding) for state in self._peers.values())
+
+    @staticmethod
+    def _is_con_request(packet: Packet) -> bool:
+        return packet.type == Type.CONFIRMABLE and packet.code.is_request()
+
+    @staticmethod
+    def _is_non_request(packet: Packet) -> bool:
+        return packet.type == Type.NON_CONFIRMABLE and packet.code.is_request()
+
+    def _can_send_now(self, state: _PeerState, packet: Packet, now: float) -> bool:
+        if now < state.backoff_until:
+            return False
+        if self._is_con_request(packet):
+            return len(state.outstanding) < self.nstart
+        return now >= state.next_non_at
+
+    def _do_transmit(self, peer, state: _PeerState, packet: Packet, data: bytes) -> None:
+        now = self._clock()
+        if self._is_con_request(packet):
+            timer = self._timers.schedule(self.max_transmit_wait_s,
+                                          lambda: self._release(peer, packet.msg_id))
+            state.outstanding[packet.msg_id] = (bytes(packet.token), timer)
+            self.max_outstanding = max(self.max_outstanding, len(state.outstanding))
+        elif self._is_non_request(packet):
+            state.next_non_at = max(now, state.next_non_at) + len(data) / self.probing_rate
+        self._transmit(packet, data)
+
+    def submit(self, peer, packet: Packet, data: bytes) -> None:
+        """
+        Sends PACKET right away if limits allow it, or queues it otherwise.
+        Only requests are subject to congestion control; responses and empty
+        messages are always sent immediately.
+        """
+        if not packet.code.is_request() or packet.type not in (Type.CONFIRMABLE,
+                                                                Type.NON_CONFIRMABLE):
+            self._transmit(packet, data)
+            return
+
+        state = self._peer(peer)
+        now = self._clock()
+
+        if not state.queue and self._can_send_now(state, packet, now):
+            self._do_transmit(peer, state, packet, data)
+            return
+
+        state.queue.append(_QueuedMessage(packet, data, now))
+        self.total_queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(state.queue))
+        logging.debug('congestion control: queued message id=%s (queue depth %d)',
+                      packet.msg_id, len(state.queue))
+        self._schedule_drain(peer, state)
+
+    def _schedule_drain(self, peer, state: _PeerState) -> None:
+        if not state.queue or state.drain_timer is not None:
+            return
+
+        wake_at = state.backoff_until
+        if self._is_non_request(state.queue[0].packet):
+            wake_at = max(wake_at, state.next_non_at)
+        if wake_at <= self._clock():
+            # waiting for an outstanding request to finish; _release() will
+            # drain the queue
+            return
+
+        def wake():
+            state.drain_timer = None
+            self._drain(peer)
+
+        state.drain_timer = self._timers.schedule_at(wake_at, wake)
+
+    def _drain(self, peer) -> None:
+        state = self._peer(peer)
+        while state.queue:
+            now = self._clock()
+            msg = state.queue[0]
+            if not self._can_send_now(state, msg.packet, now):
+                break
+            state.queue.popleft()
+            self.wait_times_s.append(now - msg.queued_at)
+            self._do_transmit(peer, state, msg.packet, msg.data)
+
+        self._schedule_drain(peer, state)
+
+    def _release(self, peer, msg_id: int) -> None:
+        state = self._peer(peer)
+        entry = state.outstanding.pop(msg_id, None)
+        if entry is not None:
+            entry[1].cancel()
+            self._drain(peer)
+
+    def _backoff(self, peer, state: _PeerState) -> None:
+        if state.backoff_s is None:
+            state.backoff_s = self.initial_backoff_s
+        else:
+            state.backoff_s = min(state.backoff_s * 2, self.MAX_BACKOFF_S)
+        state.backoff_until = self._clock() + state.backoff_s
+        logging.debug('congestion control: backing off for %.3f s', state.backoff_s)
+
+    def on_recv(self, peer, packet: Packet) -> None:
+        state = self._peer(peer)
+
+        if packet.type in (Type.ACKNOWLEDGEMENT, Type.RESET):
+            if packet.type == Type.RESET and packet.msg_id in state.outstanding:
+                self._backoff(peer, state)
+            elif packet.code != Code.EMPTY:
+                state.backoff_s = None
+            self._release(peer, packet.msg_id)
+        elif packet.code.is_response():
+            token = bytes(packet.token)
+            for msg_id, (outstanding_token, _) in list(state.outstanding.items()):
+                if outstanding_token == token:
+                    state.backoff_s = None
+                    self._release(peer, msg_id)
+                    break
+
+    def on_icmp_error(self, peer) -> None:
+        state = self._peer(peer)
+        self._backoff(peer, state)
+        self._schedule_drain(peer, state)
+
+    def reset(self) -> None:
+        for state in self._peers.values():
+            for _, timer in state.outstanding.values():
+                timer.cancel()
+            if state.drain_timer is not None:
+                state.drain_timer.cancel()
+        self._peers.clear()
@@ -326,6 +326,7 @@ Option.OBSERVE         = OptionConstructor(IntOption, 6, lambda int8: struct.pac
 Option.URI_PORT        = OptionConstructor(IntOption, 7,  lambda int16: struct.pack('!H', int16))
 Option.MAX_AGE         = OptionConstructor(IntOption, 14, lambda int32: struct.pack('!I', int32))
 Option.SIZE1           = OptionConstructor(IntOption, 60, lambda int32: struct.pack('!I', int32))
+Option.SIZE2           = OptionConstructor(IntOption, 28, lambda int32: struct.pack('!I', int32))
 
 Option.BLOCK1          = OptionConstructor(BlockOption, 27, pack_block)
 Option.BLOCK2          = OptionConstructor(BlockOption, 23, pack_block)
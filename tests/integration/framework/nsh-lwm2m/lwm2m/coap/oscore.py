@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import functools
+import hmac
+import struct
+from typing import Optional, Tuple
+
+from .code import Code
+from .option import Option
+from .packet import Packet
+
+# COSE algorithm IDs (RFC 8152) of supported AEAD algorithms, all of them
+# AES-CCM with 13-byte nonces
+AES_CCM_16_64_128 = 10
+AES_CCM_16_64_256 = 11
+AES_CCM_16_128_128 = 30
+AES_CCM_16_128_256 = 31
+
+# algorithm: (key size, tag size, nonce size)
+_AEAD_PARAMS = {
+    AES_CCM_16_64_128: (16, 8, 13),
+    AES_CCM_16_64_256: (32, 8, 13),
+    AES_CCM_16_128_128: (16, 16, 13),
+    AES_CCM_16_128_256: (32, 16, 13),
+}
+
+# COSE algorithm IDs of supported key derivation functions
+HKDF_SHA_256 = -10
+HKDF_SHA_512 = -11
+
+_HKDF_HASHES = {
+    HKDF_SHA_256: 'sha256',
+    HKDF_SHA_512: 'sha512',
+}
+
+# Class U options (RFC 8613, 4.1), left outside of the encrypted part.
+# Observe is handled separately, as it belongs to both classes.
+_OUTER_OPTION_NUMBERS = frozenset(opt.number for opt in (Option.URI_HOST,
+                                                         Option.URI_PORT,
+                                                         Option.OSCORE,
+                                                         Option.PROXY_URI,
+                                                         Option.PROXY_SCHEME))
+
+_MAX_PARTIAL_IV = 2 ** 40 - 1
+
+
+class OscoreError(ValueError):
+    """
+    Raised if a message cannot be protected, or a received one fails
+    verification.
+    """
+    pass
+
+
+def _cbor_head(major_type: int, value: int) -> bytes:
+    if value < 24:
+        return struct.pack('!B', (major_type << 5) | value)
+    elif value < 2 ** 8:
+        return struct.pack('!BB', (major_type << 5) | 24, value)
+    elif value < 2 ** 16:
+        return struct.pack('!BH', (major_type << 5) | 25, value)
+    elif value < 2 ** 32:
+        return struct.pack('!BI', (major_type << 5) | 26, value)
+    else:
+        return struct.pack('!BQ', (major_type << 5) | 27, value)
+
+
+def _cbor(value) -> bytes:
+    """
+    Encodes VALUE in CBOR. Only the types needed for OSCORE key derivation
+    and AAD are supported: None, int, bytes, str and lists of those.
+    """
+    if value is None:
+        return b'\xf6'
+    elif isinstance(value, int):
+        return _cbor_head(0, value) if value >= 0 else _cbor_head(1, -1 - value)
+    elif isinstance(value, (bytes, bytearray)):
+        return _cbor_head(2, len(value)) + bytes(value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        return _cbor_head(3, len(encoded)) + encoded
+    elif isinstance(value, (list, tuple)):
+        return _cbor_head(4, len(value)) + b''.join(_cbor(item) for item in value)
+    raise TypeError('cannot encode %r in CBOR' % (value,))
+
+
+@functools.lru_cache(maxsize=256)
+def _hkdf(hash_name: str, salt: bytes, ikm: bytes, info: bytes, length: int) -> bytes:
+    """
+    HKDF (RFC 5869). Results are cached, as every security context derives
+    the same keys again, e.g. when a test server is recreated.
+    """
+    prk = hmac.new(salt, ikm, hash_name).digest()
+    okm = b''
+    block = b''
+    counter = 1
+    while len(okm) < length:
+        block = hmac.new(prk, block + info + struct.pack('!B', counter), hash_name).digest()
+        okm += block
+        counter += 1
+    return okm[:length]
+
+
+def _encode_partial_iv(seq: int) -> bytes:
+    return seq.to_bytes(max(1, (seq.bit_length() + 7) // 8), 'big')
+
+
+def _encode_option(partial_iv: Optional[bytes], kid: Optional[bytes],
+                   kid_context: Optional[bytes]) -> bytes:
+    """
+    Encodes the value of the OSCORE option (RFC 8613, 6.1).
+    """
+    flags = 0
+    value = b''
+    if partial_iv is not None:
+        flags |= len(partial_iv)
+        value += partial_iv
+    if kid_context is not None:
+        flags |= 0x10
+        value += struct.pack('!B', len(kid_context)) + kid_context
+    if kid is not None:
+        flags |= 0x08
+        value += kid
+    if not flags:
+        return b''
+    return struct.pack('!B', flags) + value
+
+
+def _decode_option(value: bytes) -> Tuple[Optional[bytes], Optional[bytes], Optional[bytes]]:
+    """
+    Returns the (Partial IV, kid, kid context) encoded in the OSCORE option
+    VALUE; absent fields are None.
+    """
+    if not value:
+        return None, None, None
+
+    flags = value[0]
+    partial_iv_size = flags & 0x07
+    if flags & 0xE0 or partial_iv_size > 5:
+        raise OscoreError('unsupported OSCORE option flags: 0x%02x' % (flags,))
+
+    at = 1
+    partial_iv = None
+    if partial_iv_size:
+        partial_iv = bytes(value[at:at + partial_iv_size])
+        at += partial_iv_size
+
+    kid_context = None
+    if flags & 0x10:
+        if at >= len(value):
+            raise OscoreError('malformed OSCORE option')
+        kid_context_size = value[at]
+        kid_context = bytes(value[at + 1:at + 1 + kid_context_size])
+        at += 1 + kid_context_size
+
+    if at > len(value):
+        raise OscoreError('malformed OSCORE option')
+
+    kid = bytes(value[at:]) if flags & 0x08 else None
+    return partial_iv, kid, kid_context
+
+
+def _serialize_options(options) -> bytes:
+    serialized = []
+    prev_opt_number = 0
+    for opt in options:
+        serialized.append(opt.serialize(prev_opt_number))
+        prev_opt_number = opt.number
+    return b''.join(serialized)
+
+
+class ReplayWindow:
+    """
+    Sliding replay window of the sequence numbers (Partial IVs) received
+    from a peer (RFC 8613, 7.4), in a single integer bitmap: bit N is set if
+    the sequence number N less than the highest one received so far has
+    been seen. Numbers older than SIZE are rejected.
+    """
+
+    __slots__ = ('size', '_mask', '_highest', '_bitmap')
+
+    def __init__(self, size: int = 32):
+        if size <= 0:
+            raise ValueError('replay window size must be positive')
+        self.size = size
+        self._mask = (1 << size) - 1
+        self._highest = -1
+        self._bitmap = 0
+
+    def is_fresh(self, seq: int) -> bool:
+        if seq > self._highest:
+            return True
+        offset = self._highest - seq
+        return offset < self.size and not (self._bitmap >> offset) & 1
+
+    def update(self, seq: int) -> None:
+        """
+        Marks SEQ as received. Must only be called once the message has been
+        verified, so that forged messages cannot move the window.
+        """
+        if seq > self._highest:
+            self._bitmap = ((self._bitmap << (seq - self._highest)) | 1) & self._mask
+            self._highest = seq
+        else:
+            self._bitmap |= 1 << (self._highest - seq)
+
+
+class _Exchange:
+    """
+    Parameters of a protected request, needed to protect or verify the
+    responses to it.
+    """
+    __slots__ = ('kid', 'partial_iv', 'nonce', 'last_notification_seq')
+
+    def __init__(self, kid: bytes, partial_iv: bytes, nonce: bytes):
+        self.kid = kid
+        self.partial_iv = partial_iv
+        self.nonce = nonce
+        self.last_notification_seq = -1
+
+
+class SecurityContext:
+    """
+    OSCORE (RFC 8613) security context shared with a single peer.
+
+    Sender and Recipient Keys and the Common IV are derived from
+    MASTER_SECRET and MASTER_SALT once, when the context is created;
+    derivations are also cached between contexts with the same parameters.
+    Messages are encrypted and decrypted in place with pymbedtls.AesCcm.
+
+    Requests sent by us get consecutive sequence numbers as Partial IVs.
+    Requests received are checked against a replay window of
+    REPLAY_WINDOW_SIZE sequence numbers. Responses reuse the nonce of the
+    request, except for Observe notifications, which get Partial IVs of
+    their own. Parameters of the last MAX_EXCHANGES requests are kept for
+    matching responses by token.
+
+    The context does not survive restarts: sequence numbers start at 0 every
+    time, so a MASTER_SECRET must not be reused with a peer that remembers
+    them, unless ID_CONTEXT changes.
+    """
+
+    MAX_EXCHANGES = 256
+
+    def __init__(self, master_secret: bytes, sender_id: bytes, recipient_id: bytes,
+                 master_salt: bytes = b'', id_context: Optional[bytes] = None,
+                 aead_alg: int = AES_CCM_16_64_128, hkdf_alg: int = HKDF_SHA_256,
+                 replay_window_size: int = 32):
+        if aead_alg not in _AEAD_PARAMS:
+            raise ValueError('unsupported AEAD algorithm: %r' % (aead_alg,))
+        if hkdf_alg not in _HKDF_HASHES:
+            raise ValueError('unsupported HKDF algorithm: %r' % (hkdf_alg,))
+
+        key_size, tag_size, nonce_size = _AEAD_PARAMS[aead_alg]
+        if max(len(sender_id), len(recipient_id)) > nonce_size - 6:
+            raise ValueError('sender and recipient IDs must be at most %d bytes long'
+                             % (nonce_size - 6,))
+
+        try:
+            from pymbedtls import AesCcm
+        except ImportError:
+            raise ImportError('could not import pymbedtls! run '
+                              '`python3 setup.py install --user` in the '
+                              'pymbedtls/ subdirectory of nsh-lwm2m submodule '
+                              'or export PYTHONPATH properly')
+
+        self.sender_id = bytes(sender_id)
+        self.recipient_id = bytes(recipient_id)
+        self.id_context = bytes(id_context) if id_context is not None else None
+        self.aead_alg = aead_alg
+        self.nonce_size = nonce_size
+        self.tag_size = tag_size
+
+        def derive(id_: bytes, kind: str, length: int) -> bytes:
+            info = _cbor([id_, self.id_context, aead_alg, kind, length])
+            return _hkdf(_HKDF_HASHES[hkdf_alg], bytes(master_salt), bytes(master_secret),
+                         info, length)
+
+        self.sender_key = derive(self.sender_id, 'Key', key_size)
+        self.recipient_key = derive(self.recipient_id, 'Key', key_size)
+        self.common_iv = derive(b'', 'IV', nonce_size)
+
+        self._sender_aead = AesCcm(self.sender_key, tag_size)
+        self._recipient_aead = AesCcm(self.recipient_key, tag_size)
+        self.sender_seq = 0
+        self.replay_window = ReplayWindow(replay_window_size)
+        self._exchanges = collections.OrderedDict()
+
+    def _nonce(self, id_piv: bytes, partial_iv: bytes) -> bytes:
+        # RFC 8613, 5.2
+        nonce = (struct.pack('!B', len(id_piv))
+                 + id_piv.rjust(self.nonce_size - 6, b'\0')
+                 + partial_iv.rjust(5, b'\0'))
+        return (int.from_bytes(nonce, 'big')
+                ^ int.from_bytes(self.common_iv, 'big')).to_bytes(self.nonce_size, 'big')
+
+    def _aad(self, request_kid: bytes, request_piv: bytes) -> bytes:
+        # RFC 8613, 5.4; no Class I options are defined
+        external_aad = _cbor([1, [self.aead_alg], request_kid, request_piv, b''])
+        return _cbor(['Encrypt0', b'', external_aad])
+
+    def _remember(self, token: bytes, exchange: _Exchange) -> None:
+        self._exchanges[token] = exchange
+        self._exchanges.move_to_end(token)
+        while len(self._exchanges) > self.MAX_EXCHANGES:
+            self._exchanges.popitem(last=False)
+
+    def _next_partial_iv(self) -> bytes:
+        if self.sender_seq > _MAX_PARTIAL_IV:
+            raise OscoreError('sender sequence number space exhausted')
+        partial_iv = _encode_partial_iv(self.sender_seq)
+        self.sender_seq += 1
+        return partial_iv
+
+    def protect(self, pkt: Packet) -> Packet:
+        """
+        Returns the OSCORE-protected version of PKT. Empty messages (ACK,
+        Reset, ping) are returned unchanged.
+        """
+        if pkt.code == Code.EMPTY:
+            return pkt
+
+        observe = pkt.get_options(Option.OBSERVE)
+        if pkt.code.is_request():
+            partial_iv = self._next_partial_iv()
+            nonce = self._nonce(self.sender_id, partial_iv)
+            exchange = _Exchange(self.sender_id, partial_iv, nonce)
+            self._remember(bytes(pkt.token), exchange)
+            option_value = _encode_option(partial_iv, self.sender_id, self.id_context)
+            outer_code = Code.REQ_FETCH if observe else Code.REQ_POST
+            inner_options = [o for o in pkt.options if o.number not in _OUTER_OPTION_NUMBERS]
+        else:
+            exchange = self._exchanges.get(bytes(pkt.token))
+            if exchange is None:
+                raise OscoreError('no protected request with token %r' % (bytes(pkt.token),))
+            if observe:
+                # notifications must not reuse the request nonce
+                partial_iv = self._next_partial_iv()
+                nonce = self._nonce(self.sender_id, partial_iv)
+            else:
+                partial_iv = None
+                nonce = exchange.nonce
+            option_value = _encode_option(partial_iv, None, None)
+            outer_code = Code.RES_CONTENT if observe else Code.RES_CHANGED
+            inner_options = [o for o in pkt.options
+                             if o.number not in _OUTER_OPTION_NUMBERS and not o.matches(Option.OBSERVE)]
+
+        # plaintext (RFC 8613, 5.3) is encrypted in the same buffer, which
+        # has room for the tag at the end
+        buffer = bytearray(struct.pack('!B', pkt.code.as_byte()))
+        buffer += _serialize_options(inner_options)
+        if pkt.content:
+            buffer += b'\xFF'
+            buffer += pkt.content
+        plaintext_size = len(buffer)
+        buffer += bytes(self.tag_size)
+        self._sender_aead.encrypt(nonce, self._aad(exchange.kid, exchange.partial_iv),
+                                  buffer, plaintext_size)
+
+        outer_options = [o for o in pkt.options
+                         if o.number in _OUTER_OPTION_NUMBERS and not o.matches(Option.OSCORE)]
+        outer_options += observe
+        outer_options.append(Option.get_class_by_number(Option.OSCORE.number)(
+            Option.OSCORE.number, option_value))
+        return Packet(type=pkt.type, code=outer_code, msg_id=pkt.msg_id, token=pkt.token,
+                      options=outer_options, content=buffer, version=pkt.version)
+
+    def unprotect(self, pkt: Packet) -> Packet:
+        """
+        Verifies and decrypts the OSCORE-protected PKT, and returns the
+        original message. Raises OscoreError if PKT is not protected with
+        this context, fails verification, or is a replay.
+        """
+        oscore_options = pkt.get_options(Option.OSCORE)
+        if len(oscore_options) != 1:
+            raise OscoreError('expected 1 OSCORE option, got %d' % (len(oscore_options),))
+        partial_iv, kid, kid_context = _decode_option(oscore_options[0].content)
+
+        token = bytes(pkt.token)
+        seq = None
+        exchange = None
+        if pkt.code.is_request():
+            if partial_iv is None or kid is None:
+                raise OscoreError('Partial IV or kid missing in a protected request')
+            if kid != self.recipient_id or (kid_context is not None
+                                            and kid_context != self.id_context):
+                raise OscoreError('unknown kid %r' % (kid,))
+            seq = int.from_bytes(partial_iv, 'big')
+            if not self.replay_window.is_fresh(seq):
+                raise OscoreError('replayed request: sequence number %d' % (seq,))
+            request_kid, request_piv = kid, partial_iv
+            nonce = self._nonce(kid, partial_iv)
+        else:
+            exchange = self._exchanges.get(token)
+            if exchange is None:
+                raise OscoreError('no protected request with token %r' % (token,))
+            request_kid, request_piv = exchange.kid, exchange.partial_iv
+            if partial_iv is not None:
+                seq = int.from_bytes(partial_iv, 'big')
+                if seq <= exchange.last_notification_seq:
+                    raise OscoreError('replayed notification: sequence number %d' % (seq,))
+                nonce = self._nonce(self.recipient_id, partial_iv)
+            else:
+                nonce = exchange.nonce
+
+        buffer = bytearray(pkt.content)
+        try:
+            plaintext_size = self._recipient_aead.decrypt(
+                nonce, self._aad(request_kid, request_piv), buffer, len(buffer))
+        except (RuntimeError, ValueError) as e:
+            raise OscoreError('could not decrypt OSCORE message: %s' % (e,))
+
+        if pkt.code.is_request():
+            self.replay_window.update(seq)
+            self._remember(token, _Exchange(request_kid, request_piv, nonce))
+        elif seq is not None:
+            exchange.last_notification_seq = seq
+
+        plaintext = memoryview(buffer)[:plaintext_size]
+        if not plaintext:
+            raise OscoreError('empty OSCORE plaintext')
+
+        options = []
+        content = b''
+        at = 1
+        while at < len(plaintext):
+            if plaintext[at] == 0xFF:
+                content = plaintext[at + 1:]
+                break
+            opt, bytes_parsed = Option.parse(plaintext[at:], options[-1].number if options else 0)
+            options.append(opt)
+            at += bytes_parsed
+
+        # Observe may be both an inner and an outer option
+        has_inner_observe = any(o.matches(Option.OBSERVE) for o in options)
+        options += [o for o in pkt.options
+                    if not o.matches(Option.OSCORE)
+                    and not (has_inner_observe and o.matches(Option.OBSERVE))]
+        return Packet(type=pkt.type, code=Code.from_byte(plaintext[0]), msg_id=pkt.msg_id,
+                      token=pkt.token, options=options, content=content, version=pkt.version)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+from typing import Callable, Dict, Optional
+
+from .code import Code
+from .packet import Packet
+from .timer_wheel import TimerWheel
+from .type import Type
+
+
+class _OutgoingExchange:
+    __slots__ = ('packet', 'data', 'timeout_s', 'retransmissions', 'timer')
+
+    def __init__(self, packet: Packet, data: bytes, timeout_s: float):
+        self.packet = packet
+        self.data = data
+        self.timeout_s = timeout_s
+        self.retransmissions = 0
+        self.timer = None
+
+
+class ReliabilityLayer:
+    """
+    Implements the CoAP message layer (RFC 7252, section 4) on behalf of
+    a coap.Server:
+
+    - every Confirmable message sent is retransmitted with exponential
+      back-off until a matching ACK or Reset arrives, or MAX_RETRANSMIT is
+      exceeded,
+    - empty ACKs for our own requests are consumed; the Separate Response
+      that follows is returned from recv() like any other response,
+    - Confirmable responses (Separate Responses and CON notifications) are
+      acknowledged automatically.
+
+    TX_PARAMS may be any object with ack_timeout, ack_random_factor and
+    max_retransmit attributes, e.g. framework.test_utils.TxParams.
+    """
+
+    def __init__(self, tx_params,
+                 send: Callable[[Packet], None],
+                 send_raw: Callable[[bytes], None],
+                 timers: Optional[TimerWheel] = None):
+        self.tx_params = tx_params
+        self.timers = timers or TimerWheel()
+        self._send = send
+        self._send_raw = send_raw
+        self._outgoing = {}  # type: Dict[int, _OutgoingExchange]
+
+        self.retransmissions = 0
+        self.failed_exchanges = 0
+        self.acks_sent = 0
+
+    def _initial_timeout(self) -> float:
+        return random.uniform(self.tx_params.ack_timeout,
+                              self.tx_params.ack_timeout * self.tx_params.ack_random_factor)
+
+    def _schedule(self, exchange: _OutgoingExchange) -> None:
+        exchange.timer = self.timers.schedule(
+            exchange.timeout_s, lambda: self._retransmit(exchange))
+
+    def _retransmit(self, exchange: _OutgoingExchange) -> None:
+        msg_id = exchange.packet.msg_id
+        if self._outgoing.get(msg_id) is not exchange:
+            return
+
+        if exchange.retransmissions >= self.tx_params.max_retransmit:
+            logging.warning('giving up on CON message id=%d after %d retransmissions',
+                            msg_id, exchange.retransmissions)
+            del self._outgoing[msg_id]
+            self.failed_exchanges += 1
+            return
+
+        exchange.retransmissions += 1
+        exchange.timeout_s *= 2
+        self.retransmissions += 1
+        logging.debug('retransmitting CON message id=%d (%d/%d)', msg_id,
+                      exchange.retransmissions, self.tx_params.max_retransmit)
+        self._send_raw(exchange.data)
+        self._schedule(exchange)
+
+    def _finish(self, msg_id: int) -> Optional[_OutgoingExchange]:
+        exchange = self._outgoing.pop(msg_id, None)
+        if exchange is not None and exchange.timer is not None:
+            exchange.timer.cancel()
+        return exchange
+
+    @property
+    def pending(self) -> int:
+        return len(self._outgoing)
+
+    def on_send(self, packet: Packet, data: bytes) -> None:
+        if packet.type != Type.CONFIRMABLE:
+            return
+
+        self._finish(packet.msg_id)
+        exchange = _OutgoingExchange(packet, data, self._initial_timeout())
+        self._outgoing[packet.msg_id] = exchange
+        self._schedule(exchange)
+
+    def on_recv(self, packet: Packet) -> Optional[Packet]:
+        """
+        Updates the exchange state after receiving PACKET. Returns the packet
+        if it should be passed to the caller of recv(), or None if it was
+        fully handled here.
+        """
+        if packet.type in (Type.ACKNOWLEDGEMENT, Type.RESET):
+            exchange = self._finish(packet.msg_id)
+            if (exchange is not None
+                    and packet.type == Type.ACKNOWLEDGEMENT
+                    and packet.code == Code.EMPTY):
+                return None
+            return packet
+
+        if packet.code.is_response() and packet.type == Type.CONFIRMABLE:
+            self.send_empty_ack(packet)
+
+        return packet
+
+    def send_empty_ack(self, packet: Packet) -> None:
+        self._send(Packet(type=Type.ACKNOWLEDGEMENT, code=Code.EMPTY,
+                          msg_id=packet.msg_id, token=b'', content=b''))
+        self.acks_sent += 1
+
+    def reset(self) -> None:
+        for msg_id in list(self._outgoing):
+            self._finish(msg_id)
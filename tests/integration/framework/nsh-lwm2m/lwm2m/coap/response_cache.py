@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import time
+from typing import Callable, Optional, Tuple
+
+from .packet import Packet
+from .type import Type
+
+# EXCHANGE_LIFETIME for default transmission parameters, see RFC 7252, 4.8.2
+DEFAULT_EXCHANGE_LIFETIME_S = 247.0
+
+
+class _CacheEntry:
+    __slots__ = ('expires_at', 'response')
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+        self.response = None
+
+
+class ResponseCache:
+    """
+    Server-side counterpart of the client's message cache (see --cache-size
+    in the demo). Remembers the (peer, msg_id) pairs of recently received
+    Confirmable and Non-confirmable messages along with the ACK/Reset we sent
+    in reply, so that retransmissions are answered again without passing
+    them to the test a second time (RFC 7252, 4.5).
+
+    Entries expire after EXCHANGE_LIFETIME_S; if more than MAX_ENTRIES are
+    stored, the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_entries: int,
+                 exchange_lifetime_s: float = DEFAULT_EXCHANGE_LIFETIME_S,
+                 clock: Callable[[], float] = time.monotonic):
+        if max_entries <= 0:
+            raise ValueError('max_entries must be positive')
+
+        self.max_entries = max_entries
+        self.exchange_lifetime_s = exchange_lifetime_s
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_expired(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            del self._entries[key]
+
+    def on_recv(self, peer: Optional[Tuple[str, int]], packet: Packet,
+                send_raw: Callable[[bytes], None]) -> Optional[Packet]:
+        """
+        Returns PACKET if it is not a duplicate, or None if it was a duplicate
+        that has been handled (i.e. re-answered with the cached response or,
+        if no response was sent yet, silently dropped).
+        """
+        if packet.type not in (Type.CONFIRMABLE, Type.NON_CONFIRMABLE):
+            return packet
+
+        now = self._clock()
+        key = (peer, packet.msg_id)
+        entry = self._entries.get(key)
+
+        if entry is not None and entry.expires_at > now:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if entry.response is not None:
+                logging.debug('duplicate message id=%d from %s, resending cached response',
+                              packet.msg_id, peer)
+                send_raw(entry.response)
+            else:
+                logging.debug('duplicate message id=%d from %s, no response yet; ignoring',
+                              packet.msg_id, peer)
+            return None
+
+        self.misses += 1
+        self._evict_expired(now)
+        self._entries[key] = _CacheEntry(now + self.exchange_lifetime_s)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return packet
+
+    def on_send(self, peer: Optional[Tuple[str, int]], packet: Packet, data: bytes) -> None:
+        if packet.type not in (Type.ACKNOWLEDGEMENT, Type.RESET):
+            return
+
+        entry = self._entries.get((peer, packet.msg_id))
+        if entry is not None:
+            entry.response = data
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -15,13 +15,21 @@
 # limitations under the License.
 
 import contextlib
+import functools
+import os
 import socket
 import errno
-from typing import Tuple, Optional
+import time
+from typing import Iterator, List, Optional, Tuple, Union
 
 from .packet import Packet
+from .congestion import CongestionControl, DEFAULT_MAX_TRANSMIT_WAIT_S
+from .reliability import ReliabilityLayer
+from .response_cache import ResponseCache, DEFAULT_EXCHANGE_LIFETIME_S
+from .timer_wheel import TimerWheel
 from .transport import Transport
 from .code import Code
+from .option import Option
 
 import enum
 
@@ -113,7 +121,39 @@ def _disconnect_socket(old_sock, family):
 
 
 class Server(object):
-    def __init__(self, listen_port=0, use_ipv6=False, reuse_port=False, transport=Transport.UDP):
+    def __init__(self, listen_port=0, use_ipv6=False, reuse_port=False, transport=Transport.UDP,
+                 tx_params=None, response_cache_size=None, nstart=None, probing_rate=1.0,
+                 oscore_context=None):
+        """
+        If TX_PARAMS (an object with ack_timeout, ack_random_factor and
+        max_retransmit attributes, e.g. framework.test_utils.TxParams) is
+        given, the server takes care of the CoAP message layer by itself:
+        Confirmable messages are retransmitted until acknowledged, and
+        Confirmable responses from the client are ACKed automatically.
+        See ReliabilityLayer for details.
+
+        If RESPONSE_CACHE_SIZE is given, up to that many recently received
+        messages are remembered, and retransmissions of them are answered
+        with the cached response instead of being returned from recv(). See
+        ResponseCache for details.
+
+        If NSTART is given, requests sent to the client are subject to
+        congestion control: at most NSTART Confirmable requests are
+        outstanding at a time, Non-confirmable ones are paced to PROBING_RATE
+        bytes per second, and any other requests are queued until they may
+        be sent. See CongestionControl for details.
+
+        If OSCORE_CONTEXT (an oscore.SecurityContext) is given, requests and
+        responses are protected with OSCORE when sent, and verified and
+        decrypted by recv(). This happens above the layers listed above, which
+        see the protected messages. Received messages without the OSCORE
+        option, e.g. empty ACKs, are returned unchanged, so that tests can
+        tell whether the client protected them. Note that a retransmitted
+        request reuses the sequence number of the original one: unless
+        RESPONSE_CACHE_SIZE is given, so that it is answered from the cache
+        before reaching OSCORE, recv() raises oscore.OscoreError for it as
+        for a replay.
+        """
         self._prev_remote_endpoint = None
         self.socket_timeout = None
         self.socket = None
@@ -121,6 +161,26 @@ class Server(object):
         self.transport = transport
         self.reuse_port = reuse_port
         self.accepted_connection = False
+        self._timers = TimerWheel()
+        self.reliability = (ReliabilityLayer(tx_params, self.send, self._send_raw, self._timers)
+                            if tx_params is not None else None)
+        self.congestion = None
+        if nstart is not None:
+            max_transmit_wait_s = (tx_params.max_transmit_wait()
+                                   if hasattr(tx_params, 'max_transmit_wait')
+                                   else DEFAULT_MAX_TRANSMIT_WAIT_S)
+            self.congestion = CongestionControl(self._transmit, self._timers,
+                                                nstart=nstart,
+                                                probing_rate=probing_rate,
+                                                max_transmit_wait_s=max_transmit_wait_s,
+                                                backoff_s=getattr(tx_params, 'ack_timeout', 2.0))
+        self.oscore = oscore_context
+        self.response_cache = None
+        if response_cache_size is not None:
+            exchange_lifetime_s = (tx_params.exchange_lifetime()
+                                   if hasattr(tx_params, 'exchange_lifetime')
+                                   else DEFAULT_EXCHANGE_LIFETIME_S)
+            self.response_cache = ResponseCache(response_cache_size, exchange_lifetime_s)
 
         self.reset(listen_port)
 
@@ -214,9 +274,36 @@ class Server(object):
             socket.SOL_SOCKET, socket.SO_REUSEPORT, 1 if self.reuse_port else 0)
         self.socket.bind(('', listen_port))
         self.accepted_connection = False
+        if self.reliability is not None:
+            self.reliability.reset()
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        if self.congestion is not None:
+            self.congestion.reset()
+
+    def _send_raw(self, data: bytes) -> None:
+        try:
+            self.socket.send(data)
+        except ConnectionRefusedError:
+            if self.congestion is not None:
+                self.congestion.on_icmp_error(self.get_remote_addr())
+            raise
+
+    def _transmit(self, coap_packet: Packet, data: bytes) -> None:
+        self._send_raw(data)
+        if self.reliability is not None:
+            self.reliability.on_send(coap_packet, data)
+        if self.response_cache is not None:
+            self.response_cache.on_send(self.get_remote_addr(), coap_packet, data)
 
     def send(self, coap_packet: Packet) -> None:
-        self.socket.send(coap_packet.serialize(transport=self.transport))
+        if self.oscore is not None:
+            coap_packet = self.oscore.protect(coap_packet)
+        data = coap_packet.serialize(transport=self.transport)
+        if self.congestion is not None:
+            self.congestion.submit(self.get_remote_addr(), coap_packet, data)
+        else:
+            self._transmit(coap_packet, data)
 
     def recv_raw(self, timeout_s: float = -1):
         # NOTE: get_remote_addr() can sometimes return None, if someone
@@ -230,8 +317,72 @@ class Server(object):
         with _override_timeout(self.socket, timeout_s):
             return self.socket.recv(65536)
 
+    def recv_raw_into(self, buffer, timeout_s: float = -1) -> int:
+        """
+        Like recv_raw(), but receives the datagram (decrypted, for DTLS) into
+        the writable BUFFER, e.g. a preallocated bytearray, and returns its
+        size. Anything that does not fit is discarded.
+        """
+        if not self.get_remote_addr() and not self.accepted_connection:
+            self.listen(timeout_s=timeout_s)
+
+        self.accepted_connection = True
+
+        with _override_timeout(self.socket, timeout_s):
+            return self.socket.recv_into(buffer)
+
+    def _process_incoming(self, pkt: Packet) -> Optional[Packet]:
+        if self.congestion is not None:
+            self.congestion.on_recv(self.get_remote_addr(), pkt)
+        if self.response_cache is not None:
+            pkt = self.response_cache.on_recv(self.get_remote_addr(), pkt, self._send_raw)
+        if pkt is not None and self.reliability is not None:
+            pkt = self.reliability.on_recv(pkt)
+        return pkt
+
+    def _unprotect(self, pkt: Packet) -> Packet:
+        if self.oscore is not None and pkt.get_options(Option.OSCORE):
+            return self.oscore.unprotect(pkt)
+        return pkt
+
     def recv(self, timeout_s: float = -1) -> Packet:
-        return Packet.parse(self.recv_raw(timeout_s), transport=self.transport)
+        if self.reliability is None and self.response_cache is None and self.congestion is None:
+            return self._unprotect(Packet.parse(self.recv_raw(timeout_s), transport=self.transport))
+
+        if timeout_s is not None and timeout_s < 0:
+            timeout_s = self.get_timeout()
+        deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+
+        # Retransmission and congestion control timers are driven from here:
+        # the socket is only waited on until the earliest of the timer
+        # deadlines and the caller's one.
+        while True:
+            self._timers.expire()
+            wait_until = self._timers.next_expiry()
+            if deadline is not None and (wait_until is None or deadline < wait_until):
+                wait_until = deadline
+
+            if wait_until is None:
+                wait_s = None
+            else:
+                # a zero timeout would switch the socket to non-blocking
+                # mode, raising BlockingIOError instead of socket.timeout
+                wait_s = max(wait_until - time.monotonic(), 0.001)
+
+            try:
+                data = self.recv_raw(wait_s)
+            except socket.timeout:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            except ConnectionRefusedError:
+                if self.congestion is not None:
+                    self.congestion.on_icmp_error(self.get_remote_addr())
+                raise
+
+            pkt = self._process_incoming(Packet.parse(data, transport=self.transport))
+            if pkt is not None:
+                return self._unprotect(pkt)
 
     def set_timeout(self, timeout_s: float) -> None:
         self.socket_timeout = timeout_s
@@ -262,36 +413,112 @@ class Server(object):
         return 'nosec'
 
 
+@functools.lru_cache(maxsize=32)
+def _read_file(path, _stamp):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _file_contents(path):
+    """
+    Returns contents of the file at PATH, cached for as long as the file is
+    not modified.
+    """
+    stat = os.stat(path)
+    return _read_file(path, (stat.st_mtime_ns, stat.st_size))
+
+
+def _cert_security(ca_path, ca_file, crt_file, key_file):
+    """
+    Returns a new CertSecurity object for the given files. Only the file
+    contents are cached: mbedTLS modifies the private key context during
+    handshakes (RSA blinding values, ECDSA precomputed points) without any
+    locking, so every server needs its own parsed copy.
+    """
+    from pymbedtls import CertSecurity
+
+    ca_files = []
+    if ca_path is not None:
+        ca_files += sorted(entry.path for entry in os.scandir(ca_path) if entry.is_file())
+    if ca_file is not None:
+        ca_files.append(ca_file)
+    return CertSecurity(ca_certs=[_file_contents(path) for path in ca_files],
+                        crt=_file_contents(crt_file) if crt_file is not None else b'',
+                        key=_file_contents(key_file) if key_file is not None else b'')
+
+
+def _make_pymbedtls_context(psk_identity=None, psk_key=None, ca_path=None, ca_file=None,
+                            crt_file=None, key_file=None, debug=False, connection_id='',
+                            psk_store=None, session_cache_size=None, session_ttl_s=None,
+                            session_tickets=False, ciphersuites=None):
+    use_psk = (psk_identity and psk_key)
+    use_certs = any((ca_path, ca_file, crt_file, key_file))
+    if use_psk and use_certs:
+        raise ValueError(
+            "Cannot use PSK and Certificates at the same time")
+    if psk_store is not None and (use_psk or use_certs):
+        raise ValueError(
+            "Cannot use a PSK store together with other credentials")
+
+    try:
+        from pymbedtls import PskSecurity, Context
+    except ImportError:
+        raise ImportError('could not import pymbedtls! run '
+                          '`python3 setup.py install --user` in the '
+                          'pymbedtls/ subdirectory of nsh-lwm2m submodule '
+                          'or export PYTHONPATH properly')
+
+    if psk_store is not None:
+        security = psk_store
+    elif use_psk:
+        security = PskSecurity(psk_key, psk_identity)
+    elif use_certs:
+        security = _cert_security(ca_path, ca_file, crt_file, key_file)
+    else:
+        raise ValueError(
+            "Neither PSK nor Certificates were configured for use with DTLS")
+
+    context_kwargs = {'session_tickets': session_tickets}
+    if session_cache_size is not None:
+        context_kwargs['session_cache_size'] = session_cache_size
+    if session_ttl_s is not None:
+        context_kwargs['session_ttl_s'] = session_ttl_s
+    if ciphersuites is not None:
+        context_kwargs['ciphersuites'] = list(ciphersuites)
+
+    return Context(security, debug, connection_id, **context_kwargs), security.name()
+
+
 class DtlsServer(Server):
+    """
+    PSK_STORE may be a pymbedtls.PskStoreSecurity object, holding keys for
+    any number of identities, instead of a single PSK_IDENTITY and PSK_KEY.
+    The store may be modified while the server is running.
+
+    Clients may resume their sessions with an abbreviated handshake. Up to
+    SESSION_CACHE_SIZE sessions (0 disables the cache) are kept for
+    SESSION_TTL_S seconds; None means the mbedTLS defaults. If
+    SESSION_TICKETS is True, RFC 5077 session tickets are issued and
+    accepted as well. Cached sessions and ticket keys survive reset(), so
+    clients reconnecting after it can resume their sessions, too.
+
+    CIPHERSUITES is a list of IANA ciphersuite IDs (e.g. 0xC0A8) to accept,
+    in order of preference. By default, TLS_PSK_WITH_AES_128_CCM_8 is used
+    with PSK, and TLS_ECDHE_ECDSA_WITH_AES_128_CCM_8 with certificates.
+    """
+
     def __init__(self, psk_identity=None, psk_key=None, ca_path=None, ca_file=None,
                  crt_file=None, key_file=None, listen_port=0, debug=False, use_ipv6=False,
-                 reuse_port=False, connection_id=''):
-        use_psk = (psk_identity and psk_key)
-        use_certs = any((ca_path, ca_file, crt_file, key_file))
-        if use_psk and use_certs:
-            raise ValueError(
-                "Cannot use PSK and Certificates at the same time")
-
-        try:
-            from pymbedtls import PskSecurity, CertSecurity, Context
-        except ImportError:
-            raise ImportError('could not import pymbedtls! run '
-                              '`python3 setup.py install --user` in the '
-                              'pymbedtls/ subdirectory of nsh-lwm2m submodule '
-                              'or export PYTHONPATH properly')
-
-        if use_psk:
-            security = PskSecurity(psk_key, psk_identity)
-        elif use_certs:
-            security = CertSecurity(ca_path, ca_file, crt_file, key_file)
-        else:
-            raise ValueError(
-                "Neither PSK nor Certificates were configured for use with DTLS")
-
-        self._pymbedtls_context = Context(security, debug, connection_id)
-        self._security_mode = security.name()
+                 reuse_port=False, connection_id='', tx_params=None, response_cache_size=None,
+                 nstart=None, probing_rate=1.0, psk_store=None, session_cache_size=None,
+                 session_ttl_s=None, session_tickets=False, ciphersuites=None):
+        self._pymbedtls_context, self._security_mode = _make_pymbedtls_context(
+            psk_identity, psk_key, ca_path, ca_file, crt_file, key_file, debug, connection_id,
+            psk_store, session_cache_size, session_ttl_s, session_tickets, ciphersuites)
 
-        super().__init__(listen_port, use_ipv6, reuse_port=reuse_port)
+        super().__init__(listen_port, use_ipv6, reuse_port=reuse_port, tx_params=tx_params,
+                         response_cache_size=response_cache_size, nstart=nstart,
+                         probing_rate=probing_rate)
 
     def connect_to_client(self, remote_addr: Tuple[str, int]) -> None:
         raise NotImplementedError(
@@ -324,3 +551,145 @@ class DtlsServer(Server):
     def security_mode(self):
         # Either 'psk' or 'cert'.
         return self._security_mode
+
+    def handshake_stats(self):
+        """
+        Returns the numbers of full and abbreviated (resumed) handshakes
+        completed since the server was created.
+        """
+        return self._pymbedtls_context.handshake_stats()
+
+    def io_stats(self):
+        """
+        Returns the numbers of datagrams and bytes (UDP payload) exchanged with
+        the connected client so far, including handshake messages. Only
+        available after the client connects.
+        """
+        return self.socket.io_stats()
+
+
+class MultiDtlsServer(object):
+    """
+    DTLS endpoint serving any number of clients on a single UDP port, like a
+    production LwM2M server does: unlike DtlsServer, it keeps listening after
+    the first handshake, and every datagram is routed to the DTLS session of
+    the address it came from.
+
+    New clients have to pass a stateless cookie exchange (HelloVerifyRequest)
+    before any per-client state is allocated. At most MAX_PEERS sessions (0:
+    unlimited) are kept at once; ClientHellos from other clients are dropped
+    when the limit is reached. HANDSHAKE_TIMEOUTS_S is a (min, max) tuple of
+    handshake retransmission timeouts.
+
+    If CONNECTION_ID is set, every client gets its own connection ID
+    (CONNECTION_ID followed by a peer number), and sessions are looked up by
+    it instead of by address: a client whose address changes, e.g. due to
+    NAT rebinding, keeps its session without a new handshake.
+
+    Handshakes and encryption are performed by pymbedtls with the GIL
+    released; recvfrom() only returns once a client sends application data.
+    Security, session resumption and ciphersuite parameters are the same as
+    for DtlsServer; with PSK_STORE, each client may use a different PSK identity.
+    """
+
+    def __init__(self, psk_identity=None, psk_key=None, ca_path=None, ca_file=None,
+                 crt_file=None, key_file=None, listen_port=0, debug=False, use_ipv6=False,
+                 connection_id='', max_peers=0, handshake_timeouts_s=None, psk_store=None,
+                 session_cache_size=None, session_ttl_s=None, session_tickets=False,
+                 ciphersuites=None):
+        from pymbedtls import MultiServerSocket
+
+        self._pymbedtls_context, self._security_mode = _make_pymbedtls_context(
+            psk_identity, psk_key, ca_path, ca_file, crt_file, key_file, debug, connection_id,
+            psk_store, session_cache_size, session_ttl_s, session_tickets, ciphersuites)
+        self.family = socket.AF_INET6 if use_ipv6 else socket.AF_INET
+        self.transport = Transport.UDP
+
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        sock.bind(('', listen_port))
+        self.socket = MultiServerSocket(self._pymbedtls_context, sock, max_peers,
+                                        handshake_timeouts_s)
+
+    def close(self) -> None:
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def recvfrom(self, timeout_s: Optional[float] = -1) -> Tuple[bytes, Tuple[str, int]]:
+        """
+        Returns the next (plaintext, peer address) received by any client.
+        Raises socket.timeout if there is none within TIMEOUT_S (or the
+        socket timeout, if TIMEOUT_S is negative).
+        """
+        with _override_timeout(self.socket, timeout_s):
+            return self.socket.recvfrom(65536)
+
+    def recv(self, timeout_s: Optional[float] = -1) -> Tuple[Tuple[str, int], Packet]:
+        data, addr = self.recvfrom(timeout_s)
+        return addr, Packet.parse(data, transport=self.transport)
+
+    def events(self, timeout_s: Optional[float] = None) -> Iterator[Tuple[Tuple[str, int], bytes]]:
+        """
+        Yields (peer address, plaintext) pairs as they arrive, until no
+        datagram is received for TIMEOUT_S (forever if None).
+        """
+        while True:
+            try:
+                data, addr = self.recvfrom(timeout_s)
+            except socket.timeout:
+                return
+            yield addr, data
+
+    def sendto(self, data: Union[bytes, Packet], addr: Tuple[str, int]) -> None:
+        """
+        Sends DATA (a serialized or a Packet object) to the client at ADDR,
+        which must have an established DTLS session.
+        """
+        if isinstance(data, Packet):
+            data = data.serialize(transport=self.transport)
+        self.socket.sendto(data, addr)
+
+    def peers(self) -> List[Tuple[str, int]]:
+        """
+        Addresses of all clients with an established DTLS session.
+        """
+        return self.socket.peers()
+
+    def close_peer(self, addr: Tuple[str, int]) -> bool:
+        """
+        Sends close_notify to ADDR and forgets its session. Returns False if
+        there was no session with ADDR.
+        """
+        return self.socket.close_peer(addr)
+
+    def forget_idle_peers(self, max_idle_s: float) -> int:
+        return self.socket.forget_idle_peers(max_idle_s)
+
+    def stats(self):
+        """
+        Returns counters of HelloVerifyRequests sent, completed and failed
+        handshakes, client reconnects, datagrams dropped, session migrations
+        to new addresses and handshakes avoided thanks to them.
+        """
+        return self.socket.stats()
+
+    def handshake_stats(self):
+        """
+        Returns the numbers of full and abbreviated (resumed) handshakes.
+        """
+        return self._pymbedtls_context.handshake_stats()
+
+    def set_timeout(self, timeout_s: Optional[float]) -> None:
+        self.socket.settimeout(timeout_s)
+
+    def get_timeout(self) -> Optional[float]:
+        return self.socket.gettimeout()
+
+    def get_listen_port(self) -> int:
+        return self.socket.getsockname()[1]
+
+    def get_local_addr(self) -> Optional[Tuple[str, int]]:
+        return self.socket.getsockname()
+
+    def security_mode(self):
+        return self._security_mode
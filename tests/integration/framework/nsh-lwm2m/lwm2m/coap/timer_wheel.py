@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import itertools
+import math
+import time
+from typing import Callable, Optional
+
+
+class TimerHandle:
+    __slots__ = ('deadline_tick', 'callback', 'cancelled')
+
+    def __init__(self, deadline_tick: int, callback: Callable[[], None]):
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel. Timers are stored in one of NUM_SLOTS buckets
+    selected by their deadline tick, so cancellation is O(1) and expiring
+    timers only touches the buckets that have already passed.
+    Timers further away than one rotation simply stay in their bucket until
+    the wheel comes around enough times.
+
+    Deadlines are additionally kept in a heap, so that the earliest one can
+    be found without scanning the buckets, at the cost of O(log n)
+    scheduling; entries of cancelled or expired timers are discarded lazily,
+    once they reach the top of the heap.
+    """
+
+    def __init__(self, tick_s: float = 0.01, num_slots: int = 512,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tick_s = tick_s
+        self._clock = clock
+        self._slots = [[] for _ in range(num_slots)]
+        self._origin = clock()
+        self._current_tick = 0
+        self._count = 0
+        # (deadline tick, sequence number, handle)
+        self._deadlines = []
+        self._heap_seq = itertools.count()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(math.ceil((timestamp - self._origin) / self.tick_s))
+
+    def schedule_at(self, timestamp: float, callback: Callable[[], None]) -> TimerHandle:
+        handle = TimerHandle(max(self._tick_of(timestamp), self._current_tick),
+                             callback)
+        self._slots[handle.deadline_tick % len(self._slots)].append(handle)
+        heapq.heappush(self._deadlines, (handle.deadline_tick, next(self._heap_seq), handle))
+        self._count += 1
+        return handle
+
+    def schedule(self, delay_s: float, callback: Callable[[], None]) -> TimerHandle:
+        return self.schedule_at(self._clock() + delay_s, callback)
+
+    def next_expiry(self) -> Optional[float]:
+        """
+        Returns the absolute time (as returned by the clock) at which the
+        earliest timer fires, or None if no timers are scheduled.
+        """
+        while self._deadlines:
+            deadline_tick, _, handle = self._deadlines[0]
+            if not handle.cancelled:
+                return self._origin + deadline_tick * self.tick_s
+            heapq.heappop(self._deadlines)
+        return None
+
+    def expire(self) -> int:
+        """
+        Runs callbacks of all timers whose deadline has passed. Callbacks may
+        schedule new timers. Returns the number of callbacks invoked.
+        """
+        now_tick = int((self._clock() - self._origin) / self.tick_s)
+        num_slots = len(self._slots)
+        fired = 0
+
+        # no need to visit any slot more than once per call
+        last_tick = min(now_tick, self._current_tick + num_slots - 1)
+        while self._current_tick <= last_tick:
+            slot = self._slots[self._current_tick % num_slots]
+            due = [h for h in slot if h.deadline_tick <= now_tick or h.cancelled]
+            if due:
+                slot[:] = [h for h in slot if not (h.deadline_tick <= now_tick or h.cancelled)]
+                self._count -= len(due)
+                for handle in due:
+                    if not handle.cancelled:
+                        handle.cancelled = True
+                        handle.callback()
+                        fired += 1
+            self._current_tick += 1
+
+        self._current_tick = max(self._current_tick, now_tick)
+        return fired
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import concurrent.futures
+import copy
+import logging
+import socket
+import time
+from typing import Callable, Iterator, Optional
+
+from . import coap
+from .coap.packet import ANY
+from .messages import Lwm2mMsg
+
+FanoutResult = collections.namedtuple('FanoutResult',
+                                      ('target', 'request', 'response', 'error',
+                                       'attempts', 'elapsed_s'))
+FanoutResult.__doc__ = """
+Outcome of a single request performed by Fanout. TARGET is the key of the
+Lwm2mServer it was sent to, REQUEST is the last attempt sent. Exactly one of
+RESPONSE and ERROR (an exception, e.g. socket.timeout) is not None.
+"""
+
+
+class _Job:
+    __slots__ = ('target', 'template', 'attempts', 'started_at', 'request', 'deadline')
+
+    def __init__(self, target, template: Lwm2mMsg):
+        self.target = target
+        self.template = template
+        self.attempts = 0
+        self.started_at = None
+        self.request = None
+        self.deadline = None
+
+
+class Fanout:
+    """
+    Performs the same kind of operation on many endpoints at once, each
+    endpoint being represented by its own Lwm2mServer.
+
+    At most MAX_IN_FLIGHT requests are outstanding in total and at most
+    MAX_IN_FLIGHT_PER_TARGET for each endpoint; targets are served in
+    round-robin order. Each attempt must complete within TIMEOUT_S. Attempts
+    that time out, are answered with Reset or with one of RETRY_CODES are
+    repeated (with a fresh message ID and token) up to RETRIES times.
+    """
+
+    def __init__(self,
+                 max_in_flight: int = 64,
+                 max_in_flight_per_target: int = 1,
+                 timeout_s: float = 5.0,
+                 retries: int = 0,
+                 retry_codes=(coap.Code.RES_SERVICE_UNAVAILABLE,),
+                 clock: Callable[[], float] = time.monotonic):
+        if max_in_flight < 1 or max_in_flight_per_target < 1:
+            raise ValueError('concurrency limits must be at least 1')
+
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_target = max_in_flight_per_target
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.retry_codes = tuple(retry_codes)
+        self._clock = clock
+
+    @staticmethod
+    def _instantiate(template: Lwm2mMsg) -> Lwm2mMsg:
+        request = copy.copy(template)
+        request.msg_id = ANY
+        request.token = ANY
+        return request
+
+    def _should_retry(self, job: _Job, response: Optional[Lwm2mMsg],
+                      error: Optional[BaseException]) -> bool:
+        if job.attempts > self.retries:
+            return False
+        if error is not None:
+            return isinstance(error, socket.timeout)
+        return response.type == coap.Type.RESET or response.code in self.retry_codes
+
+    def run(self, targets, requests) -> Iterator[FanoutResult]:
+        """
+        Sends REQUESTS to all TARGETS and yields a FanoutResult for each
+        request as soon as it is finished.
+
+        TARGETS is either a dict mapping arbitrary keys (e.g. endpoint names)
+        to Lwm2mServer objects, or an iterable of Lwm2mServer objects, which
+        then serve as their own keys.
+
+        REQUESTS is a message used as a template for every target, a list of
+        such messages (sent to every target in order, e.g. a series of
+        Write-Attributes), or a function that takes the target key and
+        returns a message or list of messages.
+        """
+        if not isinstance(targets, dict):
+            targets = collections.OrderedDict((server, server) for server in targets)
+
+        queues = collections.OrderedDict()
+        for key in targets:
+            templates = requests(key) if callable(requests) else requests
+            if isinstance(templates, coap.Packet):
+                templates = [templates]
+            queues[key] = collections.deque(_Job(key, template) for template in templates)
+
+        round_robin = collections.deque(queues)
+        in_flight = {}  # type: dict
+        per_target = collections.Counter()
+
+        def launch(job: _Job):
+            job.attempts += 1
+            job.request = self._instantiate(job.template)
+            now = self._clock()
+            if job.started_at is None:
+                job.started_at = now
+            job.deadline = now + self.timeout_s
+            per_target[job.target] += 1
+            try:
+                future = targets[job.target].request_async(job.request)
+            except OSError as e:
+                return finish(job, error=e)
+            in_flight[future] = job
+            return None
+
+        def finish(job: _Job, response=None, error=None):
+            per_target[job.target] -= 1
+            if self._should_retry(job, response, error):
+                logging.debug('fan-out: retrying request to %r (attempt %d)',
+                              job.target, job.attempts + 1)
+                queues[job.target].appendleft(job)
+                return None
+            return FanoutResult(job.target, job.request, response, error,
+                                job.attempts, self._clock() - job.started_at)
+
+        while in_flight or any(queues.values()):
+            while len(in_flight) < self.max_in_flight:
+                launched = False
+                for _ in range(len(round_robin)):
+                    key = round_robin[0]
+                    round_robin.rotate(-1)
+                    if queues[key] and per_target[key] < self.max_in_flight_per_target:
+                        result = launch(queues[key].popleft())
+                        if result is not None:
+                            yield result
+                        launched = True
+                        break
+                if not launched:
+                    break
+
+            if not in_flight:
+                continue
+
+            next_deadline = min(job.deadline for job in in_flight.values())
+            done, _ = concurrent.futures.wait(
+                list(in_flight), timeout=max(next_deadline - self._clock(), 0),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                job = in_flight.pop(future)
+                if future.cancelled():
+                    result = finish(job, error=concurrent.futures.CancelledError())
+                elif future.exception() is not None:
+                    result = finish(job, error=future.exception())
+                else:
+                    result = finish(job, response=future.result())
+                if result is not None:
+                    yield result
+
+            now = self._clock()
+            for future, job in list(in_flight.items()):
+                if job.deadline <= now:
+                    del in_flight[future]
+                    targets[job.target].cancel_request(job.request)
+                    result = finish(job, error=socket.timeout('no response in %.3f s'
+                                                              % (self.timeout_s,)))
+                    if result is not None:
+                        yield result
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import concurrent.futures
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Union
+
+from . import coap
+from .messages import Lwm2mExecute, Lwm2mMsg, Lwm2mWrite, Lwm2mWriteAttributes
+from .observations import Observation
+from .pump import gather
+
+# Firmware Update Object (/5) resources
+PACKAGE_URI_PATH = '/5/0/1'
+UPDATE_PATH = '/5/0/2'
+STATE_PATH = '/5/0/3'
+UPDATE_RESULT_PATH = '/5/0/5'
+
+STATE_IDLE = 0
+STATE_DOWNLOADING = 1
+STATE_DOWNLOADED = 2
+STATE_UPDATING = 3
+
+UPDATE_RESULT_INITIAL = 0
+UPDATE_RESULT_SUCCESS = 1
+
+CampaignResult = collections.namedtuple('CampaignResult',
+                                        ('target', 'success', 'phase', 'timings',
+                                         'update_result', 'error'))
+CampaignResult.__doc__ = """
+Outcome of a firmware update of a single device. PHASE is the last phase
+entered ('observe', 'write', 'download' or 'update'); if SUCCESS is False,
+it is the phase that failed, and ERROR describes why. TIMINGS maps names of
+completed phases to their durations in seconds. UPDATE_RESULT is the last
+known value of the Update Result resource.
+"""
+
+
+class CampaignError(Exception):
+    pass
+
+
+class _DeviceRun:
+    """
+    Firmware update of a single device, performed in a worker thread.
+    """
+
+    def __init__(self, campaign: 'FirmwareCampaign', target, server):
+        self.campaign = campaign
+        self.target = target
+        self.server = server
+        self.phase = None
+        self.timings = collections.OrderedDict()
+        self.state = None
+        self.update_result = None
+        self._phase_started_at = None
+        self._wake = threading.Event()
+
+    def _enter(self, phase: str) -> None:
+        now = self.campaign._clock()
+        if self.phase is not None:
+            self.timings[self.phase] = now - self._phase_started_at
+        self.phase = phase
+        self._phase_started_at = now
+
+    def _request(self, request: Lwm2mMsg, timeout_s: float) -> Lwm2mMsg:
+        response = gather([self.server.request_async(request)], timeout_s)[0]
+        if response.code.cls != 2:
+            raise CampaignError('%s failed: %s' % (request.summary(), response.summary()))
+        return response
+
+    @staticmethod
+    def _value(msg: Lwm2mMsg) -> int:
+        return int(msg.content)
+
+    def _observe(self, path: str) -> Observation:
+        observation = self.server.observe(path, timeout_s=self.campaign.request_timeout_s,
+                                          accept=coap.ContentFormat.TEXT_PLAIN)
+        if not observation.active:
+            raise CampaignError('could not observe %s: %s'
+                                % (path, observation.initial_response.summary()))
+        observation.on_notify.append(lambda _: self._wake.set())
+        return observation
+
+    def _wait_for(self, state: Observation, result: Observation,
+                  done: Callable[[], bool], timeout_s: float) -> None:
+        deadline = self.campaign._clock() + timeout_s
+        while True:
+            # cleared before draining, so that anything that arrives later
+            # wakes the wait below
+            self._wake.clear()
+            for observation in (state, result):
+                while observation.pending():
+                    value = self._value(observation.get(0))
+                    if observation is state:
+                        self.state = value
+                    else:
+                        self.update_result = value
+
+            if self.update_result is not None and self.update_result > UPDATE_RESULT_SUCCESS:
+                raise CampaignError('update failed with result %d' % (self.update_result,))
+            if done():
+                return
+            if not (state.active and result.active):
+                raise CampaignError('observation cancelled by the client')
+
+            remaining = deadline - self.campaign._clock()
+            if remaining <= 0 or not self._wake.wait(remaining):
+                raise socket.timeout('%s phase not finished in %.1f s (state %r, result %r)'
+                                     % (self.phase, timeout_s, self.state, self.update_result))
+
+    def _cancel(self, observation: Optional[Observation]) -> None:
+        if observation is not None and observation.active:
+            # the device may be rebooting, so do not wait for a response
+            self.server.cancel_observe(observation, reset=True)
+
+    def run(self, package_uri: str) -> CampaignResult:
+        campaign = self.campaign
+        started_at = campaign._clock()
+        state = result = None
+        try:
+            self._enter('observe')
+            if campaign.observe_attributes:
+                for path in (STATE_PATH, UPDATE_RESULT_PATH):
+                    self._request(Lwm2mWriteAttributes(path, query=list(campaign.observe_attributes)),
+                                  campaign.request_timeout_s)
+            state = self._observe(STATE_PATH)
+            result = self._observe(UPDATE_RESULT_PATH)
+            self.state = self._value(state.initial_response)
+            self.update_result = self._value(result.initial_response)
+
+            self._enter('write')
+            self._request(Lwm2mWrite(PACKAGE_URI_PATH, package_uri),
+                          campaign.request_timeout_s)
+
+            self._enter('download')
+            self._wait_for(state, result, lambda: self.state == STATE_DOWNLOADED,
+                           campaign.download_timeout_s)
+
+            if campaign.execute_update:
+                self._enter('update')
+                self._request(Lwm2mExecute(UPDATE_PATH), campaign.request_timeout_s)
+                self._wait_for(state, result,
+                               lambda: (self.state == STATE_UPDATING
+                                        or self.update_result == UPDATE_RESULT_SUCCESS),
+                               campaign.update_timeout_s)
+
+            self._enter(None)
+            return CampaignResult(self.target, True, list(self.timings)[-1],
+                                  dict(self.timings, total=campaign._clock() - started_at),
+                                  self.update_result, None)
+        except (CampaignError, OSError, ValueError) as e:
+            logging.debug('firmware update of %r failed in %s phase: %s', self.target, self.phase, e)
+            return CampaignResult(self.target, False, self.phase,
+                                  dict(self.timings, total=campaign._clock() - started_at),
+                                  self.update_result, e)
+        finally:
+            self._cancel(state)
+            self._cancel(result)
+
+
+class FirmwareCampaign:
+    """
+    Updates firmware of many devices, each represented by its own
+    Lwm2mServer, using Pull mode: Write Package URI, wait until the package
+    is downloaded, Execute Update and wait until the update starts.
+
+    Instead of polling, State and Update Result of every device are
+    observed (after setting OBSERVE_ATTRIBUTES on them, so that no state
+    change is delayed by pmin), and each phase ends as soon as the relevant
+    notification arrives. Update Result values other than Initial and
+    Success abort the update of the device.
+
+    At most ROLLOUT_WINDOW devices are updated at the same time. Phases have
+    to complete within DOWNLOAD_TIMEOUT_S and UPDATE_TIMEOUT_S, and each
+    request within REQUEST_TIMEOUT_S. If EXECUTE_UPDATE is False, the
+    campaign stops after the download phase.
+    """
+
+    def __init__(self,
+                 package_uri: Union[str, Callable[[object], str]],
+                 rollout_window: int = 8,
+                 download_timeout_s: float = 300.0,
+                 update_timeout_s: float = 60.0,
+                 request_timeout_s: float = 5.0,
+                 execute_update: bool = True,
+                 observe_attributes=('pmin=0',),
+                 clock: Callable[[], float] = time.monotonic):
+        if rollout_window < 1:
+            raise ValueError('rollout window must be at least 1')
+
+        self.package_uri = package_uri
+        self.rollout_window = rollout_window
+        self.download_timeout_s = download_timeout_s
+        self.update_timeout_s = update_timeout_s
+        self.request_timeout_s = request_timeout_s
+        self.execute_update = execute_update
+        self.observe_attributes = tuple(observe_attributes or ())
+        self._clock = clock
+
+    def _package_uri(self, target) -> str:
+        return self.package_uri(target) if callable(self.package_uri) else self.package_uri
+
+    def run(self, targets) -> Iterator[CampaignResult]:
+        """
+        Updates all TARGETS and yields a CampaignResult for each device as
+        soon as it is finished. TARGETS is either a dict mapping arbitrary
+        keys (e.g. endpoint names) to Lwm2mServer objects, or an iterable of
+        Lwm2mServer objects, which then serve as their own keys.
+        """
+        if not isinstance(targets, dict):
+            targets = collections.OrderedDict((server, server) for server in targets)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.rollout_window) as executor:
+            futures = [executor.submit(_DeviceRun(self, key, server).run, self._package_uri(key))
+                       for key, server in targets.items()]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+    def run_all(self, targets) -> Dict[object, CampaignResult]:
+        return collections.OrderedDict((result.target, result) for result in self.run(targets))
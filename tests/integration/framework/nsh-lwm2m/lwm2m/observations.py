@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from . import coap
+from .messages import Lwm2mMsg
+
+DEFAULT_QUEUE_SIZE = 64
+
+# RFC 7641, 3.4 and 4.4
+OBSERVE_SEQ_MODULO = 2 ** 24
+OBSERVE_SEQ_HALF = 2 ** 23
+OBSERVE_FRESHNESS_S = 128.0
+
+
+def _observe_seq(msg: coap.Packet) -> Optional[int]:
+    opts = msg.get_options(coap.Option.OBSERVE)
+    return opts[0].content_to_int() if opts else None
+
+
+class Observation:
+    """
+    A single observation established by the server. Notifications are kept
+    in a queue of at most QUEUE_SIZE messages; if the test does not consume
+    them fast enough, the oldest ones are dropped and counted in DROPPED.
+
+    Observe sequence numbers are checked according to RFC 7641, 3.4:
+    numbers skipped between two consecutive notifications are added to GAPS,
+    and notifications that are older than the last one received are counted
+    in REORDERED (but still delivered).
+
+    Functions in ON_NOTIFY are called with each notification after it is
+    queued (and with None when the observation is closed), from the thread
+    that received it; they are meant for waking up consumers that wait for
+    more than one observation at once.
+    """
+
+    def __init__(self, token: bytes, path: str, initial_response: Lwm2mMsg = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.token = token
+        self.path = path
+        self.initial_response = initial_response
+        self.active = True
+        self.on_notify = []  # type: List[Callable[[Lwm2mMsg], None]]
+
+        self._queue = collections.deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+
+        self.last_seq = None
+        self._last_seq_at = None
+        self.received = 0
+        self.dropped = 0
+        self.gaps = 0
+        self.reordered = 0
+
+        if initial_response is not None:
+            self._track_seq(_observe_seq(initial_response), time.monotonic())
+
+    def __repr__(self):
+        return 'Observation(token=%r, path=%r, received=%d%s)' % (
+            self.token, self.path, self.received, '' if self.active else ', inactive')
+
+    def _is_fresher(self, seq: int, now: float) -> bool:
+        if self.last_seq is None or now - self._last_seq_at > OBSERVE_FRESHNESS_S:
+            return True
+        return ((self.last_seq < seq and seq - self.last_seq < OBSERVE_SEQ_HALF)
+                or (self.last_seq > seq and self.last_seq - seq > OBSERVE_SEQ_HALF))
+
+    def _track_seq(self, seq: Optional[int], now: float) -> None:
+        if seq is None:
+            return
+        if not self._is_fresher(seq, now):
+            self.reordered += 1
+            return
+        if self.last_seq is not None:
+            self.gaps += (seq - self.last_seq - 1) % OBSERVE_SEQ_MODULO
+        self.last_seq = seq
+        self._last_seq_at = now
+
+    def _deliver(self, msg: Lwm2mMsg) -> None:
+        seq = _observe_seq(msg)
+        with self._cond:
+            self._track_seq(seq, time.monotonic())
+            if seq is None or msg.code.cls != 2:
+                # RFC 7641, 3.2: a response without Observe option or with an
+                # error code ends the observation
+                self.active = False
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(msg)
+            self.received += 1
+            self._cond.notify_all()
+        for callback in self.on_notify:
+            callback(msg)
+
+    def _close(self) -> None:
+        with self._cond:
+            self.active = False
+            self._cond.notify_all()
+        for callback in self.on_notify:
+            callback(None)
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def get(self, timeout_s: Optional[float] = None) -> Lwm2mMsg:
+        """
+        Returns the oldest queued notification, waiting up to TIMEOUT_S for
+        one to arrive. Raises socket.timeout if there is none by then, or
+        right away if the observation is no longer active and the queue is
+        empty.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or not self.active, timeout_s) \
+                    or not self._queue:
+                raise socket.timeout('no notification for %s' % (self.path,))
+            return self._queue.popleft()
+
+    def stream(self, timeout_s: Optional[float] = None,
+               limit: Optional[int] = None) -> Iterator[Lwm2mMsg]:
+        """
+        Yields notifications as they arrive, until LIMIT notifications were
+        yielded or the observation ends and its queue is drained. TIMEOUT_S
+        applies to each notification separately; socket.timeout is raised if
+        it elapses while the observation is still active.
+        """
+        count = 0
+        while limit is None or count < limit:
+            try:
+                msg = self.get(timeout_s)
+            except socket.timeout:
+                if not self.active:
+                    return
+                raise
+            yield msg
+            count += 1
+
+    def __iter__(self) -> Iterator[Lwm2mMsg]:
+        return self.stream()
+
+
+class ObservationRegistry:
+    """
+    Set of observations established by a server, indexed by token (used to
+    route incoming notifications in constant time) and by path. Paths are
+    interned, so that thousands of observations of the same resources do
+    not keep thousands of copies of the same string.
+
+    Tokens of observations removed with remove(..., reset=True) are kept
+    until the next notification with that token arrives, so that it can be
+    answered with Reset (RFC 7641, 3.6).
+
+    If STORE (e.g. lwm2m.store.Lwm2mStore) is given, tokens and paths of all
+    observations are saved there, and a notification with an unknown token
+    is looked up in it, so that observations survive a server restart.
+    """
+
+    def __init__(self, store=None):
+        self._store = store
+        self._lock = threading.Lock()
+        self._by_token = {}  # type: Dict[bytes, Observation]
+        self._by_path = {}  # type: Dict[str, Dict[bytes, Observation]]
+        self._reset_tokens = set()
+
+    def __len__(self) -> int:
+        return len(self._by_token)
+
+    def __contains__(self, token: bytes) -> bool:
+        return bytes(token) in self._by_token
+
+    def __iter__(self) -> Iterator[Observation]:
+        with self._lock:
+            return iter(list(self._by_token.values()))
+
+    def add(self, token: bytes, path: str, initial_response: Lwm2mMsg = None,
+            queue_size: int = DEFAULT_QUEUE_SIZE) -> Observation:
+        token = bytes(token)
+        path = sys.intern(str(path))
+        observation = Observation(token, path, initial_response, queue_size)
+        with self._lock:
+            self._index(observation)
+        if self._store is not None:
+            self._store.save_observation(token, path)
+        return observation
+
+    def _index(self, observation: Observation) -> None:
+        previous = self._by_token.pop(observation.token, None)
+        if previous is not None:
+            self._unindex(previous)
+        self._by_token[observation.token] = observation
+        self._by_path.setdefault(observation.path, {})[observation.token] = observation
+        self._reset_tokens.discard(observation.token)
+
+    def _unindex(self, observation: Observation) -> None:
+        same_path = self._by_path.get(observation.path)
+        if same_path is not None:
+            same_path.pop(observation.token, None)
+            if not same_path:
+                del self._by_path[observation.path]
+        observation._close()
+
+    def get(self, token: bytes) -> Optional[Observation]:
+        return self._by_token.get(bytes(token))
+
+    def by_path(self, path: str) -> List[Observation]:
+        with self._lock:
+            return list(self._by_path.get(str(path), {}).values())
+
+    def remove(self, token: bytes, reset: bool = False) -> Optional[Observation]:
+        """
+        Forgets the observation with given TOKEN. If RESET is set, the next
+        notification with that token is answered with Reset.
+        """
+        token = bytes(token)
+        with self._lock:
+            observation = self._by_token.pop(token, None)
+            if observation is not None:
+                self._unindex(observation)
+            if reset:
+                self._reset_tokens.add(token)
+        if self._store is not None:
+            self._store.delete_observation(token)
+        return observation
+
+    def dispatch(self, msg: Lwm2mMsg) -> Optional[bool]:
+        """
+        Routes notification MSG to its observation. Returns True if it was
+        queued, False if it belongs to an observation cancelled with Reset
+        (and so should be rejected) and None if the token is unknown.
+        """
+        token = bytes(msg.token)
+        with self._lock:
+            if token in self._reset_tokens:
+                self._reset_tokens.discard(token)
+                return False
+            observation = self._by_token.get(token)
+            if observation is None and self._store is not None:
+                stored = self._store.load_observation(token)
+                if stored is not None:
+                    observation = Observation(token, sys.intern(stored[1]))
+                    self._index(observation)
+        if observation is None:
+            return None
+
+        observation._deliver(msg)
+        if not observation.active:
+            self.remove(token)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            for observation in self._by_token.values():
+                observation._close()
+            self._by_token.clear()
+            self._by_path.clear()
+            self._reset_tokens.clear()
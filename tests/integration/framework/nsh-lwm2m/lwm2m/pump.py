@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import logging
+import queue
+import select
+import socket
+import threading
+from typing import Callable, Dict, List, Optional
+
+from . import coap
+from .messages import get_lwm2m_msg, Lwm2mEmpty, Lwm2mMsg, Lwm2mReset
+from .observations import DEFAULT_QUEUE_SIZE, ObservationRegistry
+
+
+class ReceivePump:
+    """
+    Background thread that receives all messages arriving at a coap.Server
+    and dispatches them:
+
+    - responses whose token matches a request sent with send_request() are
+      used to resolve the Future returned from it,
+    - a successful response to an Observe request sent that way registers
+      the observation in OBSERVATIONS, and further responses with its token
+      (i.e. notifications) are queued there; Confirmable notifications are
+      acknowledged unless the coap.Server does that itself,
+    - requests for which REQUEST_HANDLER returns True are considered
+      handled (e.g. answered by a RegistrationDirectory),
+    - everything else (e.g. Register/Update requests from the client, or
+      responses to requests sent without send_request()) is put into the
+      INBOX queue, which Lwm2mServer.recv() reads from while the pump is
+      running.
+
+    If receiving fails, e.g. because the coap.Server was closed, the thread
+    exits and the exception is stored in FAILURE. It is then raised from
+    pending Futures, send_request() and, once the INBOX is drained, recv().
+
+    The coap.Server is only accessed with LOCK held, so that requests may be
+    sent from other threads while the pump is waiting for data.
+    """
+
+    POLL_INTERVAL_S = 0.05
+
+    def __init__(self, coap_server: coap.Server,
+                 observations: Optional[ObservationRegistry] = None,
+                 request_handler: Optional[Callable[[Lwm2mMsg], bool]] = None):
+        self._server = coap_server
+        self._request_handler = request_handler
+        self.lock = threading.RLock()
+        self.inbox = queue.Queue()
+        self.observations = observations if observations is not None else ObservationRegistry()
+
+        # token -> (Future, request, observation queue size)
+        self._pending = {}  # type: Dict[bytes, tuple]
+        # msg_id -> token, for matching empty ACKs and Resets
+        self._pending_msg_ids = {}  # type: Dict[int, bytes]
+
+        self.failure = None  # type: Optional[BaseException]
+        self._shutdown = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def send_request(self, request: Lwm2mMsg,
+                     observe_queue_size: int = DEFAULT_QUEUE_SIZE) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.failure is not None:
+                raise self.failure
+            request.fill_placeholders()
+            token = bytes(request.token)
+            if token in self._pending:
+                raise ValueError('request with token %r is already in flight' % (token,))
+            self._pending[token] = (future, request, observe_queue_size)
+            self._pending_msg_ids[request.msg_id] = token
+            try:
+                self._server.send(request)
+            except Exception:
+                self._forget(token)
+                raise
+        return future
+
+    def cancel_request(self, token: bytes) -> None:
+        """
+        Stops waiting for the response to a request sent with send_request().
+        Its Future is cancelled and a late response ends up in the INBOX.
+        """
+        with self.lock:
+            token = bytes(token)
+            if token in self._pending:
+                self._forget(token)[0].cancel()
+
+    def send(self, pkt: coap.Packet) -> None:
+        with self.lock:
+            self._server.send(pkt)
+
+    def recv(self, timeout_s: Optional[float]) -> Lwm2mMsg:
+        try:
+            msg = self.inbox.get(timeout=timeout_s)
+        except queue.Empty:
+            raise socket.timeout('timed out')
+        if msg is None:
+            # the pump failed; keep the marker for subsequent calls
+            self.inbox.put(None)
+            raise self.failure
+        return msg
+
+    def _forget(self, token: bytes):
+        entry = self._pending.pop(token)
+        self._pending_msg_ids.pop(entry[1].msg_id, None)
+        return entry
+
+    @staticmethod
+    def _observe_value(pkt: coap.Packet) -> Optional[int]:
+        opts = pkt.get_options(coap.Option.OBSERVE)
+        return opts[0].content_to_int() if opts else None
+
+    def _is_response_to(self, msg: Lwm2mMsg, request: coap.Packet) -> bool:
+        # a cancelling Observe request shares the token with the observation
+        # it cancels, so notifications may still arrive before its response
+        return not (self._observe_value(request) == 1
+                    and self._observe_value(msg) is not None)
+
+    def _dispatch(self, msg: Lwm2mMsg) -> None:
+        if (msg.code.is_request() and self._request_handler is not None
+                and self._request_handler(msg)):
+            return
+
+        if msg.type in (coap.Type.ACKNOWLEDGEMENT, coap.Type.RESET) and msg.code == coap.Code.EMPTY:
+            token = self._pending_msg_ids.get(msg.msg_id)
+            if token is not None:
+                if msg.type == coap.Type.RESET:
+                    self._forget(token)[0].set_result(msg)
+                # empty ACK: the Separate Response will follow
+                return
+
+        if msg.code.is_response():
+            token = bytes(msg.token)
+            if token in self._pending and self._is_response_to(msg, self._pending[token][1]):
+                future, request, observe_queue_size = self._forget(token)
+                if (self._observe_value(request) == 0 and msg.code.cls == 2
+                        and self._observe_value(msg) is not None):
+                    self.observations.add(token, request.get_uri_path(), msg,
+                                          queue_size=observe_queue_size)
+                future.set_result(msg)
+                return
+
+            routed = self.observations.dispatch(msg)
+            if routed is False:
+                # observation cancelled with Reset
+                if msg.type in (coap.Type.CONFIRMABLE, coap.Type.NON_CONFIRMABLE):
+                    self._server.send(Lwm2mReset(msg_id=msg.msg_id))
+                return
+            if routed:
+                if (msg.type == coap.Type.CONFIRMABLE
+                        and getattr(self._server, 'reliability', None) is None):
+                    self._server.send(Lwm2mEmpty(msg_id=msg.msg_id))
+                return
+
+        self.inbox.put(msg)
+
+    def _fail_pending(self, exc: BaseException) -> None:
+        with self.lock:
+            for token in list(self._pending):
+                self._forget(token)[0].set_exception(exc)
+
+    def _run(self) -> None:
+        try:
+            while not self._shutdown.is_set():
+                if self._server.socket is None:
+                    raise ConnectionAbortedError('server socket closed')
+
+                try:
+                    ready, _, _ = select.select([self._server._raw_udp_socket], [], [],
+                                                self.POLL_INTERVAL_S)
+                except (OSError, ValueError):
+                    # socket closed or replaced in the meantime; it may be
+                    # reopened (see coap.Server.fake_close()), so wait for that
+                    self._shutdown.wait(self.POLL_INTERVAL_S)
+                    continue
+
+                # even if there is nothing to read, recv() needs to be called
+                # now and then to drive retransmission timers
+                if not ready and not len(getattr(self._server, '_timers', ())):
+                    continue
+
+                with self.lock:
+                    try:
+                        pkt = self._server.recv(timeout_s=self.POLL_INTERVAL_S if ready else 0.001)
+                    except socket.timeout:
+                        continue
+                    except ConnectionRefusedError as e:
+                        logging.debug('receive pump: %s', e)
+                        continue
+                    self._dispatch(get_lwm2m_msg(pkt))
+        except Exception as e:
+            if not self._shutdown.is_set():
+                logging.error('receive pump failed: %r', e)
+                with self.lock:
+                    self.failure = e
+                    self._fail_pending(e)
+                # wake up recv()
+                self.inbox.put(None)
+                return
+        self._fail_pending(concurrent.futures.CancelledError())
+
+    def stop(self) -> None:
+        self._shutdown.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+def gather(futures: List[concurrent.futures.Future],
+           timeout_s: Optional[float] = None) -> List[Lwm2mMsg]:
+    """
+    Waits until all FUTURES are resolved and returns their results, in the
+    same order. Raises socket.timeout if that does not happen in TIMEOUT_S.
+    """
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout_s)
+    if not_done:
+        raise socket.timeout('%d of %d requests not completed in time'
+                             % (len(not_done), len(futures)))
+    return [f.result() for f in futures]
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import coap
+from .messages import (Lwm2mChanged, Lwm2mCreated, Lwm2mDeleted, Lwm2mDeregister,
+                       Lwm2mErrorResponse, Lwm2mMsg, Lwm2mRegister, Lwm2mUpdate)
+
+DEFAULT_LIFETIME_S = 86400
+DEFAULT_BINDING = 'U'
+
+LinkEntry = Tuple[str, Dict[str, Optional[str]]]
+
+
+def _split_unquoted(text: str, separator: str) -> List[str]:
+    parts = []
+    current = []
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == separator and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+def parse_link_format(content: bytes) -> List[LinkEntry]:
+    """
+    Parses a CoRE Link Format (RFC 6690) payload, as sent in Register and
+    Update, into a list of (path, attributes) tuples. Attribute values are
+    unquoted; attributes without a value are mapped to None.
+    """
+    links = []
+    text = content.decode('utf-8') if isinstance(content, (bytes, bytearray)) else content
+    for link in _split_unquoted(text.strip(), ','):
+        link = link.strip()
+        if not link:
+            continue
+        params = _split_unquoted(link, ';')
+        target = params[0].strip()
+        if not (target.startswith('<') and target.endswith('>')):
+            raise ValueError('invalid link: %r' % (link,))
+
+        attrs = {}
+        for param in params[1:]:
+            name, sep, value = param.strip().partition('=')
+            if sep and len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            attrs[name] = value if sep else None
+        links.append((target[1:-1], attrs))
+    return links
+
+
+class Registration:
+    """
+    State of a single LwM2M client registered with a RegistrationDirectory.
+    """
+
+    def __init__(self, endpoint: str, location: str, peer=None):
+        self.endpoint = endpoint
+        self.location = location
+        self.peer = peer
+        self.lifetime = DEFAULT_LIFETIME_S
+        self.binding = DEFAULT_BINDING
+        self.lwm2m_version = None
+        self.sms_number = None
+        self.queue_mode = False
+        self.links = []  # type: List[LinkEntry]
+
+        self.registered_at = None
+        self.updated_at = None
+        self.expires_at = None
+        self.updates = 0
+
+    def __repr__(self):
+        return 'Registration(endpoint=%r, location=%r, lifetime=%d, binding=%r)' % (
+            self.endpoint, self.location, self.lifetime, self.binding)
+
+    @property
+    def objects(self) -> Dict[int, List[int]]:
+        """
+        Maps Object IDs from the registered object list to lists of their
+        Instance IDs (empty if only the Object itself was listed).
+        """
+        objects = {}
+        for path, _ in self.links:
+            segments = [s for s in path.split('/') if s]
+            if not segments or not all(s.isdigit() for s in segments):
+                # e.g. the "</>;rt=..." root link or an alternate path
+                continue
+            instances = objects.setdefault(int(segments[0]), [])
+            if len(segments) > 1:
+                instances.append(int(segments[1]))
+        return objects
+
+    def apply_query(self, query: List[str]) -> None:
+        """
+        Applies Register/Update parameters from QUERY. If any of them is
+        invalid, raises ValueError without changing anything.
+        """
+        changes = {}
+        for param in query:
+            name, sep, value = param.partition('=')
+            if name == 'lt':
+                changes['lifetime'] = int(value)
+            elif name == 'b':
+                changes['binding'] = value
+                changes['queue_mode'] = 'Q' in value
+            elif name == 'lwm2m':
+                changes['lwm2m_version'] = value
+            elif name == 'sms':
+                changes['sms_number'] = value
+            elif name == 'Q' and not sep:
+                changes['queue_mode'] = True
+        for name, value in changes.items():
+            setattr(self, name, value)
+
+
+def _uri_query(pkt: coap.Packet) -> List[str]:
+    return [opt.content.decode('ascii') for opt in pkt.get_options(coap.Option.URI_QUERY)]
+
+
+class RegistrationDirectory:
+    """
+    Server-side registration interface: answers Register, Update and
+    De-register requests and keeps track of registered clients.
+
+    Every registration expires LIFETIME seconds after the last successful
+    Register or Update. Expiry times are kept in a heap, so that finding
+    expired registrations does not require scanning all of them; stale heap
+    entries (left behind by Updates and De-registers) are discarded lazily.
+    Expired registrations are removed whenever the directory is accessed,
+    and each of them is passed to all ON_EXPIRE callbacks.
+
+    New registrations get locations generated by MAKE_LOCATION, which is
+    called with the endpoint name; by default these are /rd/0, /rd/1 etc.
+
+    If STORE (e.g. lwm2m.store.Lwm2mStore) is given, all changes are written
+    to it, and registrations not known to this instance are looked up there
+    on first access, so that clients registered before a restart can keep
+    sending Updates.
+    """
+
+    def __init__(self,
+                 make_location: Optional[Callable[[str], str]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 store=None):
+        self._make_location = make_location or self._next_free_location
+        self._location_counter = itertools.count()
+        self._clock = clock
+        self._store = store
+        self._by_endpoint = {}  # type: Dict[str, Registration]
+        self._by_location = {}  # type: Dict[str, Registration]
+        # (expires_at, sequence number, location)
+        self._expiry_heap = []  # type: List[Tuple[float, int, str]]
+        self._heap_seq = itertools.count()
+        self.on_expire = []  # type: List[Callable[[Registration], None]]
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self._by_location)
+
+    def __iter__(self) -> Iterator[Registration]:
+        self.expire()
+        return iter(list(self._by_location.values()))
+
+    def by_endpoint(self, endpoint: str) -> Optional[Registration]:
+        self.expire()
+        registration = self._by_endpoint.get(endpoint)
+        if registration is None and self._store is not None:
+            registration = self._adopt(self._store.load_registration(endpoint=endpoint))
+        return registration
+
+    def by_location(self, location: str) -> Optional[Registration]:
+        self.expire()
+        registration = self._by_location.get(location)
+        if registration is None and self._store is not None:
+            registration = self._adopt(self._store.load_registration(location=location))
+        return registration
+
+    def _adopt(self, registration: Optional[Registration]) -> Optional[Registration]:
+        if registration is None:
+            return None
+        self._by_endpoint[registration.endpoint] = registration
+        self._by_location[registration.location] = registration
+        heapq.heappush(self._expiry_heap,
+                       (registration.expires_at, next(self._heap_seq), registration.location))
+        return registration
+
+    def load_all(self) -> None:
+        """
+        Loads all unexpired registrations from the store.
+        """
+        if self._store is not None:
+            for registration in self._store.load_registrations():
+                if registration.location not in self._by_location:
+                    self._adopt(registration)
+
+    def _next_free_location(self, _endpoint: str) -> str:
+        while True:
+            location = '/rd/%d' % (next(self._location_counter),)
+            if self.by_location(location) is None:
+                return location
+
+    def _touch(self, registration: Registration, now: float) -> None:
+        registration.updated_at = now
+        registration.expires_at = now + registration.lifetime
+        heapq.heappush(self._expiry_heap,
+                       (registration.expires_at, next(self._heap_seq), registration.location))
+        if self._store is not None:
+            self._store.save_registration(registration)
+
+    def _remove(self, registration: Registration) -> None:
+        del self._by_location[registration.location]
+        if self._by_endpoint.get(registration.endpoint) is registration:
+            del self._by_endpoint[registration.endpoint]
+        if self._store is not None:
+            self._store.delete_registration(registration.location)
+
+    def expire(self) -> List[Registration]:
+        """
+        Removes all registrations whose lifetime has passed and returns them.
+        """
+        now = self._clock()
+        expired = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, _, location = heapq.heappop(self._expiry_heap)
+            registration = self._by_location.get(location)
+            if registration is None or registration.expires_at != expires_at:
+                # superseded by an Update, or already removed
+                continue
+            logging.debug('registration of %s expired', registration.endpoint)
+            self._remove(registration)
+            expired.append(registration)
+
+        for registration in expired:
+            for callback in self.on_expire:
+                callback(registration)
+        return expired
+
+    def next_expiry(self) -> Optional[float]:
+        self.expire()
+        while self._expiry_heap:
+            expires_at, _, location = self._expiry_heap[0]
+            registration = self._by_location.get(location)
+            if registration is not None and registration.expires_at == expires_at:
+                return expires_at
+            heapq.heappop(self._expiry_heap)
+        return None
+
+    def register(self, msg: Lwm2mMsg, peer=None) -> coap.Packet:
+        query = _uri_query(msg)
+        endpoint = None
+        for param in query:
+            if param.startswith('ep='):
+                endpoint = param[len('ep='):]
+        if not endpoint:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_BAD_REQUEST)
+
+        try:
+            links = parse_link_format(msg.content)
+        except ValueError:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_BAD_REQUEST)
+
+        registration = Registration(endpoint, self._make_location(endpoint), peer)
+        try:
+            registration.apply_query(query)
+        except ValueError:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_BAD_REQUEST)
+        registration.links = links
+
+        # only a valid re-registration replaces the previous one
+        previous = self.by_endpoint(endpoint)
+        if previous is not None:
+            self._remove(previous)
+        clash = self.by_location(registration.location)
+        if clash is not None:
+            self._remove(clash)
+        now = self._clock()
+        registration.registered_at = now
+        self._by_endpoint[endpoint] = registration
+        self._by_location[registration.location] = registration
+        self._touch(registration, now)
+        return Lwm2mCreated.matching(msg)(location=registration.location)
+
+    def update(self, msg: Lwm2mMsg, peer=None) -> coap.Packet:
+        registration = self.by_location(msg.get_uri_path())
+        if registration is None:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_NOT_FOUND)
+
+        try:
+            # parsed first, so that an invalid Update does not change anything
+            links = parse_link_format(msg.content) if msg.content else None
+            registration.apply_query(_uri_query(msg))
+        except ValueError:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_BAD_REQUEST)
+        if links is not None:
+            registration.links = links
+
+        if peer is not None:
+            registration.peer = peer
+        registration.updates += 1
+        self._touch(registration, self._clock())
+        return Lwm2mChanged.matching(msg)()
+
+    def deregister(self, msg: Lwm2mMsg) -> coap.Packet:
+        registration = self.by_location(msg.get_uri_path())
+        if registration is None:
+            return Lwm2mErrorResponse.matching(msg)(code=coap.Code.RES_NOT_FOUND)
+
+        self._remove(registration)
+        return Lwm2mDeleted.matching(msg)()
+
+    def handle(self, msg: Lwm2mMsg, peer=None) -> Optional[coap.Packet]:
+        """
+        Handles MSG if it is a Register, Update or De-register request and
+        returns the response that should be sent. Returns None for any
+        other message.
+        """
+        if isinstance(msg, Lwm2mRegister):
+            return self.register(msg, peer)
+        if isinstance(msg, Lwm2mUpdate):
+            return self.update(msg, peer)
+        if isinstance(msg, Lwm2mDeregister):
+            return self.deregister(msg)
+        return None
+
+    def clear(self) -> None:
+        self._by_endpoint.clear()
+        self._by_location.clear()
+        self._expiry_heap.clear()
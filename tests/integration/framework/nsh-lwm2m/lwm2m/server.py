@@ -14,24 +14,210 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
+import time
+from typing import List, Optional
+
 from . import coap
-from .messages import get_lwm2m_msg
+from .blockwise import BlockwiseTransfer
+from .messages import get_lwm2m_msg, Lwm2mMsg, Lwm2mObserve
+from .observations import DEFAULT_QUEUE_SIZE, Observation, ObservationRegistry
+from .pump import ReceivePump, gather
+from .registration import RegistrationDirectory
 
 
 class Lwm2mServer:
-    def __init__(self, coap_server=None):
+    def __init__(self, coap_server=None,
+                 registrations: Optional[RegistrationDirectory] = None,
+                 store=None):
+        """
+        REGISTRATIONS, if given, is used to answer Register, Update and
+        De-register requests (see set_registrations()). STORE (see
+        lwm2m.store.Lwm2mStore) makes observations persistent; pass the same
+        store to the RegistrationDirectory to persist registrations as well.
+        """
         super().__setattr__('_coap_server', coap_server or coap.Server())
+        super().__setattr__('_pump', None)
+        super().__setattr__('_observations', ObservationRegistry(store))
+        super().__setattr__('_registrations', registrations)
         self.set_timeout(timeout_s=5)
 
-    def send(self, pkt: coap.Packet):
+    @staticmethod
+    def _check_packet(pkt):
         if not isinstance(pkt, coap.Packet):
             raise ValueError(('pkt is %r, expected coap.Packet; did you forget additional parentheses? ' +
                              'valid syntax: Lwm2mSomething.matching(pkt)()') % (type(pkt),))
-        self._coap_server.send(pkt.fill_placeholders())
+
+    def send(self, pkt: coap.Packet):
+        self._check_packet(pkt)
+        if self._pump is not None:
+            self._pump.send(pkt.fill_placeholders())
+        else:
+            self._coap_server.send(pkt.fill_placeholders())
 
     def recv(self, timeout_s=-1):
-        pkt = self._coap_server.recv(timeout_s=timeout_s)
-        return get_lwm2m_msg(pkt)
+        if self._pump is not None:
+            if timeout_s is not None and timeout_s < 0:
+                timeout_s = self._coap_server.get_timeout()
+            return self._pump.recv(timeout_s)
+
+        if self._registrations is None:
+            pkt = self._coap_server.recv(timeout_s=timeout_s)
+            return get_lwm2m_msg(pkt)
+
+        if timeout_s is not None and timeout_s < 0:
+            timeout_s = self._coap_server.get_timeout()
+        deadline = time.time() + timeout_s if timeout_s is not None else None
+        while True:
+            remaining_s = max(deadline - time.time(), 0.001) if deadline is not None else None
+            msg = get_lwm2m_msg(self._coap_server.recv(timeout_s=remaining_s))
+            if not self._handle_request(msg):
+                return msg
+
+    @property
+    def registrations(self) -> Optional[RegistrationDirectory]:
+        return self._registrations
+
+    def set_registrations(self, registrations: Optional[RegistrationDirectory]) -> None:
+        """
+        Sets the RegistrationDirectory used to answer Register, Update and
+        De-register requests. Those requests are then no longer returned from
+        recv(). Pass None to handle them manually again.
+        """
+        super().__setattr__('_registrations', registrations)
+
+    def _handle_request(self, msg: Lwm2mMsg) -> bool:
+        if self._registrations is None:
+            return False
+        response = self._registrations.handle(msg, peer=self._coap_server.get_remote_addr())
+        if response is None:
+            return False
+        self.send(response)
+        return True
+
+    def start_pump(self) -> ReceivePump:
+        """
+        Starts a background thread that receives all incoming messages. While
+        it is running, recv() returns messages that were not matched with
+        any request sent with request_async(), and notifications for
+        observations established with request_async() or observe() are
+        routed to their entries in self.observations instead.
+
+        If a previous pump failed (see ReceivePump), a new one is started.
+        """
+        if self._pump is None or self._pump.failure is not None:
+            super().__setattr__('_pump', ReceivePump(self._coap_server, self._observations,
+                                                     self._handle_request))
+        return self._pump
+
+    def stop_pump(self) -> None:
+        """
+        Stops the receive pump. Messages already received but not consumed
+        yet are lost.
+        """
+        if self._pump is not None:
+            self._pump.stop()
+            super().__setattr__('_pump', None)
+
+    @property
+    def observations(self) -> ObservationRegistry:
+        return self._observations
+
+    def observe(self, path: str, queue_size: int = DEFAULT_QUEUE_SIZE,
+                timeout_s: Optional[float] = -1, **kwargs) -> Observation:
+        """
+        Sends an Observe request for PATH (KWARGS are passed to Lwm2mObserve)
+        and waits for the response. Returns the Observation, with the response
+        in its initial_response attribute; if the request failed, the
+        Observation is not registered and is already inactive.
+        """
+        if timeout_s is not None and timeout_s < 0:
+            timeout_s = self._coap_server.get_timeout()
+
+        req = Lwm2mObserve(path, **kwargs)
+        future = self.start_pump().send_request(req, observe_queue_size=queue_size)
+        response = gather([future], timeout_s)[0]
+
+        observation = self._observations.get(req.token)
+        if observation is None:
+            observation = Observation(bytes(req.token), req.get_uri_path(), response)
+            observation.active = False
+        return observation
+
+    def cancel_observe(self, observation: Observation, reset: bool = False,
+                       timeout_s: Optional[float] = -1) -> Optional[Lwm2mMsg]:
+        """
+        Cancels OBSERVATION. By default, this is done by sending an Observe
+        request with Observe=1 and the same token; its response is returned.
+        If RESET is set, the next notification is answered with Reset and
+        None is returned. Note that when the message layer of the coap.Server
+        is enabled, Confirmable notifications are acknowledged before they
+        can be rejected, so Observe=1 should be used in that case.
+        """
+        if reset:
+            self._observations.remove(observation.token, reset=True)
+            return None
+
+        if timeout_s is not None and timeout_s < 0:
+            timeout_s = self._coap_server.get_timeout()
+
+        req = Lwm2mObserve(observation.path, observe=1, token=observation.token)
+        response = gather([self.request_async(req)], timeout_s)[0]
+        self._observations.remove(observation.token)
+        return response
+
+    def request_async(self, msg: Lwm2mMsg) -> concurrent.futures.Future:
+        """
+        Sends MSG without waiting for the response and returns a Future that
+        is resolved with the response (matched by token) once it arrives.
+        Starts the receive pump if it is not running yet.
+        """
+        self._check_packet(msg)
+        return self.start_pump().send_request(msg)
+
+    def cancel_request(self, msg: Lwm2mMsg) -> None:
+        """
+        Cancels the Future returned from request_async(MSG), if the response
+        has not arrived yet.
+        """
+        if self._pump is not None:
+            self._pump.cancel_request(msg.token)
+
+    def request_blockwise(self, msg: Lwm2mMsg,
+                          block_size: Optional[int] = None,
+                          window: int = 1,
+                          check_etag: bool = True,
+                          timeout_s: Optional[float] = -1) -> Lwm2mMsg:
+        """
+        Sends MSG and returns the response, transparently splitting the
+        request content into Block1 blocks and reassembling a Block2 response
+        if necessary. See lwm2m.blockwise.BlockwiseTransfer for the meaning of
+        BLOCK_SIZE, WINDOW and CHECK_ETAG. TIMEOUT_S applies to each block;
+        -1 means the server timeout set with set_timeout().
+        """
+        self._check_packet(msg)
+        if timeout_s is not None and timeout_s < 0:
+            timeout_s = self._coap_server.get_timeout()
+        transfer = BlockwiseTransfer(submit=self.request_async, wait=gather,
+                                     block_size=block_size, window=window,
+                                     check_etag=check_etag, timeout_s=timeout_s,
+                                     cancel=self.cancel_request)
+        return transfer.perform(msg)
+
+    @staticmethod
+    def gather(futures: List[concurrent.futures.Future],
+               timeout_s: Optional[float] = None) -> List[Lwm2mMsg]:
+        return gather(futures, timeout_s)
+
+    def close(self):
+        self.stop_pump()
+        self._observations.clear()
+        self._coap_server.close()
+
+    def reset(self, *args, **kwargs):
+        self.stop_pump()
+        self._observations.clear()
+        self._coap_server.reset(*args, **kwargs)
 
     def __getattr__(self, name):
         return getattr(self._coap_server, name)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .registration import Registration
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS registrations (
+    location TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL UNIQUE,
+    lifetime INTEGER NOT NULL,
+    binding TEXT NOT NULL,
+    lwm2m_version TEXT,
+    sms_number TEXT,
+    queue_mode INTEGER NOT NULL,
+    links TEXT NOT NULL,
+    updates INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS registrations_expires_at ON registrations (expires_at);
+CREATE TABLE IF NOT EXISTS observations (
+    token BLOB PRIMARY KEY,
+    path TEXT NOT NULL
+);
+"""
+
+
+class Lwm2mStore:
+    """
+    SQLite-backed persistent storage for registrations and observations, so
+    that a restarted server can keep serving clients registered with the
+    previous instance instead of forcing all of them to register again.
+
+    Nothing is loaded up front: opening the store only opens the database,
+    and RegistrationDirectory / ObservationRegistry look up records one by
+    one (by primary key) when they see an unknown location or token.
+
+    Expiry times are stored as wall-clock timestamps and converted to and
+    from CLOCK (the clock used by RegistrationDirectory) on the fly. Expired
+    registrations are deleted during compaction, which runs every
+    COMPACT_EVERY writes or when compact() is called explicitly.
+    """
+
+    def __init__(self, path: str,
+                 compact_every: int = 1000,
+                 clock: Callable[[], float] = time.monotonic,
+                 wall_clock: Callable[[], float] = time.time):
+        self.path = path
+        self.compact_every = compact_every
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self._writes_since_compaction = 0
+
+        # used from the receive pump thread as well
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _to_wall(self, timestamp: float) -> float:
+        return self._wall_clock() + (timestamp - self._clock())
+
+    def _from_wall(self, timestamp: float) -> float:
+        return self._clock() + (timestamp - self._wall_clock())
+
+    def _write(self, query: str, args: tuple) -> None:
+        with self._lock:
+            self._db.execute(query, args)
+            self._writes_since_compaction += 1
+            compact = self._writes_since_compaction >= self.compact_every
+        if compact:
+            self.compact()
+
+    def save_registration(self, registration: Registration) -> None:
+        # REPLACE also drops a previous registration of the same endpoint
+        self._write('INSERT OR REPLACE INTO registrations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (registration.location, registration.endpoint, registration.lifetime,
+                     registration.binding, registration.lwm2m_version, registration.sms_number,
+                     int(registration.queue_mode), json.dumps(registration.links),
+                     registration.updates, self._to_wall(registration.expires_at)))
+
+    def delete_registration(self, location: str) -> None:
+        self._write('DELETE FROM registrations WHERE location = ?', (location,))
+
+    def _registration_from_row(self, row) -> Registration:
+        (location, endpoint, lifetime, binding, lwm2m_version, sms_number, queue_mode,
+         links, updates, expires_at) = row
+        registration = Registration(endpoint, location)
+        registration.lifetime = lifetime
+        registration.binding = binding
+        registration.lwm2m_version = lwm2m_version
+        registration.sms_number = sms_number
+        registration.queue_mode = bool(queue_mode)
+        registration.links = [(path, attrs) for path, attrs in json.loads(links)]
+        registration.updates = updates
+        registration.expires_at = self._from_wall(expires_at)
+        return registration
+
+    def _load_registrations(self, where: str, args: tuple) -> List[Registration]:
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM registrations WHERE expires_at > ? AND ' + where,
+                                    (self._wall_clock(),) + args).fetchall()
+        return [self._registration_from_row(row) for row in rows]
+
+    def load_registration(self, location: str = None, endpoint: str = None) -> Optional[Registration]:
+        """
+        Returns the unexpired registration with given LOCATION or ENDPOINT
+        name, or None if there is no such registration.
+        """
+        if location is not None:
+            found = self._load_registrations('location = ?', (location,))
+        else:
+            found = self._load_registrations('endpoint = ?', (endpoint,))
+        return found[0] if found else None
+
+    def load_registrations(self) -> List[Registration]:
+        return self._load_registrations('1', ())
+
+    def save_observation(self, token: bytes, path: str) -> None:
+        self._write('INSERT OR REPLACE INTO observations VALUES (?, ?)', (bytes(token), path))
+
+    def delete_observation(self, token: bytes) -> None:
+        self._write('DELETE FROM observations WHERE token = ?', (bytes(token),))
+
+    def load_observation(self, token: bytes) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            row = self._db.execute('SELECT token, path FROM observations WHERE token = ?',
+                                   (bytes(token),)).fetchone()
+        return (bytes(row[0]), row[1]) if row is not None else None
+
+    def compact(self) -> None:
+        """
+        Deletes expired registrations and truncates the write-ahead log.
+        """
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM registrations WHERE expires_at <= ?',
+                                       (self._wall_clock(),)).rowcount
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._writes_since_compaction = 0
+        logging.debug('store compacted, %d expired registrations removed', deleted)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -55,7 +55,10 @@ if 'MBEDTLS_ROOT_DIR' in os.environ:
 extensions = [
     Extension('pymbedtls',
               sources=[os.path.join(SCRIPT_DIR, 'src/pymbedtls.cpp'),
+                       os.path.join(SCRIPT_DIR, 'src/aead.cpp'),
                        os.path.join(SCRIPT_DIR, 'src/socket.cpp'),
+                       os.path.join(SCRIPT_DIR, 'src/address.cpp'),
+                       os.path.join(SCRIPT_DIR, 'src/multi_server_socket.cpp'),
                        os.path.join(SCRIPT_DIR, 'src/common.cpp'),
                        os.path.join(SCRIPT_DIR, 'src/context.cpp'),
                        os.path.join(SCRIPT_DIR, 'src/security.cpp')],
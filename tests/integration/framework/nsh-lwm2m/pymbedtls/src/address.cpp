@@ -0,0 +1,147 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include <cerrno>
+#include <cstring>
+#include <stdexcept>
+
+#include <arpa/inet.h>
+#include <netdb.h>
+#include <netinet/in.h>
+
+#include "address.hpp"
+
+using namespace std;
+
+namespace ssl {
+
+Address::Address() : size_(0) {
+    memset(&storage_, 0, sizeof(storage_));
+}
+
+Address Address::from_python(int fd, py::tuple host_port) {
+    const string host = py::cast<string>(host_port[0]);
+    const int port = py::cast<int>(host_port[1]);
+
+    sockaddr_storage local;
+    socklen_t local_size = sizeof(local);
+    if (getsockname(fd, reinterpret_cast<sockaddr *>(&local), &local_size)) {
+        throw runtime_error("getsockname failed: " + string(strerror(errno)));
+    }
+
+    addrinfo hints;
+    memset(&hints, 0, sizeof(hints));
+    hints.ai_family = local.ss_family;
+    hints.ai_socktype = SOCK_DGRAM;
+    if (local.ss_family == AF_INET6) {
+        hints.ai_flags = AI_V4MAPPED;
+    }
+
+    addrinfo *info = nullptr;
+    int result = getaddrinfo(host.empty() ? nullptr : host.c_str(),
+                             std::to_string(port).c_str(), &hints, &info);
+    if (result) {
+        throw runtime_error("could not resolve " + host + ": "
+                            + gai_strerror(result));
+    }
+
+    Address address;
+    memcpy(&address.storage_, info->ai_addr, info->ai_addrlen);
+    address.size_ = info->ai_addrlen;
+    freeaddrinfo(info);
+    return address;
+}
+
+py::tuple Address::to_python() const {
+    return py::make_tuple(host(), port());
+}
+
+string Address::host() const {
+    char buf[INET6_ADDRSTRLEN] = "";
+    if (storage_.ss_family == AF_INET) {
+        inet_ntop(AF_INET,
+                  &reinterpret_cast<const sockaddr_in *>(&storage_)->sin_addr,
+                  buf, sizeof(buf));
+    } else if (storage_.ss_family == AF_INET6) {
+        inet_ntop(AF_INET6,
+                  &reinterpret_cast<const sockaddr_in6 *>(&storage_)->sin6_addr,
+                  buf, sizeof(buf));
+    }
+    return buf;
+}
+
+int Address::port() const {
+    if (storage_.ss_family == AF_INET) {
+        return ntohs(
+                reinterpret_cast<const sockaddr_in *>(&storage_)->sin_port);
+    } else if (storage_.ss_family == AF_INET6) {
+        return ntohs(
+                reinterpret_cast<const sockaddr_in6 *>(&storage_)->sin6_port);
+    }
+    return 0;
+}
+
+string Address::to_string() const {
+    if (storage_.ss_family == AF_INET6) {
+        return "[" + host() + "]:" + std::to_string(port());
+    }
+    return host() + ":" + std::to_string(port());
+}
+
+size_t Address::hash() const {
+    // FNV-1a over the fields compared by operator==
+    const unsigned char *data;
+    size_t size;
+    if (storage_.ss_family == AF_INET) {
+        auto in = reinterpret_cast<const sockaddr_in *>(&storage_);
+        data = reinterpret_cast<const unsigned char *>(&in->sin_addr);
+        size = sizeof(in->sin_addr);
+    } else if (storage_.ss_family == AF_INET6) {
+        auto in6 = reinterpret_cast<const sockaddr_in6 *>(&storage_);
+        data = reinterpret_cast<const unsigned char *>(&in6->sin6_addr);
+        size = sizeof(in6->sin6_addr);
+    } else {
+        data = reinterpret_cast<const unsigned char *>(&storage_);
+        size = size_;
+    }
+
+    uint64_t result = 14695981039346656037ULL;
+    for (size_t i = 0; i < size; ++i) {
+        result = (result ^ data[i]) * 1099511628211ULL;
+    }
+    result = (result ^ (unsigned) port()) * 1099511628211ULL;
+    return (size_t) result;
+}
+
+bool Address::operator==(const Address &other) const {
+    if (storage_.ss_family != other.storage_.ss_family) {
+        return false;
+    }
+    if (storage_.ss_family == AF_INET) {
+        auto a = reinterpret_cast<const sockaddr_in *>(&storage_);
+        auto b = reinterpret_cast<const sockaddr_in *>(&other.storage_);
+        return a->sin_port == b->sin_port
+               && a->sin_addr.s_addr == b->sin_addr.s_addr;
+    } else if (storage_.ss_family == AF_INET6) {
+        auto a = reinterpret_cast<const sockaddr_in6 *>(&storage_);
+        auto b = reinterpret_cast<const sockaddr_in6 *>(&other.storage_);
+        return a->sin6_port == b->sin6_port
+               && !memcmp(&a->sin6_addr, &b->sin6_addr, sizeof(a->sin6_addr));
+    }
+    return size_ == other.size_ && !memcmp(&storage_, &other.storage_, size_);
+}
+
+} // namespace ssl
@@ -0,0 +1,103 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef PYMBEDTLS_ADDRESS_HPP
+#define PYMBEDTLS_ADDRESS_HPP
+
+#include <sys/socket.h>
+
+#include <functional>
+#include <string>
+
+#include "pybind11_interop.hpp"
+
+namespace ssl {
+
+/**
+ * Socket address of a datagram peer, compared by family, host and port only,
+ * so that it can be matched against addresses returned by recvfrom().
+ */
+class Address {
+    sockaddr_storage storage_;
+    socklen_t size_;
+
+public:
+    Address();
+
+    /**
+     * Converts a Python (host, port) tuple to an address usable with socket
+     * @p fd. Host names are resolved, and IPv4 addresses are mapped to IPv6
+     * ones if @p fd is an IPv6 socket. Requires the GIL.
+     */
+    static Address from_python(int fd, py::tuple host_port);
+
+    py::tuple to_python() const;
+
+    sockaddr *get() {
+        return reinterpret_cast<sockaddr *>(&storage_);
+    }
+
+    const sockaddr *get() const {
+        return reinterpret_cast<const sockaddr *>(&storage_);
+    }
+
+    socklen_t size() const {
+        return size_;
+    }
+
+    /**
+     * Address length to pass to recvfrom(); set_size() must be called with
+     * the value it returns afterwards.
+     */
+    socklen_t capacity() const {
+        return sizeof(storage_);
+    }
+
+    void set_size(socklen_t size) {
+        size_ = size;
+    }
+
+    bool empty() const {
+        return size_ == 0;
+    }
+
+    std::string host() const;
+    int port() const;
+    // "host:port", or "[host]:port" for IPv6 addresses
+    std::string to_string() const;
+
+    size_t hash() const;
+    bool operator==(const Address &other) const;
+
+    bool operator!=(const Address &other) const {
+        return !(*this == other);
+    }
+};
+
+} // namespace ssl
+
+namespace std {
+
+template <>
+struct hash<ssl::Address> {
+    size_t operator()(const ssl::Address &address) const {
+        return address.hash();
+    }
+};
+
+} // namespace std
+
+#endif // PYMBEDTLS_ADDRESS_HPP
@@ -0,0 +1,95 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include <stdexcept>
+
+#include "aead.hpp"
+#include "common.hpp"
+
+using namespace std;
+
+namespace ssl {
+
+AesCcm::AesCcm(const string &key, size_t tag_size) : tag_size_(tag_size) {
+    mbedtls_ccm_init(&ccm_);
+    int result = mbedtls_ccm_setkey(
+            &ccm_, MBEDTLS_CIPHER_ID_AES,
+            reinterpret_cast<const unsigned char *>(key.data()),
+            (unsigned) key.size() * 8);
+    if (result) {
+        mbedtls_ccm_free(&ccm_);
+        throw mbedtls_error("mbedtls_ccm_setkey failed", result);
+    }
+}
+
+AesCcm::~AesCcm() {
+    mbedtls_ccm_free(&ccm_);
+}
+
+size_t AesCcm::encrypt(py::object nonce,
+                       py::object aad,
+                       py::object buffer,
+                       size_t length) {
+    const BufferView nonce_view(nonce, false);
+    const BufferView aad_view(aad, false);
+    const BufferView view(buffer, true);
+    if (length > view.size() || view.size() - length < tag_size_) {
+        throw invalid_argument("buffer too small for the data and tag");
+    }
+
+    int result;
+    {
+        py::gil_scoped_release release;
+        lock_guard<mutex> lock(mutex_);
+        result = mbedtls_ccm_encrypt_and_tag(
+                &ccm_, length, nonce_view.data(), nonce_view.size(),
+                aad_view.data(), aad_view.size(), view.data(), view.data(),
+                view.data() + length, tag_size_);
+    }
+    if (result) {
+        throw mbedtls_error("mbedtls_ccm_encrypt_and_tag failed", result);
+    }
+    return length + tag_size_;
+}
+
+size_t AesCcm::decrypt(py::object nonce,
+                       py::object aad,
+                       py::object buffer,
+                       size_t length) {
+    const BufferView nonce_view(nonce, false);
+    const BufferView aad_view(aad, false);
+    const BufferView view(buffer, true);
+    if (length > view.size() || length < tag_size_) {
+        throw invalid_argument("length out of range");
+    }
+    const size_t plaintext_size = length - tag_size_;
+
+    int result;
+    {
+        py::gil_scoped_release release;
+        lock_guard<mutex> lock(mutex_);
+        result = mbedtls_ccm_auth_decrypt(
+                &ccm_, plaintext_size, nonce_view.data(), nonce_view.size(),
+                aad_view.data(), aad_view.size(), view.data(), view.data(),
+                view.data() + plaintext_size, tag_size_);
+    }
+    if (result) {
+        throw mbedtls_error("mbedtls_ccm_auth_decrypt failed", result);
+    }
+    return plaintext_size;
+}
+
+} // namespace ssl
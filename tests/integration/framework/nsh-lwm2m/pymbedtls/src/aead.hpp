@@ -0,0 +1,74 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef PYMBEDTLS_AEAD_HPP
+#define PYMBEDTLS_AEAD_HPP
+
+#include <mbedtls/ccm.h>
+
+#include <mutex>
+#include <string>
+
+#include "pybind11_interop.hpp"
+
+namespace ssl {
+
+/**
+ * AES-CCM authenticated encryption with a fixed key, as used by COSE and
+ * OSCORE. Data is encrypted and decrypted in place, in any writable object
+ * supporting the buffer protocol, with the GIL released.
+ */
+class AesCcm {
+    mbedtls_ccm_context ccm_;
+    size_t tag_size_;
+    // mbedtls_ccm_context is not safe to use from multiple threads at once
+    std::mutex mutex_;
+
+public:
+    AesCcm(const std::string &key, size_t tag_size);
+    ~AesCcm();
+    AesCcm(const AesCcm &) = delete;
+    AesCcm &operator=(const AesCcm &) = delete;
+
+    size_t tag_size() const {
+        return tag_size_;
+    }
+
+    /**
+     * Encrypts the first @p length bytes of @p buffer in place, and stores
+     * the tag right after them. Returns the size of the result, i.e.
+     * @p length + tag_size().
+     */
+    size_t encrypt(py::object nonce,
+                   py::object aad,
+                   py::object buffer,
+                   size_t length);
+
+    /**
+     * Verifies and decrypts the first @p length bytes of @p buffer in place:
+     * the ciphertext followed by the tag. Returns the size of the plaintext
+     * at the start of @p buffer. If the tag does not match, throws
+     * mbedtls_error and leaves the plaintext zeroed.
+     */
+    size_t decrypt(py::object nonce,
+                   py::object aad,
+                   py::object buffer,
+                   size_t length);
+};
+
+} // namespace ssl
+
+#endif // PYMBEDTLS_AEAD_HPP
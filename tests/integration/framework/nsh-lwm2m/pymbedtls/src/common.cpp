@@ -15,10 +15,19 @@
  */
 
 #include <mbedtls/error.h>
+#include <mbedtls/ssl.h>
+#include <mbedtls/version.h>
+#if MBEDTLS_VERSION_NUMBER >= 0x02040000 // mbed TLS 2.4 deprecated net.h
+#    include <mbedtls/net_sockets.h>
+#else // support mbed TLS <=2.3
+#    include <mbedtls/net.h>
+#endif
 
+#include <cerrno>
 #include <sstream>
 
 #include "common.hpp"
+#include "pybind11_interop.hpp"
 
 using namespace std;
 
@@ -42,4 +51,35 @@ string mbedtls_error_string(int error_code) {
     return string(buf) + " (" + detail::to_hex(error_code) + ")";
 }
 
+void raise_read_error(int error_code,
+                      int saved_errno,
+                      const string &message) {
+    if (error_code == MBEDTLS_ERR_SSL_TIMEOUT) {
+        PyErr_SetString(py::module::import("socket").attr("timeout").ptr(),
+                        "timed out");
+        throw py::error_already_set();
+    } else if (error_code == MBEDTLS_ERR_NET_RECV_FAILED && saved_errno) {
+        errno = saved_errno;
+        PyErr_SetFromErrno(PyExc_OSError);
+        throw py::error_already_set();
+    }
+    throw mbedtls_error(message, error_code);
+}
+
+string record_cid(const unsigned char *datagram, size_t size, size_t cid_size) {
+#if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
+    // type, version, epoch and sequence number precede the connection ID
+    const size_t cid_offset = 11;
+    if (cid_size > 0 && size >= cid_offset + cid_size + 2
+            && datagram[0] == MBEDTLS_SSL_MSG_CID) {
+        return string(reinterpret_cast<const char *>(datagram + cid_offset),
+                      cid_size);
+    }
+#endif // MBEDTLS_SSL_DTLS_CONNECTION_ID
+    (void) datagram;
+    (void) size;
+    (void) cid_size;
+    return string();
+}
+
 } // namespace ssl
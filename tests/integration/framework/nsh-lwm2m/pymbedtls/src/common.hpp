@@ -16,6 +16,7 @@
 
 #ifndef PYMBEDTLS_COMMON_HPP
 #define PYMBEDTLS_COMMON_HPP
+#include <cstddef>
 #include <stdexcept>
 #include <string>
 
@@ -30,6 +31,25 @@ public:
                                  + mbedtls_error_string(error_code)) {}
 };
 
+/**
+ * Raises the Python exception corresponding to a failed read, so that
+ * callers see the same socket.timeout or OSError (e.g.
+ * ConnectionRefusedError after an ICMP Port Unreachable) as with a plain
+ * socket; any other error is thrown as mbedtls_error. Requires the GIL.
+ */
+[[noreturn]] void
+raise_read_error(int error_code, int saved_errno, const std::string &message);
+
+/**
+ * Returns the connection ID of the DTLS record at the start of
+ * @p datagram, assuming it is @p cid_size bytes long, or an empty string if
+ * the record is not protected with a connection ID. Only the record header
+ * is inspected: the result must not be trusted before mbedTLS
+ * authenticates the record.
+ */
+std::string
+record_cid(const unsigned char *datagram, size_t size, size_t cid_size);
+
 } // namespace ssl
 
 #endif // PYMBEDTLS_COMMON_HPP
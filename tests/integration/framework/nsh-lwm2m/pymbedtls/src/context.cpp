@@ -14,31 +14,218 @@
  * limitations under the License.
  */
 
+#include <cstdio>
 #include <cstring>
+#include <stdexcept>
 
+#include <mbedtls/ssl_ciphersuites.h>
+
+#include "common.hpp"
 #include "context.hpp"
+#include "security.hpp"
 
 using namespace std;
 
+namespace {
+
+// Set by the lookup callbacks when they find the client's session. The
+// callbacks are invoked synchronously from mbedtls_ssl_handshake(), so a
+// thread-local flag is enough to tell which handshake resumed a session.
+thread_local bool session_found = false;
+
+void debug_mbedtls(void * /*ctx*/,
+                   int /*level*/,
+                   const char *file,
+                   int line,
+                   const char *str) {
+    fprintf(stderr, "%s:%04d: %s", file, line, str);
+}
+
+} // namespace
+
 namespace ssl {
 
 Context::Context(std::shared_ptr<SecurityInfo> security,
                  bool debug,
-                 std::string connection_id)
-        : security_(security), debug_(debug), connection_id_(connection_id) {
-    memset(&session_cache_, 0, sizeof(session_cache_));
-    mbedtls_ssl_cache_init(&session_cache_);
-
+                 std::string connection_id,
+                 int session_cache_size,
+                 int session_ttl_s,
+                 bool session_tickets,
+                 const std::vector<int> &ciphersuites)
+        : security_(security),
+          debug_(debug),
+          connection_id_(connection_id),
+          session_cache_size_(session_cache_size),
+          session_tickets_(session_tickets),
+          full_handshakes_(0),
+          abbreviated_handshakes_(0) {
 #if !defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
     if (connection_id.size() > 0) {
         throw runtime_error(
                 "connection_id is not supported in this version of pymbedtls");
     }
 #endif // !MBEDTLS_SSL_DTLS_CONNECTION_ID
+#if !defined(MBEDTLS_SSL_SESSION_TICKETS)
+    if (session_tickets) {
+        throw runtime_error("session tickets are not supported in this "
+                            "version of pymbedtls");
+    }
+#endif // !MBEDTLS_SSL_SESSION_TICKETS
+    if (session_cache_size < 0 || session_ttl_s < 0) {
+        throw invalid_argument(
+                "session_cache_size and session_ttl_s must not be negative");
+    }
+    for (int id : ciphersuites) {
+        if (!mbedtls_ssl_ciphersuite_from_id(id)) {
+            char hex_id[16];
+            snprintf(hex_id, sizeof(hex_id), "0x%04X", (unsigned) id);
+            throw invalid_argument(string("unsupported ciphersuite: ")
+                                   + hex_id);
+        }
+    }
+    if (!ciphersuites.empty()) {
+        ciphersuites_ = ciphersuites;
+        ciphersuites_.push_back(0);
+    }
+
+    memset(&session_cache_, 0, sizeof(session_cache_));
+    mbedtls_ssl_cache_init(&session_cache_);
+    mbedtls_ssl_cache_set_max_entries(&session_cache_, session_cache_size);
+#if defined(MBEDTLS_HAVE_TIME)
+    mbedtls_ssl_cache_set_timeout(&session_cache_, session_ttl_s);
+#endif // MBEDTLS_HAVE_TIME
+
+#if defined(MBEDTLS_SSL_SESSION_TICKETS)
+    if (session_tickets_) {
+        mbedtls_entropy_init(&ticket_entropy_);
+        mbedtls_ctr_drbg_init(&ticket_rng_);
+        mbedtls_ssl_ticket_init(&ticket_);
+
+        int result = mbedtls_ctr_drbg_seed(&ticket_rng_, mbedtls_entropy_func,
+                                           &ticket_entropy_, NULL, 0);
+        if (!result) {
+            result = mbedtls_ssl_ticket_setup(
+                    &ticket_, mbedtls_ctr_drbg_random, &ticket_rng_,
+                    MBEDTLS_CIPHER_AES_256_GCM, (uint32_t) session_ttl_s);
+        }
+        if (result) {
+            mbedtls_ssl_ticket_free(&ticket_);
+            mbedtls_ctr_drbg_free(&ticket_rng_);
+            mbedtls_entropy_free(&ticket_entropy_);
+            mbedtls_ssl_cache_free(&session_cache_);
+            throw mbedtls_error("could not set up session tickets", result);
+        }
+    }
+#endif // MBEDTLS_SSL_SESSION_TICKETS
 }
 
 Context::~Context() {
+#if defined(MBEDTLS_SSL_SESSION_TICKETS)
+    if (session_tickets_) {
+        mbedtls_ssl_ticket_free(&ticket_);
+        mbedtls_ctr_drbg_free(&ticket_rng_);
+        mbedtls_entropy_free(&ticket_entropy_);
+    }
+#endif // MBEDTLS_SSL_SESSION_TICKETS
     mbedtls_ssl_cache_free(&session_cache_);
 }
 
+int Context::cache_get(void *cache, mbedtls_ssl_session *session) {
+    int result = mbedtls_ssl_cache_get(cache, session);
+    if (!result) {
+        session_found = true;
+    }
+    return result;
+}
+
+int Context::ticket_parse(void *ticket,
+                          mbedtls_ssl_session *session,
+                          unsigned char *buf,
+                          size_t len) {
+#if defined(MBEDTLS_SSL_SESSION_TICKETS)
+    int result = mbedtls_ssl_ticket_parse(ticket, session, buf, len);
+    if (!result) {
+        session_found = true;
+    }
+    return result;
+#else  // MBEDTLS_SSL_SESSION_TICKETS
+    (void) ticket;
+    (void) session;
+    (void) buf;
+    (void) len;
+    return -1;
+#endif // MBEDTLS_SSL_SESSION_TICKETS
+}
+
+void Context::configure(mbedtls_ssl_config &config,
+                        int endpoint,
+                        mbedtls_ctr_drbg_context &rng) {
+    int result =
+            mbedtls_ssl_config_defaults(&config, endpoint,
+                                        MBEDTLS_SSL_TRANSPORT_DATAGRAM, // TODO
+                                        MBEDTLS_SSL_PRESET_DEFAULT);
+    if (result) {
+        throw mbedtls_error("mbedtls_ssl_config_defaults failed", result);
+    }
+
+    if (debug_) {
+        mbedtls_ssl_conf_dbg(&config, debug_mbedtls, NULL);
+    }
+
+    // TODO
+    mbedtls_ssl_conf_min_version(&config, MBEDTLS_SSL_MAJOR_VERSION_3,
+                                 MBEDTLS_SSL_MINOR_VERSION_3);
+    mbedtls_ssl_conf_rng(&config, mbedtls_ctr_drbg_random, &rng);
+
+#if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
+    if (connection_id_.size() > 0
+            && (result = mbedtls_ssl_conf_cid(
+                        &config, connection_id_.size(),
+                        MBEDTLS_SSL_UNEXPECTED_CID_IGNORE))) {
+        throw mbedtls_error("mbedtls_ssl_conf_cid failed", result);
+    }
+#endif // MBEDTLS_SSL_DTLS_CONNECTION_ID
+
+    security_->configure(config);
+    if (!ciphersuites_.empty()) {
+        mbedtls_ssl_conf_ciphersuites(&config, ciphersuites_.data());
+    }
+
+    if (session_cache_size_ > 0) {
+        mbedtls_ssl_conf_session_cache(&config, &session_cache_,
+                                       &Context::cache_get,
+                                       mbedtls_ssl_cache_set);
+    }
+#if defined(MBEDTLS_SSL_SESSION_TICKETS)
+    if (session_tickets_ && endpoint == MBEDTLS_SSL_IS_SERVER) {
+        mbedtls_ssl_conf_session_tickets_cb(&config, mbedtls_ssl_ticket_write,
+                                            &Context::ticket_parse, &ticket_);
+    }
+#endif // MBEDTLS_SSL_SESSION_TICKETS
+}
+
+int Context::handshake_step(mbedtls_ssl_context &ssl, bool &resumed) {
+    session_found = false;
+    int result = mbedtls_ssl_handshake(&ssl);
+    if (session_found) {
+        resumed = true;
+    }
+    return result;
+}
+
+void Context::record_handshake(bool resumed) {
+    if (resumed) {
+        ++abbreviated_handshakes_;
+    } else {
+        ++full_handshakes_;
+    }
+}
+
+HandshakeStats Context::handshake_stats() const {
+    HandshakeStats stats;
+    stats.full = full_handshakes_;
+    stats.abbreviated = abbreviated_handshakes_;
+    return stats;
+}
+
 } // namespace ssl
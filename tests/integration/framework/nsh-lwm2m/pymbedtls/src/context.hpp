@@ -17,31 +17,81 @@
 #ifndef PYMBEDTLS_CONTEXT_HPP
 #define PYMBEDTLS_CONTEXT_HPP
 
+#include <atomic>
+#include <cstdint>
 #include <memory>
 #include <string>
+#include <vector>
 
+#include <mbedtls/ctr_drbg.h>
+#include <mbedtls/entropy.h>
+#include <mbedtls/ssl.h>
 #include <mbedtls/ssl_cache.h>
+#include <mbedtls/ssl_ticket.h>
 
 namespace ssl {
 
 class SecurityInfo;
 
+/**
+ * Server-side handshakes completed with sockets using a Context: full ones,
+ * and abbreviated ones that resumed a cached session or a session ticket.
+ */
+struct HandshakeStats {
+    uint64_t full;
+    uint64_t abbreviated;
+};
+
 class Context {
     mbedtls_ssl_cache_context session_cache_;
     std::shared_ptr<SecurityInfo> security_;
     bool debug_;
     std::string connection_id_;
+    int session_cache_size_;
+    bool session_tickets_;
+    // zero-terminated, as expected by mbedtls_ssl_conf_ciphersuites(); empty
+    // if the defaults of the security info are used
+    std::vector<int> ciphersuites_;
+
+    // only initialized if session tickets are enabled
+    mbedtls_entropy_context ticket_entropy_;
+    mbedtls_ctr_drbg_context ticket_rng_;
+    mbedtls_ssl_ticket_context ticket_;
+
+    std::atomic<uint64_t> full_handshakes_;
+    std::atomic<uint64_t> abbreviated_handshakes_;
+
+    // Wrappers of mbedtls_ssl_cache_get() and mbedtls_ssl_ticket_parse()
+    // that note a successful lookup for handshake_step().
+    static int cache_get(void *cache, mbedtls_ssl_session *session);
+    static int ticket_parse(void *ticket,
+                            mbedtls_ssl_session *session,
+                            unsigned char *buf,
+                            size_t len);
 
 public:
+    /**
+     * @param session_cache_size Maximum number of sessions cached for
+     *                           resumption by session ID; 0 disables the
+     *                           cache.
+     * @param session_ttl_s      Lifetime of cached sessions and session
+     *                           tickets; 0 means no limit for cached
+     *                           sessions.
+     * @param session_tickets    Whether to issue and accept RFC 5077 session
+     *                           tickets, which need no server-side state.
+     * @param ciphersuites       IANA IDs of the ciphersuites to offer or
+     *                           accept, in order of preference; if empty,
+     *                           the ones chosen by @p security are used.
+     */
     Context(std::shared_ptr<SecurityInfo> security,
             bool debug,
-            std::string connection_id);
+            std::string connection_id,
+            int session_cache_size,
+            int session_ttl_s,
+            bool session_tickets,
+            const std::vector<int> &ciphersuites);
     ~Context();
 
-    mbedtls_ssl_cache_context *session_cache() {
-        return &session_cache_;
-    }
-
     std::shared_ptr<SecurityInfo> security() const {
         return security_;
     }
@@ -53,6 +103,28 @@ public:
     bool debug() const {
         return debug_;
     }
+
+    /**
+     * Sets up @p config for a DTLS @p endpoint (MBEDTLS_SSL_IS_CLIENT or
+     * MBEDTLS_SSL_IS_SERVER) with the security, connection_id, debug and
+     * session resumption settings of this context. DTLS cookies are not
+     * configured, as their keys belong to the socket.
+     */
+    void configure(mbedtls_ssl_config &config,
+                   int endpoint,
+                   mbedtls_ctr_drbg_context &rng);
+
+    /**
+     * Calls mbedtls_ssl_handshake() on @p ssl, and sets @p resumed if the
+     * client's session was found in the cache or its ticket was accepted
+     * during the call. Lookups happen synchronously in the calling thread,
+     * so they are attributed to the right handshake even if several are
+     * interleaved.
+     */
+    static int handshake_step(mbedtls_ssl_context &ssl, bool &resumed);
+
+    void record_handshake(bool resumed);
+    HandshakeStats handshake_stats() const;
 };
 
 } // namespace ssl
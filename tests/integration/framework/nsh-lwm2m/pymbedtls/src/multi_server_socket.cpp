@@ -0,0 +1,696 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include <mbedtls/version.h>
+#if MBEDTLS_VERSION_NUMBER >= 0x02040000 // mbed TLS 2.4 deprecated net.h
+#    include <mbedtls/net_sockets.h>
+#else // support mbed TLS <=2.3
+#    include <mbedtls/net.h>
+#endif
+
+#include <algorithm>
+#include <cerrno>
+#include <cstring>
+#include <stdexcept>
+#include <vector>
+
+#include <poll.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+
+#include "common.hpp"
+#include "context.hpp"
+#include "multi_server_socket.hpp"
+
+using namespace std;
+using namespace chrono;
+
+namespace ssl {
+
+namespace {
+
+// DTLS record header: type, version, epoch, sequence number, length
+constexpr size_t RECORD_HEADER_SIZE = 13;
+// DTLS handshake header: type, length, message_seq, fragment offset/length
+constexpr size_t HANDSHAKE_HEADER_SIZE = 12;
+// offset of session_id length in an unfragmented ClientHello datagram
+// (after client_version and random)
+constexpr size_t CLIENT_HELLO_SESSION_ID_OFFSET =
+        RECORD_HEADER_SIZE + HANDSHAKE_HEADER_SIZE + 2 + 32;
+// size of the peer number appended to the configured connection_id
+constexpr size_t PEER_NUMBER_SIZE = 4;
+
+} // namespace
+
+void MultiServerSocket::Timer::set(void *self,
+                                   uint32_t int_ms,
+                                   uint32_t fin_ms) {
+    Timer *timer = reinterpret_cast<Timer *>(self);
+    timer->armed = (fin_ms != 0);
+    if (timer->armed) {
+        const auto now = Clock::now();
+        timer->intermediate = now + milliseconds(int_ms);
+        timer->final = now + milliseconds(fin_ms);
+    }
+}
+
+int MultiServerSocket::Timer::get(void *self) {
+    Timer *timer = reinterpret_cast<Timer *>(self);
+    if (!timer->armed) {
+        return -1;
+    }
+    const auto now = Clock::now();
+    if (now >= timer->final) {
+        return 2;
+    } else if (now >= timer->intermediate) {
+        return 1;
+    }
+    return 0;
+}
+
+MultiServerSocket::Peer::Peer(MultiServerSocket *owner, const Address &address)
+        : owner(owner),
+          address(address),
+          established(false),
+          resumed(false),
+          last_activity(Clock::now()),
+          pending(nullptr),
+          pending_size(0) {
+    if (owner->cid_size_ > 0) {
+        do {
+            const uint32_t number = owner->next_peer_number_++;
+            const char number_bytes[PEER_NUMBER_SIZE] = {
+                (char) (number >> 24), (char) (number >> 16),
+                (char) (number >> 8), (char) number
+            };
+            cid = owner->context_->connection_id()
+                  + string(number_bytes, sizeof(number_bytes));
+        } while (owner->peers_by_cid_.count(cid));
+    }
+
+    mbedtls_ssl_init(&ssl);
+    try {
+        int result = mbedtls_ssl_setup(&ssl, &owner->config_);
+        if (result) {
+            throw mbedtls_error("mbedtls_ssl_setup failed", result);
+        }
+        mbedtls_ssl_set_bio(&ssl, this, &MultiServerSocket::_send,
+                            &MultiServerSocket::_recv, NULL);
+        mbedtls_ssl_set_timer_cb(&ssl, &timer, &Timer::set, &Timer::get);
+        owner->reset_peer(*this);
+    } catch (...) {
+        mbedtls_ssl_free(&ssl);
+        throw;
+    }
+    if (!cid.empty()) {
+        owner->peers_by_cid_[cid] = this;
+    }
+}
+
+MultiServerSocket::Peer::~Peer() {
+    if (!cid.empty()) {
+        owner->peers_by_cid_.erase(cid);
+    }
+    mbedtls_ssl_free(&ssl);
+}
+
+int MultiServerSocket::_send(void *peer_,
+                             const unsigned char *buf,
+                             size_t len) {
+    Peer *peer = reinterpret_cast<Peer *>(peer_);
+    return peer->owner->send_datagram(peer->address, buf, len);
+}
+
+int MultiServerSocket::_recv(void *peer_, unsigned char *buf, size_t len) {
+    Peer *peer = reinterpret_cast<Peer *>(peer_);
+    if (!peer->pending) {
+        return MBEDTLS_ERR_SSL_WANT_READ;
+    }
+    // datagrams cannot be read in parts; anything that does not fit the
+    // mbedTLS input buffer is malformed anyway
+    size_t size = min(len, peer->pending_size);
+    memcpy(buf, peer->pending, size);
+    peer->pending = nullptr;
+    peer->pending_size = 0;
+    return (int) size;
+}
+
+MultiServerSocket::MultiServerSocket(std::shared_ptr<Context> context,
+                                     py::object py_socket,
+                                     size_t max_peers,
+                                     py::object handshake_timeouts_s)
+        : context_(context),
+          py_socket_(py_socket),
+          fd_(-1),
+          last_errno_(0),
+          timeout_ms_(-1),
+          max_peers_(max_peers),
+          cid_size_(0),
+          next_peer_number_(0),
+          stats_() {
+    // Zeroize cookie context. This prevents issue
+    // https://github.com/ARMmbed/mbedtls/issues/843.
+    memset(&cookie_, 0, sizeof(cookie_));
+    mbedtls_ssl_cookie_init(&cookie_);
+    mbedtls_ssl_config_init(&config_);
+    mbedtls_entropy_init(&entropy_);
+    mbedtls_ctr_drbg_init(&rng_);
+
+    int result = mbedtls_ctr_drbg_seed(&rng_, mbedtls_entropy_func, &entropy_,
+                                       NULL, 0);
+    if (result) {
+        throw mbedtls_error("mbedtls_ctr_drbg_seed failed", result);
+    }
+
+    context_->configure(config_, MBEDTLS_SSL_IS_SERVER, rng_);
+#if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
+    if (context_->connection_id().size() > 0) {
+        cid_size_ = context_->connection_id().size() + PEER_NUMBER_SIZE;
+        if ((result = mbedtls_ssl_conf_cid(
+                     &config_, cid_size_,
+                     MBEDTLS_SSL_UNEXPECTED_CID_IGNORE))) {
+            throw mbedtls_error("mbedtls_ssl_conf_cid failed", result);
+        }
+    }
+#endif // MBEDTLS_SSL_DTLS_CONNECTION_ID
+
+    if ((result = mbedtls_ssl_cookie_setup(&cookie_, mbedtls_ctr_drbg_random,
+                                           &rng_))) {
+        throw mbedtls_error("mbedtls_ssl_cookie_setup failed", result);
+    }
+    mbedtls_ssl_conf_dtls_cookies(&config_,
+                                  mbedtls_ssl_cookie_write,
+                                  mbedtls_ssl_cookie_check,
+                                  &cookie_);
+
+    if (!handshake_timeouts_s.is_none()) {
+        auto timeouts_s = py::cast<py::tuple>(handshake_timeouts_s);
+        auto min = py::cast<double>(timeouts_s[0]);
+        auto max = py::cast<double>(timeouts_s[1]);
+        mbedtls_ssl_conf_handshake_timeout(&config_, uint32_t(min * 1000.0),
+                                           uint32_t(max * 1000.0));
+    }
+}
+
+MultiServerSocket::~MultiServerSocket() {
+    peers_.clear();
+    mbedtls_ctr_drbg_free(&rng_);
+    mbedtls_entropy_free(&entropy_);
+    mbedtls_ssl_config_free(&config_);
+    mbedtls_ssl_cookie_free(&cookie_);
+}
+
+void MultiServerSocket::update_fd() {
+    fd_ = call_method<int>(py_socket_, "fileno");
+    last_errno_ = 0;
+}
+
+int MultiServerSocket::send_datagram(const Address &address,
+                                     const unsigned char *buf,
+                                     size_t len) {
+    for (;;) {
+        ssize_t sent =
+                ::sendto(fd_, buf, len, 0, address.get(), address.size());
+        if (sent >= 0) {
+            return (int) sent;
+        } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+            pollfd pfd = { fd_, POLLOUT, 0 };
+            (void) poll(&pfd, 1, -1);
+        } else if (errno != EINTR) {
+            last_errno_ = errno;
+            return MBEDTLS_ERR_NET_SEND_FAILED;
+        }
+    }
+}
+
+void MultiServerSocket::reset_peer(Peer &peer) {
+    int result = mbedtls_ssl_session_reset(&peer.ssl);
+    if (result) {
+        throw mbedtls_error("mbedtls_ssl_session_reset failed", result);
+    }
+    const string cli_id = peer.address.to_string();
+    result = mbedtls_ssl_set_client_transport_id(
+            &peer.ssl, reinterpret_cast<const unsigned char *>(cli_id.data()),
+            cli_id.size());
+    if (result) {
+        throw mbedtls_error("mbedtls_ssl_set_client_transport_id failed",
+                            result);
+    }
+#if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
+    if (!peer.cid.empty()
+            && (result = mbedtls_ssl_set_cid(
+                        &peer.ssl, MBEDTLS_SSL_CID_ENABLED,
+                        reinterpret_cast<const unsigned char *>(
+                                peer.cid.data()),
+                        peer.cid.size()))) {
+        throw mbedtls_error("mbedtls_ssl_set_cid failed", result);
+    }
+#endif // MBEDTLS_SSL_DTLS_CONNECTION_ID
+    peer.established = false;
+    peer.resumed = false;
+    peer.timer.armed = false;
+}
+
+bool MultiServerSocket::verify_client_hello(const Address &address,
+                                            size_t len) {
+    const unsigned char *in = datagram_;
+
+    // Only unfragmented ClientHello messages in epoch 0 are accepted, as
+    // in ssl_check_dtls_clihlo_cookie() in mbedTLS.
+    if (len < CLIENT_HELLO_SESSION_ID_OFFSET + 2
+            || in[0] != MBEDTLS_SSL_MSG_HANDSHAKE || in[1] != 0xfe
+            || in[3] != 0 || in[4] != 0
+            || RECORD_HEADER_SIZE + ((in[11] << 8) | in[12]) > len
+            || in[RECORD_HEADER_SIZE] != MBEDTLS_SSL_HS_CLIENT_HELLO
+            || in[19] != 0 || in[20] != 0 || in[21] != 0) {
+        ++stats_.dropped_datagrams;
+        return false;
+    }
+
+    const size_t session_id_size = in[CLIENT_HELLO_SESSION_ID_OFFSET];
+    const size_t cookie_size_offset =
+            CLIENT_HELLO_SESSION_ID_OFFSET + 1 + session_id_size;
+    if (cookie_size_offset >= len
+            || cookie_size_offset + 1 + in[cookie_size_offset] > len) {
+        ++stats_.dropped_datagrams;
+        return false;
+    }
+
+    const string cli_id = address.to_string();
+    const size_t cookie_size = in[cookie_size_offset];
+    if (cookie_size > 0
+            && mbedtls_ssl_cookie_check(
+                       &cookie_, in + cookie_size_offset + 1, cookie_size,
+                       reinterpret_cast<const unsigned char *>(cli_id.data()),
+                       cli_id.size())
+                           == 0) {
+        return true;
+    }
+
+    // Answer with HelloVerifyRequest, built the same way as in
+    // ssl_check_dtls_clihlo_cookie(): record and handshake headers are
+    // copied from the ClientHello, then the lengths are adjusted.
+    unsigned char out[RECORD_HEADER_SIZE + HANDSHAKE_HEADER_SIZE + 3 + 255];
+    memcpy(out, in, RECORD_HEADER_SIZE + HANDSHAKE_HEADER_SIZE);
+    out[13] = MBEDTLS_SSL_HS_HELLO_VERIFY_REQUEST;
+    // server_version: DTLS 1.0, as recommended by RFC 6347, 4.2.1
+    out[25] = 0xfe;
+    out[26] = 0xff;
+
+    unsigned char *p = out + 28;
+    if (mbedtls_ssl_cookie_write(&cookie_, &p, out + sizeof(out),
+                                 reinterpret_cast<const unsigned char *>(
+                                         cli_id.data()),
+                                 cli_id.size())) {
+        ++stats_.dropped_datagrams;
+        return false;
+    }
+
+    const size_t out_len = (size_t) (p - out);
+    out[27] = (unsigned char) (out_len - 28);
+    out[14] = out[22] = (unsigned char) ((out_len - 25) >> 16);
+    out[15] = out[23] = (unsigned char) ((out_len - 25) >> 8);
+    out[16] = out[24] = (unsigned char) (out_len - 25);
+    out[11] = (unsigned char) ((out_len - 13) >> 8);
+    out[12] = (unsigned char) (out_len - 13);
+
+    (void) send_datagram(address, out, out_len);
+    ++stats_.hello_verify_requests;
+    return false;
+}
+
+void MultiServerSocket::handle_datagram(const Address &address, size_t len) {
+    Peer *peer = nullptr;
+    const string cid = record_cid(datagram_, len, cid_size_);
+    if (!cid.empty()) {
+        // routed regardless of the source address, which may have changed
+        auto it = peers_by_cid_.find(cid);
+        if (it == peers_by_cid_.end()) {
+            ++stats_.dropped_datagrams;
+            return;
+        }
+        peer = it->second;
+    } else {
+        auto it = peers_.find(address);
+        if (it == peers_.end()) {
+            if (!verify_client_hello(address, len)) {
+                return;
+            }
+            if (max_peers_ && peers_.size() >= max_peers_) {
+                ++stats_.dropped_datagrams;
+                return;
+            }
+            try {
+                it = peers_.emplace(address,
+                                    unique_ptr<Peer>(new Peer(this, address)))
+                             .first;
+            } catch (mbedtls_error &) {
+                ++stats_.failed_handshakes;
+                return;
+            }
+        }
+        peer = it->second.get();
+    }
+
+    peer->pending = datagram_;
+    peer->pending_size = len;
+    peer->last_activity = Clock::now();
+    process(*peer, address);
+}
+
+void MultiServerSocket::migrate_peer(Peer &peer, const Address &address) {
+    auto it = peers_.find(peer.address);
+    unique_ptr<Peer> owned = std::move(it->second);
+    peers_.erase(it);
+    // a stale session of whoever used the new address before is dropped
+    peers_[address] = std::move(owned);
+    peer.address = address;
+
+    // used for cookies if the client reconnects
+    const string cli_id = address.to_string();
+    (void) mbedtls_ssl_set_client_transport_id(
+            &peer.ssl, reinterpret_cast<const unsigned char *>(cli_id.data()),
+            cli_id.size());
+    ++stats_.migrations;
+}
+
+void MultiServerSocket::process(Peer &peer, const Address &source) {
+    // Records from an address other than peer.address were routed by
+    // connection ID. The session is only migrated once mbedTLS
+    // authenticates them: by completing the handshake, or by returning
+    // application data.
+    if (!peer.established) {
+        int result = Context::handshake_step(peer.ssl, peer.resumed);
+        if (result == MBEDTLS_ERR_SSL_WANT_READ
+                || result == MBEDTLS_ERR_SSL_WANT_WRITE) {
+            return;
+        } else if (result) {
+            // also covers MBEDTLS_ERR_SSL_TIMEOUT after the last
+            // retransmission
+            ++stats_.failed_handshakes;
+            peers_.erase(Address(peer.address));
+            return;
+        }
+        peer.established = true;
+        ++stats_.handshakes;
+        context_->record_handshake(peer.resumed);
+        if (source != peer.address) {
+            migrate_peer(peer, source);
+        }
+    }
+
+    for (;;) {
+        int result =
+                mbedtls_ssl_read(&peer.ssl, plaintext_, sizeof(plaintext_));
+        if (result > 0) {
+            if (source != peer.address) {
+                migrate_peer(peer, source);
+                ++stats_.handshakes_avoided;
+            }
+            received_.emplace_back(
+                    peer.address,
+                    string(reinterpret_cast<const char *>(plaintext_),
+                           (size_t) result));
+        } else if (result == 0 || result == MBEDTLS_ERR_SSL_WANT_READ
+                   || result == MBEDTLS_ERR_SSL_WANT_WRITE) {
+            return;
+        } else if (result == MBEDTLS_ERR_SSL_CLIENT_RECONNECT) {
+            // The client started a new handshake with a valid cookie;
+            // mbedTLS has already reset the context, keeping the ClientHello
+            // buffered, so just continue the handshake like Socket::read()
+            // does. A reset here would discard that ClientHello.
+            ++stats_.reconnects;
+            peer.established = false;
+            peer.resumed = false;
+            process(peer, source);
+            return;
+        } else {
+            // close_notify or a fatal alert
+            peers_.erase(Address(peer.address));
+            return;
+        }
+    }
+}
+
+int MultiServerSocket::wait_timeout_ms(Clock::time_point deadline,
+                                       bool has_deadline) const {
+    bool has_wakeup = has_deadline;
+    Clock::time_point wakeup = deadline;
+    for (const auto &entry : peers_) {
+        const Peer &peer = *entry.second;
+        if (!peer.established && peer.timer.armed
+                && (!has_wakeup || peer.timer.final < wakeup)) {
+            wakeup = peer.timer.final;
+            has_wakeup = true;
+        }
+    }
+
+    if (!has_wakeup) {
+        return -1;
+    }
+    auto remaining_ms =
+            duration_cast<milliseconds>(wakeup - Clock::now()).count() + 1;
+    return (int) std::max<decltype(remaining_ms)>(remaining_ms, 0);
+}
+
+void MultiServerSocket::handle_timers() {
+    vector<Address> expired;
+    const auto now = Clock::now();
+    for (const auto &entry : peers_) {
+        const Peer &peer = *entry.second;
+        if (!peer.established && peer.timer.armed
+                && now >= peer.timer.final) {
+            expired.push_back(entry.first);
+        }
+    }
+
+    for (const Address &address : expired) {
+        auto it = peers_.find(address);
+        if (it != peers_.end()) {
+            // retransmits the last flight, or fails the handshake if there
+            // were too many retransmissions already
+            process(*it->second, address);
+        }
+    }
+}
+
+int MultiServerSocket::receive(Address &address, string &data) {
+    const bool has_deadline = (timeout_ms_ >= 0);
+    const auto deadline =
+            Clock::now() + milliseconds(has_deadline ? timeout_ms_ : 0);
+
+    for (;;) {
+        if (!received_.empty()) {
+            address = received_.front().first;
+            data = std::move(received_.front().second);
+            received_.pop_front();
+            return 0;
+        }
+
+        handle_timers();
+
+        Address peer_address;
+        socklen_t peer_address_size = peer_address.capacity();
+        ssize_t received =
+                ::recvfrom(fd_, datagram_, sizeof(datagram_), MSG_DONTWAIT,
+                           peer_address.get(), &peer_address_size);
+        if (received >= 0) {
+            peer_address.set_size(peer_address_size);
+            handle_datagram(peer_address, (size_t) received);
+            continue;
+        } else if (errno == EINTR) {
+            // give the caller a chance to handle signals
+            return MBEDTLS_ERR_SSL_WANT_READ;
+        } else if (errno != EAGAIN && errno != EWOULDBLOCK) {
+            last_errno_ = errno;
+            return MBEDTLS_ERR_NET_RECV_FAILED;
+        }
+
+        if (has_deadline && Clock::now() >= deadline) {
+            return MBEDTLS_ERR_SSL_TIMEOUT;
+        }
+
+        pollfd pfd = { fd_, POLLIN, 0 };
+        const int poll_timeout_ms = wait_timeout_ms(deadline, has_deadline);
+        mutex_.unlock();
+        int poll_result = poll(&pfd, 1, poll_timeout_ms);
+        int poll_errno = errno;
+        mutex_.lock();
+
+        if (poll_result < 0) {
+            if (poll_errno == EINTR) {
+                return MBEDTLS_ERR_SSL_WANT_READ;
+            }
+            last_errno_ = poll_errno;
+            return MBEDTLS_ERR_NET_RECV_FAILED;
+        }
+    }
+}
+
+py::tuple MultiServerSocket::recvfrom(size_t bufsize) {
+    update_fd();
+
+    Address address;
+    string data;
+    int result;
+    for (;;) {
+        {
+            py::gil_scoped_release release;
+            lock_guard<mutex> lock(mutex_);
+            result = receive(address, data);
+        }
+        if (result != MBEDTLS_ERR_SSL_WANT_READ) {
+            break;
+        }
+        if (PyErr_CheckSignals()) {
+            throw py::error_already_set();
+        }
+    }
+
+    if (result) {
+        raise_read_error(result, last_errno_, "recvfrom failed");
+    }
+    if (data.size() > bufsize) {
+        // same as for a datagram socket: the rest is discarded
+        data.resize(bufsize);
+    }
+    return py::make_tuple(py::bytes(data), address.to_python());
+}
+
+void MultiServerSocket::sendto(py::object data, py::tuple host_port) {
+    update_fd();
+    const Address address = Address::from_python(fd_, host_port);
+    const BufferView view(data, false);
+
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
+
+    auto it = peers_.find(address);
+    if (it == peers_.end() || !it->second->established) {
+        throw invalid_argument("no DTLS session with " + address.to_string());
+    }
+
+    size_t total_sent = 0;
+    while (total_sent < view.size()) {
+        int sent = mbedtls_ssl_write(&it->second->ssl,
+                                     view.data() + total_sent,
+                                     view.size() - total_sent);
+        if (sent < 0) {
+            if (sent == MBEDTLS_ERR_SSL_WANT_READ
+                    || sent == MBEDTLS_ERR_SSL_WANT_WRITE) {
+                continue;
+            }
+            throw mbedtls_error("mbedtls_ssl_write failed", sent);
+        }
+        total_sent += (size_t) sent;
+    }
+}
+
+py::list MultiServerSocket::peers() {
+    vector<Address> addresses;
+    {
+        py::gil_scoped_release release;
+        lock_guard<mutex> lock(mutex_);
+        for (const auto &entry : peers_) {
+            if (entry.second->established) {
+                addresses.push_back(entry.first);
+            }
+        }
+    }
+
+    py::list result;
+    for (const Address &address : addresses) {
+        result.append(address.to_python());
+    }
+    return result;
+}
+
+bool MultiServerSocket::close_peer(py::tuple host_port) {
+    update_fd();
+    const Address address = Address::from_python(fd_, host_port);
+
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
+
+    auto it = peers_.find(address);
+    if (it == peers_.end()) {
+        return false;
+    }
+    if (it->second->established) {
+        (void) mbedtls_ssl_close_notify(&it->second->ssl);
+    }
+    peers_.erase(it);
+    return true;
+}
+
+size_t MultiServerSocket::forget_idle_peers(double max_idle_s) {
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
+
+    const auto oldest =
+            Clock::now()
+            - duration_cast<Clock::duration>(duration<double>(max_idle_s));
+    size_t forgotten = 0;
+    for (auto it = peers_.begin(); it != peers_.end();) {
+        if (it->second->last_activity < oldest) {
+            it = peers_.erase(it);
+            ++forgotten;
+        } else {
+            ++it;
+        }
+    }
+    return forgotten;
+}
+
+MultiServerSocket::Stats MultiServerSocket::stats() {
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
+    return stats_;
+}
+
+void MultiServerSocket::settimeout(py::object timeout_s_or_none) {
+    if (timeout_s_or_none.is_none()) {
+        timeout_ms_ = -1;
+    } else {
+        timeout_ms_ = (int64_t) (py::cast<double>(timeout_s_or_none) * 1000.0);
+        timeout_ms_ = std::max<int64_t>(timeout_ms_, 0);
+    }
+}
+
+py::object MultiServerSocket::gettimeout() const {
+    if (timeout_ms_ < 0) {
+        return py::none();
+    }
+    return py::float_(timeout_ms_ / 1000.0);
+}
+
+py::object MultiServerSocket::__getattr__(py::object name) {
+    if (py::cast<string>(name) == "py_socket") {
+        return py_socket_;
+    } else {
+        return call_method<py::object>(py_socket_, "__getattribute__", name);
+    }
+}
+
+void MultiServerSocket::__setattr__(py::object name, py::object value) {
+    if (py::cast<string>(name) == "py_socket") {
+        py_socket_ = value;
+    } else {
+        call_method<py::object>(py_socket_, "__setattribute__", name, value);
+    }
+}
+
+} // namespace ssl
@@ -0,0 +1,179 @@
+/*
+ * Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef PYMBEDTLS_MULTI_SERVER_SOCKET_HPP
+#define PYMBEDTLS_MULTI_SERVER_SOCKET_HPP
+
+#include <mbedtls/ctr_drbg.h>
+#include <mbedtls/entropy.h>
+#include <mbedtls/ssl.h>
+#include <mbedtls/ssl_cookie.h>
+
+#include <chrono>
+#include <cstdint>
+#include <deque>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <unordered_map>
+#include <utility>
+
+#include "address.hpp"
+#include "pybind11_interop.hpp"
+
+namespace ssl {
+
+class Context;
+
+/**
+ * DTLS server endpoint that terminates sessions with any number of peers on
+ * a single, unconnected UDP socket.
+ *
+ * Every datagram is routed to the session of the address it came from. A
+ * ClientHello from an unknown address is answered with a stateless
+ * HelloVerifyRequest; mbedTLS state for the peer is only allocated once it
+ * repeats the ClientHello with a valid cookie, so spoofed or flooding
+ * clients cost nothing but a single response each.
+ *
+ * If the context has a connection_id, each peer gets a distinct connection
+ * ID: the configured one followed by a 32-bit peer number. Records carrying
+ * a connection ID are routed by it rather than by their source address, and
+ * once such a record from a new address is authenticated, the session
+ * migrates there, so that NAT rebinding does not require a new handshake.
+ *
+ * All I/O is done on the file descriptor with the GIL released.
+ */
+class MultiServerSocket {
+public:
+    struct Stats {
+        uint64_t hello_verify_requests;
+        uint64_t handshakes;
+        uint64_t failed_handshakes;
+        uint64_t reconnects;
+        uint64_t dropped_datagrams;
+        // sessions moved to a new client address
+        uint64_t migrations;
+        // migrations of established sessions, each of which would have
+        // required a new handshake without connection IDs
+        uint64_t handshakes_avoided;
+    };
+
+private:
+    using Clock = std::chrono::steady_clock;
+
+    // Retransmission timer of a single peer, in the format expected by
+    // mbedtls_ssl_set_timer_cb(); unlike mbedtls_timing_delay_context, it
+    // exposes its deadline, so that all timers can be waited for at once.
+    struct Timer {
+        bool armed;
+        Clock::time_point intermediate;
+        Clock::time_point final;
+
+        Timer() : armed(false) {}
+
+        static void set(void *self, uint32_t int_ms, uint32_t fin_ms);
+        static int get(void *self);
+    };
+
+    struct Peer {
+        MultiServerSocket *owner;
+        Address address;
+        // connection ID the peer uses to address its records to us; empty
+        // if connection IDs are disabled
+        std::string cid;
+        mbedtls_ssl_context ssl;
+        Timer timer;
+        bool established;
+        // whether the handshake in progress resumes a previous session
+        bool resumed;
+        Clock::time_point last_activity;
+        // datagram passed to mbedTLS by the next _recv() call
+        const unsigned char *pending;
+        size_t pending_size;
+
+        Peer(MultiServerSocket *owner, const Address &address);
+        ~Peer();
+        Peer(const Peer &) = delete;
+        Peer &operator=(const Peer &) = delete;
+    };
+
+    std::shared_ptr<Context> context_;
+    py::object py_socket_;
+    int fd_;
+    int last_errno_;
+    // read timeout in ms; negative means "wait indefinitely"
+    int64_t timeout_ms_;
+    size_t max_peers_;
+    // size of per-peer connection IDs, 0 if they are disabled
+    size_t cid_size_;
+    uint32_t next_peer_number_;
+
+    mbedtls_ssl_cookie_ctx cookie_;
+    mbedtls_ssl_config config_;
+    mbedtls_entropy_context entropy_;
+    mbedtls_ctr_drbg_context rng_;
+
+    // Guards everything below. Like Socket::mutex_, it is released while
+    // waiting for data, so that sendto() may be called from other threads.
+    std::mutex mutex_;
+    std::unordered_map<Address, std::unique_ptr<Peer>> peers_;
+    // the same peers, keyed by Peer::cid; entries are managed by Peer
+    std::unordered_map<std::string, Peer *> peers_by_cid_;
+    // plaintext received, but not yet returned by recvfrom()
+    std::deque<std::pair<Address, std::string>> received_;
+    Stats stats_;
+    unsigned char datagram_[65536];
+    unsigned char plaintext_[65536];
+
+    static int _send(void *peer, const unsigned char *buf, size_t len);
+    static int _recv(void *peer, unsigned char *buf, size_t len);
+
+    void update_fd();
+    int send_datagram(const Address &address,
+                      const unsigned char *buf,
+                      size_t len);
+    void handle_datagram(const Address &address, size_t len);
+    bool verify_client_hello(const Address &address, size_t len);
+    void process(Peer &peer, const Address &source);
+    void migrate_peer(Peer &peer, const Address &address);
+    void reset_peer(Peer &peer);
+    int wait_timeout_ms(Clock::time_point deadline, bool has_deadline) const;
+    void handle_timers();
+    int receive(Address &address, std::string &data);
+
+public:
+    MultiServerSocket(std::shared_ptr<Context> context,
+                      py::object py_socket,
+                      size_t max_peers,
+                      py::object handshake_timeouts_s);
+    ~MultiServerSocket();
+
+    py::tuple recvfrom(size_t bufsize);
+    void sendto(py::object data, py::tuple host_port);
+    py::list peers();
+    bool close_peer(py::tuple host_port);
+    size_t forget_idle_peers(double max_idle_s);
+    Stats stats();
+
+    void settimeout(py::object timeout_s_or_none);
+    py::object gettimeout() const;
+    py::object __getattr__(py::object name);
+    void __setattr__(py::object name, py::object value);
+};
+
+} // namespace ssl
+
+#endif // PYMBEDTLS_MULTI_SERVER_SOCKET_HPP
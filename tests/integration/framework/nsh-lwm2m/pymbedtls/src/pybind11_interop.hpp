@@ -39,4 +39,38 @@ call_method(py::object py_object, const char *name, Args &&... args) {
     (void) f(std::forward<Args>(args)...);
 }
 
+/**
+ * Contiguous memory of a Python object supporting the buffer protocol
+ * (bytes, bytearray, memoryview, mmap, ...), accessible without copying.
+ * While it exists, the object cannot be resized, so the memory may be used
+ * with the GIL released; the view itself must be created and destroyed
+ * with the GIL held.
+ */
+class BufferView {
+    Py_buffer view_;
+
+public:
+    BufferView(py::handle object, bool writable) {
+        if (PyObject_GetBuffer(object.ptr(), &view_,
+                               writable ? PyBUF_WRITABLE : PyBUF_SIMPLE)) {
+            throw py::error_already_set();
+        }
+    }
+
+    ~BufferView() {
+        PyBuffer_Release(&view_);
+    }
+
+    BufferView(const BufferView &) = delete;
+    BufferView &operator=(const BufferView &) = delete;
+
+    unsigned char *data() const {
+        return static_cast<unsigned char *>(view_.buf);
+    }
+
+    size_t size() const {
+        return (size_t) view_.len;
+    }
+};
+
 #endif // PYMBEDTLS_PYBIND11_INTEROP
@@ -15,8 +15,11 @@
  */
 
 #include <string>
+#include <vector>
 
+#include "aead.hpp"
 #include "context.hpp"
+#include "multi_server_socket.hpp"
 #include "security.hpp"
 #include "socket.hpp"
 
@@ -47,6 +50,20 @@ PYBIND11_MODULE(pymbedtls, m) {
                  py::arg("key"),
                  py::arg("identity"));
 
+    py::class_<PskStoreSecurity, SecurityInfo, shared_ptr<PskStoreSecurity>>(
+            m, "PskStoreSecurity")
+            .def(py::init<>())
+            .def("set", &PskStoreSecurity::set, py::arg("identity"),
+                 py::arg("key"))
+            .def("update", &PskStoreSecurity::update, py::arg("keys"),
+                 py::call_guard<py::gil_scoped_release>())
+            .def("load", &PskStoreSecurity::load, py::arg("path"),
+                 py::call_guard<py::gil_scoped_release>())
+            .def("remove", &PskStoreSecurity::remove, py::arg("identity"))
+            .def("clear", &PskStoreSecurity::clear)
+            .def("__contains__", &PskStoreSecurity::contains)
+            .def("__len__", &PskStoreSecurity::size);
+
     py::class_<CertSecurity, SecurityInfo, shared_ptr<CertSecurity>>(
             m, "CertSecurity")
             .def(py::init<const char *, const char *, const char *,
@@ -54,18 +71,50 @@ PYBIND11_MODULE(pymbedtls, m) {
                  py::arg("ca_path"),
                  py::arg("ca_file"),
                  py::arg("crt_file"),
-                 py::arg("key_file"));
+                 py::arg("key_file"))
+            .def(py::init<const vector<string> &, const string &,
+                          const string &>(),
+                 py::arg("ca_certs"),
+                 py::arg("crt"),
+                 py::arg("key"));
+
+    py::class_<AesCcm>(m, "AesCcm")
+            .def(py::init<const string &, size_t>(), py::arg("key"),
+                 py::arg("tag_size"))
+            .def_property_readonly("tag_size", &AesCcm::tag_size)
+            .def("encrypt", &AesCcm::encrypt, py::arg("nonce"), py::arg("aad"),
+                 py::arg("buffer"), py::arg("length"))
+            .def("decrypt", &AesCcm::decrypt, py::arg("nonce"), py::arg("aad"),
+                 py::arg("buffer"), py::arg("length"));
+
+    py::class_<HandshakeStats>(m, "HandshakeStats")
+            .def_readonly("full", &HandshakeStats::full)
+            .def_readonly("abbreviated", &HandshakeStats::abbreviated);
 
     py::class_<Context, shared_ptr<Context>>(m, "Context")
-            .def(py::init<shared_ptr<SecurityInfo>, bool, std::string>(),
+            .def(py::init<shared_ptr<SecurityInfo>, bool, std::string, int,
+                          int, bool, const vector<int> &>(),
                  py::arg("security"),
                  py::arg("debug") = false,
-                 py::arg("connection_id") = "")
+                 py::arg("connection_id") = "",
+                 py::arg("session_cache_size") =
+                         MBEDTLS_SSL_CACHE_DEFAULT_MAX_ENTRIES,
+                 py::arg("session_ttl_s") = MBEDTLS_SSL_CACHE_DEFAULT_TIMEOUT,
+                 py::arg("session_tickets") = false,
+                 py::arg("ciphersuites") = vector<int>())
+            .def("handshake_stats", &Context::handshake_stats)
             .def_static("supports_connection_id", []() -> bool {
 #if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
                 return true;
 #else
                     return false;
+#endif
+            })
+            .def_static("supports_session_tickets", []() -> bool {
+#if defined(MBEDTLS_SSL_SESSION_TICKETS)
+                return true;
+#else
+                    return false;
 #endif
             });
 
@@ -78,6 +127,41 @@ PYBIND11_MODULE(pymbedtls, m) {
             .def("__getattr__", &ServerSocket::__getattr__)
             .def("__setattr__", &ServerSocket::__setattr__);
 
+    auto multi_server_socket_scope =
+            py::class_<MultiServerSocket>(m, "MultiServerSocket")
+                    .def(py::init<shared_ptr<Context>, py::object, size_t,
+                                  py::object>(),
+                         py::arg("context"),
+                         py::arg("socket"),
+                         py::arg("max_peers") = 0,
+                         py::arg("handshake_timeouts_s") = py::none())
+                    .def("recvfrom", &MultiServerSocket::recvfrom,
+                         py::arg("bufsize") = 65536)
+                    .def("sendto", &MultiServerSocket::sendto)
+                    .def("peers", &MultiServerSocket::peers)
+                    .def("close_peer", &MultiServerSocket::close_peer)
+                    .def("forget_idle_peers",
+                         &MultiServerSocket::forget_idle_peers,
+                         py::arg("max_idle_s"))
+                    .def("stats", &MultiServerSocket::stats)
+                    .def("settimeout", &MultiServerSocket::settimeout)
+                    .def("gettimeout", &MultiServerSocket::gettimeout)
+                    .def("__getattr__", &MultiServerSocket::__getattr__)
+                    .def("__setattr__", &MultiServerSocket::__setattr__);
+
+    py::class_<MultiServerSocket::Stats>(multi_server_socket_scope, "Stats")
+            .def_readonly("hello_verify_requests",
+                          &MultiServerSocket::Stats::hello_verify_requests)
+            .def_readonly("handshakes", &MultiServerSocket::Stats::handshakes)
+            .def_readonly("failed_handshakes",
+                          &MultiServerSocket::Stats::failed_handshakes)
+            .def_readonly("reconnects", &MultiServerSocket::Stats::reconnects)
+            .def_readonly("dropped_datagrams",
+                          &MultiServerSocket::Stats::dropped_datagrams)
+            .def_readonly("migrations", &MultiServerSocket::Stats::migrations)
+            .def_readonly("handshakes_avoided",
+                          &MultiServerSocket::Stats::handshakes_avoided);
+
     auto socket_scope =
             py::class_<Socket>(m, "Socket")
                     .def(py::init<shared_ptr<Context>, py::object,
@@ -91,13 +175,23 @@ PYBIND11_MODULE(pymbedtls, m) {
                     .def("sendall", &Socket::send)
                     .def("sendto", &method_unimplemented<string, py::object>)
                     .def("recv", &Socket::recv)
-                    .def("recv_into", &method_unimplemented<py::object>)
+                    .def("recv_into", &Socket::recv_into, py::arg("buffer"),
+                         py::arg("nbytes") = 0)
                     .def("recvfrom", &method_unimplemented<int>)
                     .def("recvfrom_into", &method_unimplemented<py::object>)
                     .def("settimeout", &Socket::settimeout)
+                    .def("io_stats", &Socket::io_stats,
+                         py::call_guard<py::gil_scoped_release>())
                     .def("__getattr__", &Socket::__getattr__)
                     .def("__setattr__", &Socket::__setattr__);
 
+    py::class_<Socket::IoStats>(socket_scope, "IoStats")
+            .def_readonly("datagrams_sent", &Socket::IoStats::datagrams_sent)
+            .def_readonly("bytes_sent", &Socket::IoStats::bytes_sent)
+            .def_readonly("datagrams_received",
+                          &Socket::IoStats::datagrams_received)
+            .def_readonly("bytes_received", &Socket::IoStats::bytes_received);
+
     py::enum_<SocketType>(socket_scope, "Type")
             .value("Client", SocketType::Client)
             .value("Server", SocketType::Server)
@@ -14,11 +14,14 @@
  * limitations under the License.
  */
 
+#include <cctype>
+#include <fstream>
 #include <stdexcept>
+#include <utility>
+#include <vector>
 
 #include "common.hpp"
 #include "security.hpp"
-#include "socket.hpp"
 
 #include "pybind11_interop.hpp"
 
@@ -26,22 +29,169 @@ using namespace std;
 
 namespace ssl {
 
-void PskSecurity::configure(Socket &socket) {
-    mbedtls_ssl_conf_psk(&socket.config_,
+namespace {
+
+int psk_ciphersuites[2] = { MBEDTLS_TLS_PSK_WITH_AES_128_CCM_8, 0 };
+
+int hex_digit(char c) {
+    if (c >= '0' && c <= '9') {
+        return c - '0';
+    } else if (c >= 'a' && c <= 'f') {
+        return c - 'a' + 10;
+    } else if (c >= 'A' && c <= 'F') {
+        return c - 'A' + 10;
+    }
+    return -1;
+}
+
+bool unhexlify(const string &hex, string &out) {
+    if (hex.size() % 2) {
+        return false;
+    }
+    out.resize(hex.size() / 2);
+    for (size_t i = 0; i < out.size(); ++i) {
+        int high = hex_digit(hex[2 * i]);
+        int low = hex_digit(hex[2 * i + 1]);
+        if (high < 0 || low < 0) {
+            return false;
+        }
+        out[i] = (char) ((high << 4) | low);
+    }
+    return true;
+}
+
+string strip(const string &str) {
+    size_t begin = 0;
+    size_t end = str.size();
+    while (begin < end && isspace((unsigned char) str[begin])) {
+        ++begin;
+    }
+    while (end > begin && isspace((unsigned char) str[end - 1])) {
+        --end;
+    }
+    return str.substr(begin, end - begin);
+}
+
+// Like mbedtls_pk_load_file(): PEM data needs to be NUL-terminated, with the
+// terminator included in its length, while DER data must not include it.
+vector<unsigned char> parser_input(const string &data) {
+    vector<unsigned char> result(data.begin(), data.end());
+    if (data.find("-----BEGIN ") != string::npos) {
+        result.push_back('\0');
+    }
+    return result;
+}
+
+} // namespace
+
+void PskSecurity::configure(mbedtls_ssl_config &config) {
+    mbedtls_ssl_conf_psk(&config,
                          reinterpret_cast<const unsigned char *>(key_.data()),
                          key_.size(),
                          reinterpret_cast<const unsigned char *>(
                                  identity_.data()),
                          identity_.size());
-
-    static int psk_ciphersuites[2] = { MBEDTLS_TLS_PSK_WITH_AES_128_CCM_8, 0 };
-    mbedtls_ssl_conf_ciphersuites(&socket.config_, psk_ciphersuites);
+    mbedtls_ssl_conf_ciphersuites(&config, psk_ciphersuites);
 }
 
 string PskSecurity::name() const {
     return "psk";
 }
 
+int PskStoreSecurity::psk_callback(void *self,
+                                   mbedtls_ssl_context *ssl,
+                                   const unsigned char *identity,
+                                   size_t identity_len) {
+    PskStoreSecurity *store = reinterpret_cast<PskStoreSecurity *>(self);
+    lock_guard<mutex> lock(store->mutex_);
+
+    auto it = store->keys_.find(
+            string(reinterpret_cast<const char *>(identity), identity_len));
+    if (it == store->keys_.end()) {
+        // makes mbedTLS send the unknown_psk_identity alert
+        return -1;
+    }
+    return mbedtls_ssl_set_hs_psk(
+            ssl, reinterpret_cast<const unsigned char *>(it->second.data()),
+            it->second.size());
+}
+
+void PskStoreSecurity::set(const string &identity, const string &key) {
+    lock_guard<mutex> lock(mutex_);
+    keys_[identity] = key;
+}
+
+void PskStoreSecurity::update(const unordered_map<string, string> &keys) {
+    lock_guard<mutex> lock(mutex_);
+    keys_.reserve(keys_.size() + keys.size());
+    for (const auto &entry : keys) {
+        keys_[entry.first] = entry.second;
+    }
+}
+
+size_t PskStoreSecurity::load(const string &path) {
+    ifstream file(path);
+    if (!file) {
+        throw runtime_error("could not open " + path);
+    }
+
+    // parse everything first, so that a malformed file changes nothing
+    vector<pair<string, string>> keys;
+    string line;
+    for (size_t line_number = 1; getline(file, line); ++line_number) {
+        line = strip(line);
+        if (line.empty() || line[0] == '#') {
+            continue;
+        }
+        const size_t separator = line.find(':');
+        pair<string, string> entry;
+        if (separator == string::npos
+                || !unhexlify(strip(line.substr(0, separator)), entry.first)
+                || !unhexlify(strip(line.substr(separator + 1)),
+                              entry.second)) {
+            throw invalid_argument(path + ":" + std::to_string(line_number)
+                                   + ": expected hex-encoded identity:key");
+        }
+        keys.push_back(std::move(entry));
+    }
+
+    lock_guard<mutex> lock(mutex_);
+    keys_.reserve(keys_.size() + keys.size());
+    for (auto &entry : keys) {
+        keys_[std::move(entry.first)] = std::move(entry.second);
+    }
+    return keys.size();
+}
+
+bool PskStoreSecurity::remove(const string &identity) {
+    lock_guard<mutex> lock(mutex_);
+    return keys_.erase(identity) > 0;
+}
+
+void PskStoreSecurity::clear() {
+    lock_guard<mutex> lock(mutex_);
+    keys_.clear();
+}
+
+bool PskStoreSecurity::contains(const string &identity) const {
+    lock_guard<mutex> lock(mutex_);
+    return keys_.count(identity) > 0;
+}
+
+size_t PskStoreSecurity::size() const {
+    lock_guard<mutex> lock(mutex_);
+    return keys_.size();
+}
+
+void PskStoreSecurity::configure(mbedtls_ssl_config &config) {
+    mbedtls_ssl_conf_psk_cb(&config, &PskStoreSecurity::psk_callback, this);
+    mbedtls_ssl_conf_ciphersuites(&config, psk_ciphersuites);
+}
+
+string PskStoreSecurity::name() const {
+    return "psk";
+}
+
 CertSecurity::CertSecurity(const char *ca_path,
                            const char *ca_file,
                            const char *crt_file,
@@ -78,26 +228,58 @@ CertSecurity::CertSecurity(const char *ca_path,
     }
 }
 
+CertSecurity::CertSecurity(const vector<string> &ca_certs,
+                           const string &crt,
+                           const string &key)
+        : configure_ca_(!ca_certs.empty()),
+          configure_crt_(!crt.empty() && !key.empty()) {
+    mbedtls_pk_init(&pk_ctx_);
+    mbedtls_x509_crt_init(&ca_certs_);
+    mbedtls_x509_crt_init(&crt_);
+
+    int result;
+    for (const string &ca_cert : ca_certs) {
+        const vector<unsigned char> input = parser_input(ca_cert);
+        if ((result = mbedtls_x509_crt_parse(&ca_certs_, input.data(),
+                                             input.size()))) {
+            throw mbedtls_error("Could not parse CA certificate", result);
+        }
+    }
+    if (!key.empty()) {
+        const vector<unsigned char> input = parser_input(key);
+        if ((result = mbedtls_pk_parse_key(&pk_ctx_, input.data(),
+                                           input.size(), nullptr, 0))) {
+            throw mbedtls_error("Could not parse private key", result);
+        }
+    }
+    if (!crt.empty()) {
+        const vector<unsigned char> input = parser_input(crt);
+        if ((result = mbedtls_x509_crt_parse(&crt_, input.data(),
+                                             input.size()))) {
+            throw mbedtls_error("Could not parse certificate", result);
+        }
+    }
+}
+
 CertSecurity::~CertSecurity() {
     mbedtls_x509_crt_free(&crt_);
     mbedtls_x509_crt_free(&ca_certs_);
     mbedtls_pk_free(&pk_ctx_);
 }
 
-void CertSecurity::configure(Socket &socket) {
+void CertSecurity::configure(mbedtls_ssl_config &config) {
     static int cert_ciphersuites[2] = {
         MBEDTLS_TLS_ECDHE_ECDSA_WITH_AES_128_CCM_8, 0
     };
-    mbedtls_ssl_conf_ciphersuites(&socket.config_, cert_ciphersuites);
-    mbedtls_ssl_conf_authmode(&socket.config_, MBEDTLS_SSL_VERIFY_NONE);
+    mbedtls_ssl_conf_ciphersuites(&config, cert_ciphersuites);
+    mbedtls_ssl_conf_authmode(&config, MBEDTLS_SSL_VERIFY_NONE);
 
     if (configure_ca_) {
-        mbedtls_ssl_conf_authmode(&socket.config_, MBEDTLS_SSL_VERIFY_REQUIRED);
-        mbedtls_ssl_conf_ca_chain(&socket.config_, &ca_certs_, nullptr);
+        mbedtls_ssl_conf_authmode(&config, MBEDTLS_SSL_VERIFY_REQUIRED);
+        mbedtls_ssl_conf_ca_chain(&config, &ca_certs_, nullptr);
     }
     if (configure_crt_) {
-        int result =
-                mbedtls_ssl_conf_own_cert(&socket.config_, &crt_, &pk_ctx_);
+        int result = mbedtls_ssl_conf_own_cert(&config, &crt_, &pk_ctx_);
         if (result) {
             throw mbedtls_error("Could not set own certificate", result);
         }
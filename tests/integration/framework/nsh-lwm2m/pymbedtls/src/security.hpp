@@ -18,15 +18,17 @@
 #define PYMBEDTLS_SECURITY_H
 #include <mbedtls/ssl.h>
 
+#include <mutex>
 #include <string>
+#include <unordered_map>
+#include <vector>
 
 namespace ssl {
-class Socket;
 
 class SecurityInfo {
 public:
     virtual ~SecurityInfo() = default;
-    virtual void configure(Socket &socket) = 0;
+    virtual void configure(mbedtls_ssl_config &config) = 0;
     virtual std::string name() const = 0;
 };
 
@@ -40,7 +42,41 @@ public:
 
     PskSecurity() = default;
     PskSecurity(const PskSecurity &) = default;
-    virtual void configure(Socket &socket);
+    virtual void configure(mbedtls_ssl_config &config);
+    virtual std::string name() const;
+};
+
+/**
+ * Server-side PSK security with any number of identities. Keys are looked up
+ * by identity during the handshake, in a hash map that may be modified at
+ * any time, also while handshakes are in progress.
+ */
+class PskStoreSecurity : public SecurityInfo {
+    mutable std::mutex mutex_;
+    std::unordered_map<std::string, std::string> keys_;
+
+    static int psk_callback(void *self,
+                            mbedtls_ssl_context *ssl,
+                            const unsigned char *identity,
+                            size_t identity_len);
+
+public:
+    PskStoreSecurity() = default;
+
+    void set(const std::string &identity, const std::string &key);
+    void update(const std::unordered_map<std::string, std::string> &keys);
+    /**
+     * Adds all identities from a text file with one "identity:key" pair per
+     * line, both hex-encoded. Empty lines and lines starting with '#' are
+     * ignored. Returns the number of identities read.
+     */
+    size_t load(const std::string &path);
+    bool remove(const std::string &identity);
+    void clear();
+    bool contains(const std::string &identity) const;
+    size_t size() const;
+
+    virtual void configure(mbedtls_ssl_config &config);
     virtual std::string name() const;
 };
 
@@ -64,11 +100,23 @@ public:
                  const char *crt_file,
                  const char *key_file);
 
+    /**
+     * Same as above, but takes the PEM/DER encoded contents of the files
+     * instead of their paths. Empty @p crt or @p key mean none.
+     *
+     * @param ca_certs Top-level CA(s), one element per file
+     * @param crt      Client/server certificates
+     * @param key      Client/server key
+     */
+    CertSecurity(const std::vector<std::string> &ca_certs,
+                 const std::string &crt,
+                 const std::string &key);
+
     virtual ~CertSecurity();
 
     CertSecurity() = default;
     CertSecurity(const CertSecurity &) = default;
-    virtual void configure(Socket &socket);
+    virtual void configure(mbedtls_ssl_config &config);
     virtual std::string name() const;
 };
 
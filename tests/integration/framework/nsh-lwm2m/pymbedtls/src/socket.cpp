@@ -14,12 +14,15 @@
  * limitations under the License.
  */
 
+#include <cerrno>
 #include <chrono>
 #include <sstream>
 #include <stdexcept>
+#include <system_error>
 
 #include <arpa/inet.h>
 
+#include <poll.h>
 #include <sys/socket.h>
 #include <sys/types.h>
 
@@ -31,43 +34,27 @@
 using namespace std;
 using namespace chrono;
 
-namespace {
-
-int process_python_socket_error(py::error_already_set &err, int default_err) {
-    // Ensure that the `socket` in the eval below is actually python
-    // socket, and not some module found in the context of python code
-    // that caused this _recv() to be called on c++ side.
-    py::object scope = py::module::import("socket").attr("__dict__");
-
-    if (err.matches(py::eval("timeout", scope))) {
-        return MBEDTLS_ERR_SSL_TIMEOUT;
-    } else {
-        return default_err;
-    }
-}
-
-} // namespace
-
 namespace ssl {
 
-int Socket::_send(void *self, const unsigned char *buf, size_t len) try {
+int Socket::_send(void *self, const unsigned char *buf, size_t len) {
     Socket *socket = reinterpret_cast<Socket *>(self);
 
-    call_method<void>(
-            socket->py_socket_, "sendall",
-            py::reinterpret_borrow<py::object>(
-                    PyMemoryView_FromMemory((char *) buf, len, PyBUF_READ)));
-    return (int) len;
-} catch (py::error_already_set &err) {
-    return process_python_socket_error(err, MBEDTLS_ERR_NET_SEND_FAILED);
-}
-
-namespace {
-std::tuple<string, int> host_port_to_std_tuple(py::tuple host_port) {
-    return std::make_tuple(py::cast<std::string>(host_port[0]),
-                           py::cast<int>(host_port[1]));
+    for (;;) {
+        ssize_t sent = ::send(socket->fd_, buf, len, 0);
+        if (sent >= 0) {
+            ++socket->io_stats_.datagrams_sent;
+            socket->io_stats_.bytes_sent += (uint64_t) sent;
+            return (int) sent;
+        } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+            // the Python socket is in non-blocking mode if it has a timeout
+            pollfd pfd = { socket->fd_, POLLOUT, 0 };
+            (void) poll(&pfd, 1, -1);
+        } else if (errno != EINTR) {
+            socket->last_errno_ = errno;
+            return MBEDTLS_ERR_NET_SEND_FAILED;
+        }
+    }
 }
-} // namespace
 
 int Socket::_recv(void *self,
                   unsigned char *buf,
@@ -75,126 +62,100 @@ int Socket::_recv(void *self,
                   uint32_t timeout_ms) {
     Socket *socket = reinterpret_cast<Socket *>(self);
 
-    py::object py_buf = py::reinterpret_borrow<py::object>(
-            PyMemoryView_FromMemory((char *) buf, len, PyBUF_WRITE));
-
-    class TimeoutRestorer {
-        Socket *socket_;
-        py::object orig_timeout_s_;
-        bool restored_;
-
-    public:
-        TimeoutRestorer(Socket *socket)
-                : socket_(socket),
-                  orig_timeout_s_(call_method<py::object>(socket_->py_socket_,
-                                                          "gettimeout")),
-                  restored_(false) {}
-
-        void restore() {
-            if (!restored_) {
-                call_method<void>(socket_->py_socket_, "settimeout",
-                                  orig_timeout_s_);
-                restored_ = true;
-            }
-        }
+    // timeout_ms == 0 means "wait indefinitely"
+    const auto deadline = steady_clock::now() + milliseconds(timeout_ms);
 
-        ~TimeoutRestorer() {
-            restore();
+    for (;;) {
+        int poll_timeout_ms = -1;
+        if (timeout_ms != 0) {
+            auto remaining_ms =
+                    duration_cast<milliseconds>(deadline - steady_clock::now())
+                            .count();
+            poll_timeout_ms =
+                    (int) max<decltype(remaining_ms)>(remaining_ms, 0);
         }
-    } timeout_restorer{ socket };
-
-    if (timeout_ms == 0) {
-        timeout_ms = UINT32_MAX;
-    }
-
-    int bytes_received = 0;
-    do {
-        try {
-            if (timeout_ms == UINT32_MAX) {
-                call_method<void>(socket->py_socket_, "settimeout", py::none());
-            } else {
-                call_method<void>(socket->py_socket_, "settimeout",
-                                  timeout_ms / 1000.0);
-            }
 
-            const auto before_recv = steady_clock::now();
-            py::tuple num_received_and_peer =
-                    call_method<py::tuple>(socket->py_socket_, "recvfrom_into",
-                                           py_buf);
-            if (timeout_ms != UINT32_MAX) {
-                auto elapsed_ms = duration_cast<milliseconds>(
-                                          steady_clock::now() - before_recv)
-                                          .count();
-                if (elapsed_ms > timeout_ms) {
-                    timeout_ms = 0;
-                } else {
-                    timeout_ms -= elapsed_ms;
-                }
+        pollfd pfd = { socket->fd_, POLLIN, 0 };
+        socket->mutex_.unlock();
+        int poll_result = poll(&pfd, 1, poll_timeout_ms);
+        int poll_errno = errno;
+        socket->mutex_.lock();
+
+        if (poll_result == 0) {
+            return MBEDTLS_ERR_SSL_TIMEOUT;
+        } else if (poll_result < 0) {
+            if (poll_errno == EINTR) {
+                // give the caller a chance to handle signals
+                return MBEDTLS_ERR_SSL_WANT_READ;
             }
+            socket->last_errno_ = poll_errno;
+            return MBEDTLS_ERR_NET_RECV_FAILED;
+        }
 
-            bytes_received = py::cast<int>(num_received_and_peer[0]);
-
-            // Unfortunately directly comparing two py::tuples yields false,
-            // if they're not the same objects.
-            auto peer_host_port_tuple =
-                    py::cast<py::tuple>(num_received_and_peer[1]);
-            auto recv_host_port = host_port_to_std_tuple(peer_host_port_tuple);
-
-            if (socket->client_host_and_port_ != recv_host_port) {
-                if (!socket->in_handshake_
-                        && socket->context_->connection_id().size()) {
-                    // The message may still originate from an endpoint that we
-                    // know, but we cannot verify it at this stage, because no
-                    // TLS record parsing has been made. We need to delay it
-                    // till mbedtls_ssl_read() finishes.
-                    socket->last_recv_host_and_port_ = recv_host_port;
-                } else {
-                    // ignore this message.
-                    continue;
-                }
+        Address peer;
+        socklen_t peer_size = peer.capacity();
+        ssize_t received = recvfrom(socket->fd_, buf, len, MSG_DONTWAIT,
+                                    peer.get(), &peer_size);
+        if (received < 0) {
+            if (errno == EAGAIN || errno == EWOULDBLOCK) {
+                continue;
+            } else if (errno == EINTR) {
+                return MBEDTLS_ERR_SSL_WANT_READ;
             }
-
-            // Ensure that we're still connected to the known (host, port). We
-            // may not be, if someone "disconnected" the socket to test
-            // connection_id behavior.
-            call_method<void>(socket->py_socket_, "connect",
-                              socket->client_host_and_port_);
-            break;
-        } catch (py::error_already_set &err) {
-            bytes_received =
-                    process_python_socket_error(err,
-                                                MBEDTLS_ERR_NET_RECV_FAILED);
-            if (!socket->in_handshake_) {
-                // HACK: it's there, explicitly called, because for some reason
-                // you can't call settimeout() when the "error is restored", and
-                // very weird things happen if you try to do it.
-                timeout_restorer.restore();
-                err.restore();
+            socket->last_errno_ = errno;
+            return MBEDTLS_ERR_NET_RECV_FAILED;
+        }
+        peer.set_size(peer_size);
+
+        if (socket->client_addr_ != peer) {
+            const string connection_id = socket->context_->connection_id();
+            if (connection_id.empty()
+                    || record_cid(buf, (size_t) received, connection_id.size())
+                               != connection_id) {
+                // ignore this message.
+                continue;
             }
-            break;
+            // The record carries our connection_id, so it may originate from
+            // the same client at a new address, e.g. after NAT rebinding. We
+            // cannot verify that before mbedTLS authenticates the record, so
+            // the address is only adopted by adopt_last_recv_addr() then.
         }
-    } while (timeout_ms > 0);
-
-    return bytes_received;
+        socket->last_recv_addr_ = peer;
+        ++socket->io_stats_.datagrams_received;
+        socket->io_stats_.bytes_received += (uint64_t) received;
+
+        // Ensure that we're still connected to the known (host, port). We
+        // may not be, if someone "disconnected" the socket to test
+        // connection_id behavior.
+        (void) ::connect(socket->fd_, socket->client_addr_.get(),
+                         socket->client_addr_.size());
+        return (int) received;
+    }
 }
 
-Socket::HandshakeResult Socket::do_handshake() {
-    class HandshakeRaii {
-        Socket &self_;
-
-    public:
-        HandshakeRaii(Socket &self) : self_(self) {
-            self_.in_handshake_ = true;
-        }
+void Socket::adopt_last_recv_addr() {
+    if (last_recv_addr_ != client_addr_) {
+        client_addr_ = last_recv_addr_;
+        (void) ::connect(fd_, client_addr_.get(), client_addr_.size());
+    }
+}
 
-        ~HandshakeRaii() {
-            self_.in_handshake_ = false;
-        }
-    } handshake_raii_(*this);
+void Socket::update_fd() {
+    fd_ = call_method<int>(py_socket_, "fileno");
+    last_errno_ = 0;
+}
 
+Socket::HandshakeResult Socket::do_handshake() {
+    bool resumed = false;
     for (;;) {
-        int result = mbedtls_ssl_handshake(&mbedtls_context_);
+        int result = Context::handshake_step(mbedtls_context_, resumed);
         if (result == 0) {
+            if (type_ == SocketType::Server) {
+                context_->record_handshake(resumed);
+            }
+            // the peer's Finished message might have been sent from a new
+            // address already
+            adopt_last_recv_addr();
             break;
         } else if (result == MBEDTLS_ERR_SSL_HELLO_VERIFY_REQUIRED) {
             // mbedtls is unable to continue in such case; one needs to
@@ -209,27 +170,17 @@ Socket::HandshakeResult Socket::do_handshake() {
     return HandshakeResult::Finished;
 }
 
-namespace {
-
-void debug_mbedtls(void * /*ctx*/,
-                   int /*level*/,
-                   const char *file,
-                   int line,
-                   const char *str) {
-    fprintf(stderr, "%s:%04d: %s", file, line, str);
-}
-
-} // namespace
-
 Socket::Socket(std::shared_ptr<Context> context,
                py::object py_socket,
                SocketType type)
         : context_(context),
           type_(type),
           py_socket_(py_socket),
-          in_handshake_(false),
-          client_host_and_port_(),
-          last_recv_host_and_port_() {
+          fd_(-1),
+          last_errno_(0),
+          client_addr_(),
+          last_recv_addr_(),
+          io_stats_() {
     mbedtls_ssl_init(&mbedtls_context_);
     // Zeroize cookie context. This prevents issue
     // https://github.com/ARMmbed/mbedtls/issues/843.
@@ -245,35 +196,10 @@ Socket::Socket(std::shared_ptr<Context> context,
         throw mbedtls_error("mbedtls_ctr_drbg_seed failed", result);
     }
 
-    result = mbedtls_ssl_config_defaults(&config_,
-                                         type == SocketType::Client
-                                                 ? MBEDTLS_SSL_IS_CLIENT
-                                                 : MBEDTLS_SSL_IS_SERVER,
-                                         MBEDTLS_SSL_TRANSPORT_DATAGRAM, // TODO
-                                         MBEDTLS_SSL_PRESET_DEFAULT);
-    if (result) {
-        throw mbedtls_error("mbedtls_ssl_config_defaults failed", result);
-    }
-
-    if (context_->debug()) {
-        mbedtls_ssl_conf_dbg(&config_, debug_mbedtls, NULL);
-    }
-
-    // TODO
-    mbedtls_ssl_conf_min_version(&config_, MBEDTLS_SSL_MAJOR_VERSION_3,
-                                 MBEDTLS_SSL_MINOR_VERSION_3);
-    mbedtls_ssl_conf_rng(&config_, mbedtls_ctr_drbg_random, &rng_);
-
-#if defined(MBEDTLS_SSL_DTLS_CONNECTION_ID)
-    if (context->connection_id().size() > 0
-            && (result = mbedtls_ssl_conf_cid(
-                        &config_, context->connection_id().size(),
-                        MBEDTLS_SSL_UNEXPECTED_CID_IGNORE))) {
-        throw mbedtls_error("mbedtls_ssl_conf_cid failed", result);
-    }
-#endif // MBEDTLS_SSL_DTLS_CONNECTION_ID
-
-    context_->security()->configure(*this);
+    context_->configure(config_,
+                        type == SocketType::Client ? MBEDTLS_SSL_IS_CLIENT
+                                                   : MBEDTLS_SSL_IS_SERVER,
+                        rng_);
 
     if ((result = mbedtls_ssl_cookie_setup(&cookie_, mbedtls_ctr_drbg_random,
                                            &rng_))) {
@@ -285,9 +211,6 @@ Socket::Socket(std::shared_ptr<Context> context,
                                   mbedtls_ssl_cookie_check,
                                   &cookie_);
 
-    mbedtls_ssl_conf_session_cache(&config_, context_->session_cache(),
-                                   mbedtls_ssl_cache_get,
-                                   mbedtls_ssl_cache_set);
     mbedtls_ssl_set_bio(&mbedtls_context_, this, &Socket::_send, NULL,
                         &Socket::_recv);
     mbedtls_ssl_set_timer_cb(&mbedtls_context_, &timer_,
@@ -318,8 +241,9 @@ Socket::~Socket() {
 }
 
 void Socket::connect(py::tuple host_port, py::object handshake_timeouts_s_) {
-    client_host_and_port_ = host_port_to_std_tuple(host_port);
-    last_recv_host_and_port_ = host_port_to_std_tuple(host_port);
+    update_fd();
+    client_addr_ = Address::from_python(fd_, host_port);
+    last_recv_addr_ = client_addr_;
 
     if (!handshake_timeouts_s_.is_none()) {
         auto handshake_timeouts_s = py::cast<py::tuple>(handshake_timeouts_s_);
@@ -329,6 +253,8 @@ void Socket::connect(py::tuple host_port, py::object handshake_timeouts_s_) {
                                            uint32_t(max * 1000.0));
     }
 
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
     HandshakeResult hs_result;
 
     do {
@@ -336,7 +262,7 @@ void Socket::connect(py::tuple host_port, py::object handshake_timeouts_s_) {
         if (result) {
             throw mbedtls_error("mbedtls_ssl_sssion_reset failed", result);
         }
-        string address = std::get<0>(client_host_and_port_);
+        string address = client_addr_.host();
         result = mbedtls_ssl_set_client_transport_id(
                 &mbedtls_context_,
                 reinterpret_cast<const unsigned char *>(address.c_str()),
@@ -345,19 +271,26 @@ void Socket::connect(py::tuple host_port, py::object handshake_timeouts_s_) {
             throw mbedtls_error("mbedtls_ssl_set_client_transport_id failed",
                                 result);
         }
-        call_method<void>(py_socket_, "connect", client_host_and_port_);
+        if (::connect(fd_, client_addr_.get(), client_addr_.size())) {
+            throw system_error(errno, generic_category(), "connect failed");
+        }
         hs_result = do_handshake();
     } while (hs_result == HandshakeResult::HelloVerifyRequired);
 }
 
-void Socket::send(const string &data) {
+void Socket::send(py::object data) {
+    update_fd();
+    // records are encrypted straight from the caller's buffer
+    const BufferView view(data, false);
+
+    py::gil_scoped_release release;
+    lock_guard<mutex> lock(mutex_);
     size_t total_sent = 0;
 
-    while (total_sent < data.size()) {
+    while (total_sent < view.size()) {
         int sent = mbedtls_ssl_write(&mbedtls_context_,
-                                     reinterpret_cast<const unsigned char *>(
-                                             &data[total_sent]),
-                                     data.size() - total_sent);
+                                     view.data() + total_sent,
+                                     view.size() - total_sent);
         if (sent < 0) {
             if (sent == MBEDTLS_ERR_SSL_WANT_READ
                     || sent == MBEDTLS_ERR_SSL_WANT_WRITE) {
@@ -371,41 +304,72 @@ void Socket::send(const string &data) {
     }
 }
 
-py::bytes Socket::recv(int) {
-    unsigned char buffer[65536];
+int Socket::read(unsigned char *buf, size_t len) {
+    update_fd();
 
     int result = 0;
-    do {
-        result = mbedtls_ssl_read(&mbedtls_context_, buffer, sizeof(buffer));
-    } while (result == MBEDTLS_ERR_SSL_WANT_READ
-             || result == MBEDTLS_ERR_SSL_WANT_WRITE);
+    for (;;) {
+        {
+            py::gil_scoped_release release;
+            lock_guard<mutex> lock(mutex_);
+
+            result = mbedtls_ssl_read(&mbedtls_context_, buf, len);
+            if (result == MBEDTLS_ERR_SSL_CLIENT_RECONNECT) {
+                try {
+                    do_handshake();
+                } catch (mbedtls_error &) {
+                    // ignore handshake errors, if any, to make sure that the
+                    // read error is the one that's actually thrown
+                }
+            } else if (result >= 0) {
+                // The record has been authenticated; if it came from a new
+                // address, connection_id verified it is the same client.
+                adopt_last_recv_addr();
+            }
+        }
 
-    if (result < 0) {
-        if (result == MBEDTLS_ERR_SSL_TIMEOUT
-                || result == MBEDTLS_ERR_NET_RECV_FAILED) {
+        if (result != MBEDTLS_ERR_SSL_WANT_READ
+                && result != MBEDTLS_ERR_SSL_WANT_WRITE) {
+            break;
+        }
+        if (PyErr_CheckSignals()) {
             throw py::error_already_set();
-        } else if (result == MBEDTLS_ERR_SSL_CLIENT_RECONNECT) {
-            try {
-                do_handshake();
-            } catch (mbedtls_error &) {
-                // ignore handshake errors, if any, to make sure that the
-                // read error is the one that's actually thrown
-            }
         }
-        throw mbedtls_error("mbedtls_ssl_read failed", result);
     }
 
-    if (last_recv_host_and_port_ != client_host_and_port_) {
-        // During Socket::_recv(), there had to be a message from a (host, port)
-        // we weren't sure about, but enabled connection_id verified it is the
-        // same client but from the different address. Let's adjust.
-        client_host_and_port_ = last_recv_host_and_port_;
-        call_method<void>(py_socket_, "connect", client_host_and_port_);
+    if (result < 0) {
+        raise_read_error(result, last_errno_, "mbedtls_ssl_read failed");
     }
+    return result;
+}
 
+py::bytes Socket::recv(int) {
+    unsigned char buffer[65536];
+    int result = read(buffer, sizeof(buffer));
     return py::bytes(reinterpret_cast<const char *>(buffer), result);
 }
 
+size_t Socket::recv_into(py::object buffer, size_t nbytes) {
+    const BufferView view(buffer, true);
+    if (nbytes > view.size()) {
+        throw invalid_argument("buffer too small for requested bytes");
+    }
+    // mbedTLS decrypts straight into the caller's buffer
+    const int result = read(view.data(), nbytes ? nbytes : view.size());
+
+    // mbedTLS keeps whatever did not fit for the next read; discard it, so
+    // that every call returns a single datagram, like socket.recv_into()
+    lock_guard<mutex> lock(mutex_);
+    unsigned char discarded[256];
+    while (mbedtls_ssl_get_bytes_avail(&mbedtls_context_) > 0) {
+        if (mbedtls_ssl_read(&mbedtls_context_, discarded, sizeof(discarded))
+                <= 0) {
+            break;
+        }
+    }
+    return (size_t) result;
+}
+
 void Socket::settimeout(py::object timeout_s_or_none) {
     uint32_t timeout_ms = 0; // no timeout
 
@@ -416,6 +380,11 @@ void Socket::settimeout(py::object timeout_s_or_none) {
     mbedtls_ssl_conf_read_timeout(&config_, timeout_ms);
 }
 
+Socket::IoStats Socket::io_stats() {
+    lock_guard<mutex> lock(mutex_);
+    return io_stats_;
+}
+
 py::object Socket::__getattr__(py::object name) {
     if (py::cast<string>(name) == "py_socket") {
         return py_socket_;
@@ -31,8 +31,11 @@
 #include <mbedtls/ssl_cookie.h>
 #include <mbedtls/timing.h>
 
+#include <cstdint>
 #include <memory>
+#include <mutex>
 
+#include "address.hpp"
 #include "pybind11_interop.hpp"
 
 namespace ssl {
@@ -41,9 +44,21 @@ class Context;
 enum class SocketType { Client, Server };
 
 class Socket {
-    friend class PskSecurity;
-    friend class CertSecurity;
-
+public:
+    /**
+     * Datagrams exchanged with the peer since the socket was created,
+     * including handshake messages and retransmissions. Datagrams dropped
+     * before reaching mbedTLS, e.g. ones from other endpoints, are not
+     * counted. Sizes are those of UDP payloads.
+     */
+    struct IoStats {
+        uint64_t datagrams_sent;
+        uint64_t bytes_sent;
+        uint64_t datagrams_received;
+        uint64_t bytes_received;
+    };
+
+private:
     enum class HandshakeResult { Finished, HelloVerifyRequired };
 
     std::shared_ptr<Context> context_;
@@ -56,24 +71,40 @@ class Socket {
 
     SocketType type_;
     py::object py_socket_;
-    bool in_handshake_;
+
+    // File descriptor of py_socket_, refreshed before every operation, so
+    // that the BIO callbacks can do the I/O without touching Python objects.
+    int fd_;
+    // errno of the last failed BIO operation, used to raise a matching
+    // OSError once the GIL is reacquired.
+    int last_errno_;
+    // Serializes operations on mbedtls_context_. All of them run with the
+    // GIL released; _recv() unlocks the mutex while it waits for data, so
+    // that other threads can send in the meantime.
+    std::mutex mutex_;
 
     // Used to match incoming packets with a client we initially are
     // connect()'ed to. It may change, if, for example connection_id extension
     // is used and we received a packet from a different endpoint but the
     // connection_id matched.
-    std::tuple<std::string, int> client_host_and_port_;
-    // Updated whenever we receive a packet from an endpoint we don't recognize.
-    // It must be there, because at the time of performing recv() we haven't
-    // parsed the packet as TLS record, and we cannot extract the connection_id
-    // (if any) to see if the packet is indeed valid and should be handled.
-    std::tuple<std::string, int> last_recv_host_and_port_;
-
+    Address client_addr_;
+    // Source of the last packet passed to mbedTLS. Packets from endpoints
+    // other than client_addr_ are only accepted if they carry our
+    // connection_id, but whether they are valid is only known once mbedTLS
+    // authenticates them; the address is adopted then.
+    Address last_recv_addr_;
+    // updated by the BIO callbacks, so guarded by mutex_ as well
+    IoStats io_stats_;
+
+    // mbedTLS BIO callbacks: called with the GIL released and mutex_ locked.
     static int _send(void *self, const unsigned char *buf, size_t len);
     static int
     _recv(void *self, unsigned char *buf, size_t len, uint32_t timeout_ms);
 
     HandshakeResult do_handshake();
+    void adopt_last_recv_addr();
+    void update_fd();
+    int read(unsigned char *buf, size_t len);
 
 public:
     Socket(std::shared_ptr<Context> context,
@@ -83,9 +114,11 @@ public:
     ~Socket();
 
     void connect(py::tuple host_port, py::object handshake_timeouts_s_);
-    void send(const std::string &data);
+    void send(py::object data);
     py::bytes recv(int);
+    size_t recv_into(py::object buffer, size_t nbytes);
     void settimeout(py::object timeout_s_or_none);
+    IoStats io_stats();
     py::object __getattr__(py::object name);
     void __setattr__(py::object name, py::object value);
 };
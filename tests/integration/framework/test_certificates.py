@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import collections
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+CertAndKey = collections.namedtuple('CertAndKey', ('cert_file', 'key_file'))
+CertAndKey.__doc__ = """
+Paths of a PEM-encoded self-signed certificate and its private key.
+"""
+
+
+def generate_pem_cert_and_key(cn: str = '127.0.0.1', key_size: int = 2048,
+                              valid_days: int = 1) -> Tuple[bytes, bytes]:
+    """
+    Generates an RSA key and a self-signed certificate for CN, valid for
+    VALID_DAYS from now. Returns both PEM-encoded.
+    """
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size,
+                                   backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder().
+            subject_name(name).
+            issuer_name(name).
+            public_key(key.public_key()).
+            serial_number(1000).
+            not_valid_before(now).
+            not_valid_after(now + datetime.timedelta(days=valid_days)).
+            sign(key, hashes.SHA256(), default_backend()))
+    cert_pem = cert.public_bytes(encoding=serialization.Encoding.PEM)
+    key_pem = key.private_bytes(encoding=serialization.Encoding.PEM,
+                                format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                encryption_algorithm=serialization.NoEncryption())
+    return cert_pem, key_pem
+
+
+class CertificateFactory:
+    """
+    Hands out self-signed certificates for TLS test servers, generating each
+    (CN, key size, validity) combination only once: RSA key generation is
+    by far the slowest part of setting up such a test, and every test would
+    otherwise generate equivalent material.
+
+    Files are created in a temporary directory, removed by cleanup(). If
+    CACHE_DIR is given, they are stored there instead, and reused by later
+    runs for as long as the certificates remain valid for at least
+    MIN_REMAINING_VALIDITY.
+
+    The returned files are shared: tests must not modify or remove them.
+    """
+
+    MIN_REMAINING_VALIDITY = datetime.timedelta(hours=1)
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._certs = {}  # type: Dict[Tuple[str, int, int], CertAndKey]
+        self._cache_dir = cache_dir
+        self._temp_dir = None
+
+    def get(self, cn: str = '127.0.0.1', key_size: int = 2048,
+            valid_days: int = 1) -> CertAndKey:
+        params = (cn, key_size, valid_days)
+        with self._lock:
+            if params not in self._certs:
+                self._certs[params] = self._load_or_generate(*params)
+            return self._certs[params]
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self._certs.clear()
+            if self._temp_dir is not None:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+
+    def _directory(self) -> str:
+        if self._cache_dir is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            return self._cache_dir
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp(prefix='anjay-test-certs-')
+        return self._temp_dir
+
+    def _load_or_generate(self, cn: str, key_size: int, valid_days: int) -> CertAndKey:
+        name = hashlib.sha256(repr((cn, key_size, valid_days)).encode()).hexdigest()[:16]
+        directory = self._directory()
+        result = CertAndKey(cert_file=os.path.join(directory, name + '.crt'),
+                            key_file=os.path.join(directory, name + '.key'))
+
+        if self._cache_dir is not None and self._is_usable(result):
+            return result
+
+        cert_pem, key_pem = generate_pem_cert_and_key(cn, key_size, valid_days)
+        # write under temporary names, so that concurrent runs sharing
+        # CACHE_DIR never see a certificate without its matching key
+        for path, data in ((result.key_file, key_pem), (result.cert_file, cert_pem)):
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return result
+
+    def _is_usable(self, cert_and_key: CertAndKey) -> bool:
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+
+        try:
+            with open(cert_and_key.cert_file, 'rb') as f:
+                cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+            if not os.path.isfile(cert_and_key.key_file):
+                return False
+        except (OSError, ValueError):
+            return False
+        remaining = cert.not_valid_after - datetime.datetime.utcnow()
+        return remaining >= self.MIN_REMAINING_VALIDITY
+
+
+_DEFAULT_FACTORY = None  # type: Optional[CertificateFactory]
+_DEFAULT_FACTORY_LOCK = threading.Lock()
+
+
+def get_cert_and_key(cn: Optional[str] = None, **kwargs) -> CertAndKey:
+    """
+    Returns a self-signed certificate for CN (127.0.0.1 by default) from a
+    CertificateFactory shared by the whole test run, and removed at exit.
+    """
+    global _DEFAULT_FACTORY
+    with _DEFAULT_FACTORY_LOCK:
+        if _DEFAULT_FACTORY is None:
+            _DEFAULT_FACTORY = CertificateFactory()
+            atexit.register(_DEFAULT_FACTORY.cleanup)
+    return _DEFAULT_FACTORY.get(cn or '127.0.0.1', **kwargs)
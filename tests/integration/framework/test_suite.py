@@ -154,6 +154,15 @@ class Lwm2mDmOperations(Lwm2mAsserts):
         self.assertMsgEqual(expected_response, res)
         return res
 
+    def _perform_actions_pipelined(self, server, requests, expected_responses, timeout_s=None):
+        if timeout_s is None:
+            timeout_s = self.DEFAULT_OPERATION_TIMEOUT_S
+        responses = server.gather([server.request_async(req) for req in requests],
+                                  timeout_s=timeout_s)
+        for expected_res, res in zip(expected_responses, responses):
+            self.assertMsgEqual(expected_res, res)
+        return responses
+
     def _make_expected_res(self, req, success_res_cls, expect_error_code):
         req.fill_placeholders()
 
@@ -209,6 +218,16 @@ class Lwm2mDmOperations(Lwm2mAsserts):
         return self._perform_action(server, req, expected_res, **kwargs)
 
 
+    def read_paths(self, server, paths, expect_error_code=None, accept=None, **kwargs):
+        """
+        Sends Read requests for all PATHS without waiting for responses, then
+        waits for all of them. Responses may arrive in any order.
+        """
+        reqs = [Lwm2mRead(path, accept=accept) for path in paths]
+        expected_res = [self._make_expected_res(req, Lwm2mContent, expect_error_code)
+                        for req in reqs]
+        return self._perform_actions_pipelined(server, reqs, expected_res, **kwargs)
+
     def read_resource(self, server, oid, iid, rid, expect_error_code=None, accept=None, **kwargs):
         return self.read_path(server, '/%d/%d/%d' % (oid, iid, rid), expect_error_code,
                               accept=accept, **kwargs)
@@ -868,6 +887,57 @@ class Lwm2mDtlsSingleServerTest(Lwm2mSingleServerTest):
         super().setUp(psk_identity=self.PSK_IDENTITY, psk_key=self.PSK_KEY, *args, **kwargs)
 
 
+class MultiDtlsServerPeer:
+    """
+    Makes a coap.MultiDtlsServer with a single client (the demo) usable
+    wherever an Lwm2mServer is expected by setup_demo_with_servers(),
+    assertions and Lwm2mDmOperations. Messages are received with recvfrom(),
+    and sent with sendto() to the address the last message came from.
+    """
+
+    def __init__(self, multi_server: coap.MultiDtlsServer):
+        self.multi_server = multi_server
+        self.remote_addr = None
+        self.multi_server.set_timeout(5)
+
+    def recv(self, timeout_s=-1) -> Lwm2mMsg:
+        data, self.remote_addr = self.multi_server.recvfrom(timeout_s)
+        return get_lwm2m_msg(coap.Packet.parse(data))
+
+    def send(self, pkt: coap.Packet) -> None:
+        self.multi_server.sendto(pkt.fill_placeholders(), self.remote_addr)
+
+    def get_listen_port(self) -> int:
+        return self.multi_server.get_listen_port()
+
+    def security_mode(self) -> str:
+        return self.multi_server.security_mode()
+
+    def close(self) -> None:
+        self.multi_server.close()
+
+
+class Lwm2mMultiDtlsServerTest(Lwm2mTest, SingleServerAccessor):
+    """
+    Runs the demo against a PSK mode coap.MultiDtlsServer, constructed with
+    additional SERVER_KWARGS and available as self.serv.multi_server.
+    """
+    PSK_IDENTITY = b'test-identity'
+    PSK_KEY = b'test-key'
+
+    def setUp(self, server_kwargs={}, extra_cmdline_args=[], *args, **kwargs):
+        if 'servers' not in kwargs:
+            kwargs['servers'] = [MultiDtlsServerPeer(coap.MultiDtlsServer(
+                psk_identity=self.PSK_IDENTITY, psk_key=self.PSK_KEY, **server_kwargs))]
+
+        self.setup_demo_with_servers(
+            extra_cmdline_args=['--identity', str(binascii.hexlify(self.PSK_IDENTITY), 'ascii'),
+                                '--key', str(binascii.hexlify(self.PSK_KEY), 'ascii')]
+                               + extra_cmdline_args,
+            *args,
+            **kwargs)
+
+
 # This class **MUST** be specified as the first in superclass list, due to Python's method resolution order
 # (see https://www.python-course.eu/python3_multiple_inheritance.php) and the fact that not all setUp() methods
 # call super().setUp(). Failure to fulfill this requirement may lead to "make check" failing on systems
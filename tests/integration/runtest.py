@@ -182,6 +182,9 @@ if __name__ == "__main__":
                 tests/suites, demo client execution command is prefixed with `rr record`
                 to allow post-mortem debugging with `rr replay`.
 
+          BENCHMARK - if set and not empty, benchmarks from suites/benchmark are run;
+                      otherwise, they are skipped.
+
         REGEX MATCH RULES
         =================
         {regex_match_rules_help}
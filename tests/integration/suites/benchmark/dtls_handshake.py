@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import logging
+import math
+import os
+import time
+import unittest
+
+from framework.lwm2m_test import *
+from framework.test_certificates import get_cert_and_key
+
+
+def _percentile(sorted_values, fraction):
+    # nearest-rank method
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class DtlsHandshakeBenchmark:
+    @unittest.skipUnless(os.getenv('BENCHMARK'), 'BENCHMARK environment variable not set')
+    class Test(test_suite.Lwm2mSingleServerTest):
+        """
+        Measures DTLS handshakes between the demo and a DtlsServer, performed
+        by reconnecting the demo ITERATIONS times (DTLS_HANDSHAKE_BENCHMARK_ITERATIONS
+        environment variable, 10 by default) and logged at INFO level.
+
+        If RESUME is set, the server keeps a session cache, so that every
+        reconnect resumes the session with an abbreviated handshake.
+        Otherwise, the cache is disabled and every handshake is a full one.
+        Both sides only allow CIPHERSUITE.
+
+        Latency is measured from issuing the "reconnect" command until the
+        server completes the handshake, so it includes passing the command to
+        the demo. Byte counts are UDP payloads of all datagrams exchanged,
+        including the cookie exchange and retransmissions, if any.
+
+        Subclasses must mix in server_kwargs(), returning keyword arguments
+        for coap.DtlsServer. Benchmarks are skipped unless the BENCHMARK
+        environment variable is set.
+        """
+        ITERATIONS = int(os.getenv('DTLS_HANDSHAKE_BENCHMARK_ITERATIONS', '10'))
+        RESUME = False
+        CIPHERSUITE = None  # type: int
+
+        def demo_args(self):
+            return []
+
+        def certs_path(self, name):
+            # demo_path = 'anjay/output/bin'
+            return os.path.join(os.path.dirname(self.config.demo_path), 'certs', name)
+
+        def setUp(self):
+            server = coap.DtlsServer(ciphersuites=[self.CIPHERSUITE],
+                                     session_cache_size=None if self.RESUME else 0,
+                                     **self.server_kwargs())
+            super().setUp(servers=[Lwm2mServer(server)],
+                          extra_cmdline_args=self.demo_args()
+                                             + ['--ciphersuites', '0x%04X' % self.CIPHERSUITE])
+
+        def runTest(self):
+            latencies = []
+            bytes_sent = []
+            bytes_received = []
+            datagrams = []
+
+            for _ in range(self.ITERATIONS):
+                handshakes_before = self.serv.handshake_stats()
+                io_before = self.serv.io_stats()
+                start = time.monotonic()
+
+                self.communicate('reconnect')
+                self.assertDtlsReconnect(timeout_s=5)
+
+                latencies.append(time.monotonic() - start)
+                io_after = self.serv.io_stats()
+                bytes_sent.append(io_after.bytes_sent - io_before.bytes_sent)
+                bytes_received.append(io_after.bytes_received - io_before.bytes_received)
+                datagrams.append(io_after.datagrams_sent + io_after.datagrams_received
+                                 - io_before.datagrams_sent - io_before.datagrams_received)
+
+                # assertDtlsReconnect() does not tell whether the handshake
+                # succeeded, or what kind of handshake it was
+                handshakes = self.serv.handshake_stats()
+                if self.RESUME:
+                    self.assertEqual(handshakes_before.abbreviated + 1, handshakes.abbreviated)
+                    self.assertDemoUpdatesRegistration()
+                else:
+                    self.assertEqual(handshakes_before.full + 1, handshakes.full)
+                    # the session was not resumed, so the demo registers again
+                    self.assertDemoRegisters()
+
+            self.report(latencies, bytes_sent, bytes_received, datagrams)
+
+        def report(self, latencies, bytes_sent, bytes_received, datagrams):
+            latencies = sorted(latencies)
+            count = len(latencies)
+            logging.info('%s: %d %s handshakes with ciphersuite 0x%04X: %.1f handshakes/s, '
+                         'latency p50 %.2f ms, p99 %.2f ms; per handshake: %.1f datagrams, '
+                         '%.0f B sent, %.0f B received',
+                         type(self).__name__, count, 'abbreviated' if self.RESUME else 'full',
+                         self.CIPHERSUITE, count / sum(latencies),
+                         _percentile(latencies, 0.5) * 1000.0,
+                         _percentile(latencies, 0.99) * 1000.0,
+                         sum(datagrams) / count, sum(bytes_sent) / count,
+                         sum(bytes_received) / count)
+
+    class Psk:
+        CIPHERSUITE = 0xC0A8  # TLS_PSK_WITH_AES_128_CCM_8
+        PSK_IDENTITY = b'test-identity'
+        PSK_KEY = b'test-key'
+
+        def server_kwargs(self):
+            return {'psk_identity': self.PSK_IDENTITY, 'psk_key': self.PSK_KEY}
+
+        def demo_args(self):
+            return ['--identity', str(binascii.hexlify(self.PSK_IDENTITY), 'ascii'),
+                    '--key', str(binascii.hexlify(self.PSK_KEY), 'ascii')]
+
+    class PinnedPublicKey:
+        """
+        Raw public keys (RFC 7250) are not supported by mbed TLS, so they are
+        approximated with self-signed EC certificates, the server one being
+        pinned by the demo: the handshake exchanges the same messages, only
+        with certificates wrapping the keys.
+        """
+        CIPHERSUITE = 0xC0AE  # TLS_ECDHE_ECDSA_WITH_AES_128_CCM_8
+
+        def server_kwargs(self):
+            return {'crt_file': self.certs_path('self-signed/server.crt'),
+                    'key_file': self.certs_path('self-signed/server.key')}
+
+        def demo_args(self):
+            return ['-C' + self.certs_path('self-signed/client.crt.der'),
+                    '-K' + self.certs_path('self-signed/client.key.der'),
+                    '-P' + self.certs_path('self-signed/server.crt.der')]
+
+    class EcdsaCertificate:
+        CIPHERSUITE = 0xC0AE  # TLS_ECDHE_ECDSA_WITH_AES_128_CCM_8
+
+        def server_kwargs(self):
+            return {'crt_file': self.certs_path('server.crt'),
+                    'key_file': self.certs_path('server.key')}
+
+    class RsaCertificate:
+        CIPHERSUITE = 0xC030  # TLS_ECDHE_RSA_WITH_AES_256_GCM_SHA384
+
+        def server_kwargs(self):
+            cert_and_key = get_cert_and_key()
+            return {'crt_file': cert_and_key.cert_file, 'key_file': cert_and_key.key_file}
+
+
+class PskFullHandshakeBenchmark(DtlsHandshakeBenchmark.Psk, DtlsHandshakeBenchmark.Test):
+    RESUME = False
+
+
+class PskResumedHandshakeBenchmark(DtlsHandshakeBenchmark.Psk, DtlsHandshakeBenchmark.Test):
+    RESUME = True
+
+
+class PinnedPublicKeyFullHandshakeBenchmark(DtlsHandshakeBenchmark.PinnedPublicKey,
+                                            DtlsHandshakeBenchmark.Test):
+    RESUME = False
+
+
+class PinnedPublicKeyResumedHandshakeBenchmark(DtlsHandshakeBenchmark.PinnedPublicKey,
+                                               DtlsHandshakeBenchmark.Test):
+    RESUME = True
+
+
+class EcdsaCertificateFullHandshakeBenchmark(DtlsHandshakeBenchmark.EcdsaCertificate,
+                                             DtlsHandshakeBenchmark.Test):
+    RESUME = False
+
+
+class EcdsaCertificateResumedHandshakeBenchmark(DtlsHandshakeBenchmark.EcdsaCertificate,
+                                                DtlsHandshakeBenchmark.Test):
+    RESUME = True
+
+
+class RsaCertificateFullHandshakeBenchmark(DtlsHandshakeBenchmark.RsaCertificate,
+                                           DtlsHandshakeBenchmark.Test):
+    RESUME = False
+
+
+class RsaCertificateResumedHandshakeBenchmark(DtlsHandshakeBenchmark.RsaCertificate,
+                                              DtlsHandshakeBenchmark.Test):
+    RESUME = True
@@ -352,3 +352,18 @@ class BlockResponseUnexpectedBlockServerRequestInTheMiddleOfTransfer(BlockRespon
 
         # continue reading block-wise response
         self.read_blocks(iid=0, base_seq=1, block_size=1024)
+
+
+class BlockResponseTransparentReassembly(BlockResponseTest):
+    def runTest(self):
+        expected = self.read_blocks(iid=0, block_size=1024,
+                                    accept=coap.ContentFormat.APPLICATION_OCTET_STREAM)
+
+        for block_size in (None, 16, 256):
+            res = self.serv.request_blockwise(
+                Lwm2mRead(ResPath.Test[0].ResBytes,
+                          accept=coap.ContentFormat.APPLICATION_OCTET_STREAM),
+                block_size=block_size)
+            self.assertEqual(coap.Code.RES_CONTENT, res.code)
+            self.assertEqual([], res.get_options(coap.Option.BLOCK2))
+            self.assertEqual(expected, res.content)
@@ -524,3 +524,17 @@ class NonConfirmableRequestInTheMiddleOfBlockTransfer(MessageInTheMiddleOfBlockT
     def runTest(self):
         req = Lwm2mEmpty(type=coap.Type.NON_CONFIRMABLE)
         self.test_with_message(req, expected_response=None)
+
+
+class BlockTransparentSplitTest(Block.Test):
+    def runTest(self):
+        fw_file_name = self.block_init_file()
+        self.files_to_cleanup.append(fw_file_name)
+
+        req = Lwm2mWrite(ResPath.FirmwareUpdate.Package, make_firmware_package(A_LOT_OF_STUFF),
+                         format=coap.ContentFormat.APPLICATION_OCTET_STREAM)
+        res = self.serv.request_blockwise(req, block_size=256)
+        self.assertEqual(coap.Code.RES_CHANGED, res.code)
+
+        with open(fw_file_name, 'rb') as fw_file:
+            self.assertEqual(fw_file.read(), A_LOT_OF_STUFF)
@@ -17,6 +17,7 @@
 import socket
 import time
 
+from framework.lwm2m.bootstrap import BootstrapEngine, BootstrapProfile, DeviceField
 from framework.lwm2m.coap.server import SecurityMode
 from framework.lwm2m_test import *
 
@@ -176,6 +177,36 @@ class BootstrapClientTest(BootstrapTest.Test):
 
 
 
+class BootstrapWithPrecompiledProfile(BootstrapTest.Test):
+    def setUp(self):
+        super().setUp(servers=1)
+
+    def runTest(self):
+        profile = (BootstrapProfile()
+                   .delete('/')
+                   .write(OID.Server, 1, [(RID.Server.Lifetime, 60),
+                                          (RID.Server.ShortServerID, 1),
+                                          (RID.Server.NotificationStoring, True),
+                                          (RID.Server.Binding, 'U')])
+                   .write(OID.Security, 2, [(RID.Security.ServerURI, DeviceField('uri')),
+                                            (RID.Security.Bootstrap, 0),
+                                            (RID.Security.Mode, SecurityMode.NoSec.value),
+                                            (RID.Security.ShortServerID, 1),
+                                            (RID.Security.PKOrIdentity, DeviceField('identity')),
+                                            (RID.Security.SecretKey, DeviceField('key'))]))
+
+        self.assertDemoRequestsBootstrap()
+        responses = BootstrapEngine(self.bootstrap_server).provision(
+            profile,
+            uri='coap://127.0.0.1:%d' % self.serv.get_listen_port(),
+            identity=b'', key=b'')
+        self.assertEqual([coap.Code.RES_DELETED, coap.Code.RES_CHANGED,
+                          coap.Code.RES_CHANGED, coap.Code.RES_CHANGED],
+                         [response.code for response in responses])
+
+        self.assertDemoRegisters(self.serv, lifetime=60)
+
+
 class ClientBootstrapNotSentAfterDisableWithinHoldoffTest(BootstrapTest.Test):
     def setUp(self):
         super().setUp(num_servers_passed=1, holdoff_s=3, timeout_s=3)
@@ -124,3 +124,35 @@ class NonConfirmableTest(test_suite.Lwm2mSingleServerTest,
                 self.assertIn(pkt.token, {counter_pkt.token, timestamp_pkt.token})
         except socket.timeout:
             pass
+
+
+class ConfirmableAutoAckTest(test_suite.Lwm2mSingleServerTest,
+                             test_suite.Lwm2mDmOperations):
+    def setUp(self):
+        super().setUp(servers=[Lwm2mServer(coap.Server(tx_params=TxParams()))])
+
+    def runTest(self):
+        self.create_instance(self.serv, oid=OID.Test, iid=0)
+        self.write_attributes(self.serv, oid=OID.Test, iid=0, rid=RID.Test.Counter,
+                              query=['con=1', 'pmax=1'])
+        counter_pkt = self.observe(self.serv, oid=OID.Test, iid=0, rid=RID.Test.Counter,
+                                   token=random_stuff(8))
+
+        # the server ACKs Confirmable notifications on its own, so the client
+        # never has to retransmit any of them
+        msg_ids = set()
+        for _ in range(5):
+            pkt = self.serv.recv()
+            self.assertMsgEqual(Lwm2mNotify(token=counter_pkt.token, confirmable=True), pkt)
+            self.assertNotIn(pkt.msg_id, msg_ids)
+            msg_ids.add(pkt.msg_id)
+
+        self.assertGreaterEqual(self.serv.reliability.acks_sent, 5)
+
+        self.serv.send(Lwm2mObserve(ResPath.Test[0].Counter, token=counter_pkt.token, observe=1))
+        try:
+            while True:
+                pkt = self.serv.recv(timeout_s=0.5)
+                self.assertEqual(pkt.token, counter_pkt.token)
+        except socket.timeout:
+            pass
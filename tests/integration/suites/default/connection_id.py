@@ -74,6 +74,19 @@ class UdpProxy(threading.Thread):
             self._operating = False
 
 
+@contextlib.contextmanager
+def _server_proxy(client_socket, server_addr):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.connect(server_addr)
+    proxy = UdpProxy(client_socket, server_socket)
+    proxy.start()
+    try:
+        yield
+    finally:
+        proxy.stop()
+        proxy.join()
+
+
 class CoapServerWithProxy(coap.DtlsServer):
     def __init__(self, *args, **kwargs):
         # This is the socket the demo sees and communicates with.
@@ -95,17 +108,26 @@ class CoapServerWithProxy(coap.DtlsServer):
     def get_local_addr(self):
         return self._client_socket.getsockname()
 
-    @contextlib.contextmanager
     def server_proxy(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_socket.connect(super().get_local_addr())
-        proxy = UdpProxy(self._client_socket, server_socket)
-        proxy.start()
-        try:
-            yield
-        finally:
-            proxy.stop()
-            proxy.join()
+        return _server_proxy(self._client_socket, super().get_local_addr())
+
+
+class MultiDtlsServerWithProxy(test_suite.MultiDtlsServerPeer):
+    def __init__(self, multi_server):
+        # This is the socket the demo sees and communicates with.
+        self._client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._client_socket.bind(('', 0))
+        super().__init__(multi_server)
+
+    def get_listen_port(self):
+        return self._client_socket.getsockname()[1]
+
+    def server_proxy(self):
+        return _server_proxy(self._client_socket, self.multi_server.get_local_addr())
+
+    def close(self):
+        super().close()
+        self._client_socket.close()
 
 
 # At the beginning of the test, things look like this:
@@ -191,6 +213,46 @@ class DtlsConnectionIdTest(test_suite.Lwm2mDtlsSingleServerTest,
         super().tearDown(auto_deregister=False)
 
 
+# The same flow as in DtlsConnectionIdTest, but with a MultiDtlsServer, which routes
+# datagrams by connection ID and migrates the session to the new client address.
+@unittest.skipIf(not pymbedtls.Context.supports_connection_id(),
+                 "connection_id support is not enabled in pymbedtls")
+class MultiDtlsServerConnectionIdTest(test_suite.Lwm2mMultiDtlsServerTest,
+                                      test_suite.Lwm2mDmOperations):
+    CONNECTION_ID_VALUE = 'something'
+
+    def setUp(self):
+        server = MultiDtlsServerWithProxy(coap.MultiDtlsServer(psk_identity=self.PSK_IDENTITY,
+                                                               psk_key=self.PSK_KEY,
+                                                               connection_id=self.CONNECTION_ID_VALUE))
+        super().setUp(servers=[server], auto_register=False, extra_cmdline_args=['--use-connection-id'])
+
+    def runTest(self):
+        with self.serv.server_proxy():
+            self.assertDemoRegisters()
+            self.read_resource(self.serv, oid=OID.Device, iid=0, rid=0)
+
+        stats_before = self.serv.multi_server.stats()
+        self.assertEqual(1, stats_before.handshakes)
+
+        with self.serv.server_proxy():
+            self.communicate('send-update')
+            self.assertDemoUpdatesRegistration()
+            self.read_resource(self.serv, oid=OID.Device, iid=0, rid=0)
+
+            stats_after = self.serv.multi_server.stats()
+            self.assertGreater(stats_after.migrations, stats_before.migrations)
+            self.assertGreater(stats_after.handshakes_avoided, stats_before.handshakes_avoided)
+            self.assertEqual(stats_before.handshakes, stats_after.handshakes)
+            self.assertEqual([self.serv.remote_addr], self.serv.multi_server.peers())
+
+            super().request_demo_shutdown()
+            self.assertDemoDeregisters(reset=False)
+
+    def tearDown(self):
+        super().tearDown(auto_deregister=False)
+
+
 # The flow in this test is similar to DtlsConnectionIdTest, with the exception that
 # this time connection_id extension is not used, and Server ignores messages from
 # an endpoint it doesn't recognize via (host, port) tuple.
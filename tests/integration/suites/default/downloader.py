@@ -22,7 +22,7 @@ import socket
 import threading
 import time
 
-from framework.coap_file_server import CoapFileServerThread
+from framework.coap_file_server import CoapFileServerThread, MultiClientCoapFileServer
 from framework.lwm2m_test import *
 
 DUMMY_PAYLOAD = os.urandom(16 * 1024)
@@ -30,10 +30,11 @@ DUMMY_PAYLOAD = os.urandom(16 * 1024)
 
 class CoapDownload:
     class Test(test_suite.Lwm2mSingleServerTest):
-        def setUp(self, coap_server: coap.Server = None):
+        def setUp(self, coap_server: coap.Server = None, file_server=None):
             super().setUp()
 
-            self.file_server_thread = CoapFileServerThread(coap_server or coap.Server())
+            self.file_server_thread = CoapFileServerThread(coap_server or coap.Server(),
+                                                           file_server=file_server)
             self.file_server_thread.start()
 
             self.tempfile = tempfile.NamedTemporaryFile()
@@ -143,6 +144,33 @@ class CoapDownloadSockets(CoapDownload.Test):
             self.assertEqual(f.read(), DUMMY_PAYLOAD)
 
 
+class CoapDownloadConcurrentClients(CoapDownload.Test):
+    NUM_DOWNLOADS = 4
+
+    def setUp(self):
+        super().setUp(file_server=MultiClientCoapFileServer())
+
+    def runTest(self):
+        uri = self.register_resource('/', DUMMY_PAYLOAD)
+        targets = [tempfile.NamedTemporaryFile() for _ in range(self.NUM_DOWNLOADS)]
+        try:
+            for target in targets:
+                self.communicate('download %s %s' % (uri, target.name))
+
+            self.wait_until_downloads_finished()
+            for target in targets:
+                with open(target.name, 'rb') as f:
+                    self.assertEqual(f.read(), DUMMY_PAYLOAD)
+        finally:
+            for target in targets:
+                target.close()
+
+        with self.file_server as file_server:
+            # each download uses a separate socket
+            self.assertEqual(self.NUM_DOWNLOADS, len(file_server.clients))
+            self.assertGreaterEqual(file_server.bytes_sent, self.NUM_DOWNLOADS * len(DUMMY_PAYLOAD))
+
+
 class CoapDownloadDoesNotBlockLwm2mTraffic(CoapDownload.Test):
     def runTest(self):
         self.communicate('download %s %s' % (self.register_resource('/', DUMMY_PAYLOAD), self.tempfile.name))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+
+from framework.lwm2m_test import *
+
+
+class DtlsSendBufferProtocolTest(test_suite.Lwm2mDtlsSingleServerTest):
+    def runTest(self):
+        buffer = bytearray(4096)
+        for make_buffer in (bytes, bytearray, lambda data: memoryview(bytearray(data))):
+            req = Lwm2mRead(ResPath.Device.Manufacturer)
+            req.fill_placeholders()
+            self.serv.socket.send(make_buffer(req.serialize()))
+
+            size = self.serv.recv_raw_into(buffer, timeout_s=5)
+            self.assertMsgEqual(Lwm2mContent.matching(req)(),
+                                coap.Packet.parse(bytes(buffer[:size])))
+
+
+class DtlsRecvIntoTruncatesTest(test_suite.Lwm2mDtlsSingleServerTest):
+    def runTest(self):
+        req = Lwm2mRead(ResPath.Device.Manufacturer)
+        req.fill_placeholders()
+        self.serv.send(req)
+
+        # a record that does not fit in the buffer is truncated, and the rest
+        # of it is discarded, like with socket.recv_into()
+        buffer = bytearray(4096)
+        self.assertEqual(8, self.serv.socket.recv_into(memoryview(buffer)[:16], 8))
+        self.assertEqual(req.serialize()[4:8], bytes(buffer[4:8]))
+        self.assertEqual(bytes(8), bytes(buffer[8:16]))
+        with self.assertRaises(socket.timeout):
+            self.serv.recv_raw_into(buffer, timeout_s=1)
+
+        with self.assertRaisesRegex(ValueError, 'buffer too small'):
+            self.serv.socket.recv_into(bytearray(4), 8)
@@ -27,7 +27,10 @@ import unittest
 import zlib
 
 from framework.coap_file_server import CoapFileServerThread, CoapFileServer
+from framework.firmware_http_server import FirmwareHttpServer
+from framework.lwm2m.firmware_campaign import FirmwareCampaign
 from framework.lwm2m_test import *
+from framework.test_certificates import get_cert_and_key
 from .block_write import Block, equal_chunk_splitter
 from .access_control import AccessMask
 
@@ -220,45 +223,9 @@ class FirmwareUpdate:
                 self.server_thread.join()
 
     class TestWithTlsServer(Test):
-        @staticmethod
-        def _generate_pem_cert_and_key(cn=None):
-            import datetime
-            from cryptography import x509
-            from cryptography.x509.oid import NameOID
-            from cryptography.hazmat.backends import default_backend
-            from cryptography.hazmat.primitives import hashes, serialization
-            from cryptography.hazmat.primitives.asymmetric import rsa
-
-            key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
-                                           backend=default_backend())
-            name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn or '127.0.0.1')])
-            now = datetime.datetime.utcnow()
-            cert = (x509.CertificateBuilder().
-                    subject_name(name).
-                    issuer_name(name).
-                    public_key(key.public_key()).
-                    serial_number(1000).
-                    not_valid_before(now).
-                    not_valid_after(now + datetime.timedelta(days=1)).
-                    sign(key, hashes.SHA256(), default_backend()))
-            cert_pem = cert.public_bytes(encoding=serialization.Encoding.PEM)
-            key_pem = key.private_bytes(encoding=serialization.Encoding.PEM,
-                                        format=serialization.PrivateFormat.TraditionalOpenSSL,
-                                        encryption_algorithm=serialization.NoEncryption())
-            return cert_pem, key_pem
-
         def setUp(self, pass_cert_to_demo=True, cn=None, *args, **kwargs):
-            cert_pem, key_pem = self._generate_pem_cert_and_key(cn=cn)
-            with tempfile.NamedTemporaryFile(delete=False) as cert_file, \
-                    tempfile.NamedTemporaryFile(delete=False) as key_file:
-                cert_file.write(cert_pem)
-                cert_file.flush()
-
-                key_file.write(key_pem)
-                key_file.flush()
-
-                self._cert_file = cert_file.name
-                self._key_file = key_file.name
+            # generated once per test run and shared between tests
+            self._cert_file, self._key_file = get_cert_and_key(cn=cn)
 
             extra_cmdline_args = []
             if 'extra_cmdline_args' in kwargs:
@@ -268,20 +235,6 @@ class FirmwareUpdate:
                 extra_cmdline_args += ['--fw-cert-file', self._cert_file]
             super().setUp(extra_cmdline_args=extra_cmdline_args, *args, **kwargs)
 
-        def tearDown(self):
-            def unlink_without_err(fname):
-                try:
-                    os.unlink(fname)
-                except:
-                    print('unlink(%r) failed' % (fname,))
-                    sys.excepthook(*sys.exc_info())
-
-            try:
-                super().tearDown()
-            finally:
-                unlink_without_err(self._cert_file)
-                unlink_without_err(self._key_file)
-
     class TestWithHttpsServer(TestWithTlsServer, TestWithHttpServer):
         def get_firmware_uri(self):
             http_uri = super().get_firmware_uri()
@@ -475,6 +428,23 @@ class FirmwareUpdateUriTest(FirmwareUpdate.TestWithHttpServer):
                             self.serv.recv())
 
 
+class FirmwareUpdateCampaignTest(FirmwareUpdate.TestWithHttpServer):
+    def setUp(self):
+        super().setUp()
+        self.set_check_marker(True)
+        self.set_auto_deregister(False)
+
+    def runTest(self):
+        self.provide_response()
+
+        result = FirmwareCampaign(self.get_firmware_uri(),
+                                  download_timeout_s=20).run_all([self.serv])[self.serv]
+        self.assertTrue(result.success, result.error)
+        self.assertEqual('update', result.phase)
+        self.assertEqual({'observe', 'write', 'download', 'update', 'total'}, set(result.timings))
+        self.assertEqual(['/firmware'], self.requests)
+
+
 class FirmwareUpdateStateChangeTest(FirmwareUpdate.TestWithHttpServer):
     def setUp(self):
         super().setUp()
@@ -1199,6 +1169,63 @@ class FirmwareUpdateResumeDownloadingOverHttpWithReconnect(
         self.assertEqual(len(self.requests), 2)
 
 
+class FirmwareUpdateResumeLargeImageOverHttp(FirmwareUpdate.TestWithPartialDownload,
+                                             FirmwareUpdate.Test):
+    GARBAGE_SIZE = 4 * 1024 * 1024
+
+    def setUp(self):
+        self.http_server = FirmwareHttpServer()
+        self.http_server.start()
+        super().setUp()
+
+    def tearDown(self):
+        try:
+            super().tearDown()
+        finally:
+            self.http_server.stop()
+
+    def runTest(self):
+        uri = self.http_server.set_resource(FIRMWARE_PATH,
+                                            make_firmware_package(self.FIRMWARE_SCRIPT_CONTENT))
+        etag = self.http_server.get_resource(FIRMWARE_PATH).etag
+        # guarantees that the client is in the middle of the download when
+        # it reconnects, no matter how fast the transfer is
+        self.http_server.stall_next_after(self.GARBAGE_SIZE // 2)
+
+        # Write /5/0/1 (Firmware URI)
+        req = Lwm2mWrite(ResPath.FirmwareUpdate.PackageURI, uri)
+        self.serv.send(req)
+        self.assertMsgEqual(Lwm2mChanged.matching(req)(), self.serv.recv())
+
+        self.assertTrue(self.http_server.wait_for_fault(timeout_s=20))
+
+        # reconnect
+        self.serv.reset()
+        self.communicate('reconnect')
+        self.assertDemoRegisters(self.serv)
+        self.http_server.release()
+
+        observation = self.serv.observe(ResPath.FirmwareUpdate.State,
+                                        accept=coap.ContentFormat.TEXT_PLAIN)
+        state = int(observation.initial_response.content)
+        if state != UPDATE_STATE_DOWNLOADED:
+            for notification in observation.stream(timeout_s=20):
+                state = int(notification.content)
+                if state == UPDATE_STATE_DOWNLOADED:
+                    break
+        self.serv.cancel_observe(observation)
+        self.assertEqual(UPDATE_STATE_DOWNLOADED, state)
+
+        with open(self.fw_file_name, 'rb') as f:
+            self.assertEqual(f.read(), self.FIRMWARE_SCRIPT_CONTENT)
+
+        self.assertEqual(2, len(self.http_server.requests))
+        resumed = self.http_server.requests[1]
+        self.assertIsNotNone(resumed.range)
+        self.assertGreater(resumed.range[0], 0)
+        self.assertEqual(etag, resumed.headers['If-Match'])
+
+
 class FirmwareUpdateResumeFromStartWithDownloadingOverHttp(
     FirmwareUpdate.TestWithPartialHttpDownloadAndRestart):
     def runTest(self):
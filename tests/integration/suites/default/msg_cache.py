@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import socket
+
 from framework.lwm2m.tlv import TLV
 from framework.lwm2m_test import *
 from framework.test_utils import *
@@ -133,3 +135,27 @@ class CachedBlockResponse(br.BlockResponseTest,
 
         # Read everything till the end
         self.read_blocks(iid=0, base_seq=1)
+
+
+class ServerSideCacheTest(test_suite.Lwm2mSingleServerTest):
+    def setUp(self):
+        super().setUp(servers=[Lwm2mServer(coap.Server(response_cache_size=16))],
+                      auto_register=False,
+                      extra_cmdline_args=['--ack-timeout', '1',
+                                          '--ack-random-factor', '1'])
+
+    def runTest(self):
+        req = self.serv.recv()
+        self.assertMsgEqual(
+            Lwm2mRegister('/rd?lwm2m=1.0&ep=%s&lt=86400' % (DEMO_ENDPOINT_NAME,)),
+            req)
+
+        # Register is retransmitted before we respond; the duplicate must not
+        # be passed to the test
+        with self.assertRaises(socket.timeout):
+            self.serv.recv(timeout_s=1.5)
+        self.assertEqual(1, self.serv.response_cache.hits)
+
+        self.serv.send(Lwm2mCreated.matching(req)(location=self.DEFAULT_REGISTER_ENDPOINT))
+        with self.assertRaises(socket.timeout):
+            self.serv.recv(timeout_s=1.5)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from framework.lwm2m_test import *
+
+
+class MultiDtlsServerTest(test_suite.Lwm2mMultiDtlsServerTest,
+                          test_suite.Lwm2mDmOperations):
+    def runTest(self):
+        # the demo registered in setUp(), after the cookie exchange
+        stats = self.serv.multi_server.stats()
+        self.assertGreaterEqual(stats.hello_verify_requests, 1)
+        self.assertEqual(stats.handshakes, 1)
+        self.assertEqual(stats.failed_handshakes, 0)
+        self.assertEqual([self.serv.remote_addr], self.serv.multi_server.peers())
+
+        self.read_resource(self.serv, oid=OID.Device, iid=0, rid=RID.Device.Manufacturer)
+
+        self.communicate('send-update')
+        self.assertDemoUpdatesRegistration()
+
+        # the session is reused
+        self.assertEqual(1, self.serv.multi_server.stats().handshakes)
+
+
+class MultiDtlsServerReconnectTest(test_suite.Lwm2mMultiDtlsServerTest,
+                                   test_suite.Lwm2mDmOperations):
+    def runTest(self):
+        stats_before = self.serv.multi_server.stats()
+        handshakes_before = self.serv.multi_server.handshake_stats()
+
+        # the demo keeps its port, so its new ClientHello reaches the existing
+        # session; the handshake continues there right after the cookie
+        # exchange, so the Update should arrive within the default timeout
+        self.communicate('reconnect')
+        self.assertDemoUpdatesRegistration()
+
+        stats = self.serv.multi_server.stats()
+        self.assertEqual(stats_before.reconnects + 1, stats.reconnects)
+        self.assertEqual(stats_before.handshakes + 1, stats.handshakes)
+        self.assertEqual(0, stats.failed_handshakes)
+        self.assertEqual(handshakes_before.abbreviated + 1,
+                         self.serv.multi_server.handshake_stats().abbreviated)
+        self.assertEqual([self.serv.remote_addr], self.serv.multi_server.peers())
+
+        self.read_resource(self.serv, oid=OID.Device, iid=0, rid=RID.Device.Manufacturer)
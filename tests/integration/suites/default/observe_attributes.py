@@ -63,6 +63,33 @@ class ObserveAttributesTest(test_suite.Lwm2mSingleServerTest,
         self.assertEqual(pkt.content, counter_pkt.content)
 
 
+class ObservationRegistryTest(test_suite.Lwm2mSingleServerTest,
+                              test_suite.Lwm2mDmOperations):
+    def runTest(self):
+        self.create_instance(self.serv, oid=OID.Test, iid=0)
+        self.write_attributes(self.serv, oid=OID.Test, iid=0, rid=RID.Test.Counter,
+                              query=['pmax=1'])
+
+        observation = self.serv.observe(ResPath.Test[0].Counter)
+        self.assertTrue(observation.active)
+        self.assertEqual(coap.Code.RES_CONTENT, observation.initial_response.code)
+        self.assertEqual([observation], self.serv.observations.by_path(ResPath.Test[0].Counter))
+
+        for notification in observation.stream(timeout_s=3, limit=2):
+            self.assertEqual(coap.Code.RES_CONTENT, notification.code)
+            self.assertEqual(observation.initial_response.content, notification.content)
+        self.assertEqual(0, observation.gaps)
+
+        res = self.serv.cancel_observe(observation)
+        self.assertMsgEqual(Lwm2mContent(msg_id=ANY, token=observation.token), res)
+        self.assertFalse(observation.active)
+        self.assertEqual(0, len(self.serv.observations))
+
+        # no more notifications should arrive
+        with self.assertRaises(socket.timeout):
+            self.serv.recv(timeout_s=3)
+
+
 class ObserveResourceInvalidPmax(test_suite.Lwm2mSingleServerTest,
                                  test_suite.Lwm2mDmOperations):
     def runTest(self):
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+
+from framework.lwm2m_test import *
+from framework.lwm2m.coap import oscore
+
+# Test vectors from RFC 8613, Appendix C.1.1, C.4 and C.7
+RFC8613_MASTER_SECRET = bytes.fromhex('0102030405060708090a0b0c0d0e0f10')
+RFC8613_MASTER_SALT = bytes.fromhex('9e7ca92223786340')
+RFC8613_CLIENT_KEY = bytes.fromhex('f0910ed7295e6ad4b54fc793154302ff')
+RFC8613_SERVER_KEY = bytes.fromhex('ffb14e093c94c9cac9471648b4f98710')
+RFC8613_COMMON_IV = bytes.fromhex('4622d4dd6d944168eefb54987c')
+RFC8613_REQUEST = bytes.fromhex('44015d1f00003974396c6f63616c686f737483747631')
+RFC8613_REQUEST_NONCE = bytes.fromhex('4622d4dd6d944168eefb549868')
+RFC8613_REQUEST_AAD = bytes.fromhex('8368456e63727970743040488501810a40411440')
+RFC8613_PROTECTED_REQUEST = bytes.fromhex(
+    '44025d1f00003974396c6f63616c686f7374620914ff612f1092f1776f1c1668b3825e')
+RFC8613_RESPONSE = bytes.fromhex('64455d1f00003974ff48656c6c6f20576f726c6421')
+RFC8613_PROTECTED_RESPONSE = bytes.fromhex(
+    '64445d1f0000397490ffdbaad1e9a7e7b2a813d3c31524378303cdafae119106')
+
+
+class Test:
+    class OscoreTest(test_suite.Lwm2mTest):
+        """
+        Tests of the framework's OSCORE implementation alone; the demo is
+        not started. self.client_ctx and self.server_ctx are the two ends of
+        an OSCORE security context.
+        """
+
+        def setUp(self):
+            self.client_ctx = oscore.SecurityContext(RFC8613_MASTER_SECRET, b'', b'\x01',
+                                                     master_salt=RFC8613_MASTER_SALT)
+            self.server_ctx = oscore.SecurityContext(RFC8613_MASTER_SECRET, b'\x01', b'',
+                                                     master_salt=RFC8613_MASTER_SALT)
+
+        def tearDown(self):
+            pass
+
+        def make_request(self, msg_id=0x1234, token=b'tok', options=[]):
+            return coap.Packet(type=coap.Type.CONFIRMABLE,
+                               code=coap.Code.REQ_GET,
+                               msg_id=msg_id,
+                               token=token,
+                               options=[coap.Option.URI_PATH('3'),
+                                        coap.Option.URI_PATH('0'),
+                                        coap.Option.URI_PATH('0')] + options)
+
+        def make_response(self, req, type=coap.Type.ACKNOWLEDGEMENT, msg_id=None, options=[],
+                          content=b'Test'):
+            return coap.Packet(type=type,
+                               code=coap.Code.RES_CONTENT,
+                               msg_id=req.msg_id if msg_id is None else msg_id,
+                               token=req.token,
+                               options=options,
+                               content=content)
+
+    class OscoreServerTest(OscoreTest):
+        """
+        Sends protected requests to a coap.Server with self.server_ctx from
+        a plain UDP socket, self.client.
+        """
+
+        def setUp(self, **server_kwargs):
+            super().setUp()
+            self.serv = coap.Server(oscore_context=self.server_ctx, **server_kwargs)
+            self.serv.set_timeout(timeout_s=1)
+            self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.client.settimeout(1)
+            self.client.connect(('127.0.0.1', self.serv.get_listen_port()))
+
+        def tearDown(self):
+            self.client.close()
+            self.serv.close()
+
+        def request_response(self, req):
+            data = self.client_ctx.protect(req).serialize()
+            self.client.send(data)
+            self.assertEqual(req, self.serv.recv())
+
+            res = self.make_response(req)
+            self.serv.send(res)
+            self.assertEqual(res, self.client_ctx.unprotect(
+                coap.Packet.parse(self.client.recv(65536))))
+            return data
+
+
+class OscoreRfc8613VectorsTest(Test.OscoreTest):
+    def runTest(self):
+        self.assertEqual(RFC8613_CLIENT_KEY, self.client_ctx.sender_key)
+        self.assertEqual(RFC8613_SERVER_KEY, self.client_ctx.recipient_key)
+        self.assertEqual(RFC8613_COMMON_IV, self.client_ctx.common_iv)
+        self.assertEqual(RFC8613_SERVER_KEY, self.server_ctx.sender_key)
+        self.assertEqual(RFC8613_CLIENT_KEY, self.server_ctx.recipient_key)
+        self.assertEqual(RFC8613_COMMON_IV, self.server_ctx.common_iv)
+
+        self.assertEqual(RFC8613_REQUEST_NONCE, self.client_ctx._nonce(b'', b'\x14'))
+        self.assertEqual(RFC8613_REQUEST_AAD, self.client_ctx._aad(b'', b'\x14'))
+
+        # the example request is the 21st one sent by the client
+        self.client_ctx.sender_seq = 20
+        req = coap.Packet.parse(RFC8613_REQUEST)
+        protected_req = self.client_ctx.protect(req)
+        self.assertEqual(RFC8613_PROTECTED_REQUEST, protected_req.serialize())
+        self.assertEqual(req, self.server_ctx.unprotect(coap.Packet.parse(protected_req.serialize())))
+
+        res = coap.Packet.parse(RFC8613_RESPONSE)
+        protected_res = self.server_ctx.protect(res)
+        self.assertEqual(RFC8613_PROTECTED_RESPONSE, protected_res.serialize())
+        self.assertEqual(res, self.client_ctx.unprotect(coap.Packet.parse(protected_res.serialize())))
+
+
+class OscoreRoundTripTest(Test.OscoreTest):
+    def runTest(self):
+        def transfer(sender_ctx, receiver_ctx, pkt):
+            protected = sender_ctx.protect(pkt)
+            self.assertNotEqual(pkt.content, protected.content)
+            return receiver_ctx.unprotect(coap.Packet.parse(protected.serialize()))
+
+        # request and piggybacked response
+        req = self.make_request()
+        self.assertEqual(req, transfer(self.server_ctx, self.client_ctx, req))
+        res = self.make_response(req)
+        self.assertEqual(res, transfer(self.client_ctx, self.server_ctx, res))
+
+        # replayed request
+        protected_req = self.server_ctx.protect(self.make_request(msg_id=0x1235))
+        self.client_ctx.unprotect(protected_req)
+        with self.assertRaisesRegex(oscore.OscoreError, 'replayed request'):
+            self.client_ctx.unprotect(protected_req)
+
+        # notifications get Partial IVs of their own
+        observe_req = self.make_request(msg_id=0x1236, token=b'observe',
+                                        options=[coap.Option.OBSERVE(0)])
+        self.assertEqual(observe_req, transfer(self.server_ctx, self.client_ctx, observe_req))
+
+        protected_notifications = []
+        for seq in range(3):
+            notification = self.make_response(observe_req,
+                                              type=coap.Type.NON_CONFIRMABLE,
+                                              msg_id=0x4321 + seq,
+                                              options=[coap.Option.OBSERVE(seq + 1)],
+                                              content=b'Test %d' % (seq,))
+            protected_notifications.append(self.client_ctx.protect(notification))
+            self.assertEqual(notification,
+                             self.server_ctx.unprotect(protected_notifications[-1]))
+
+        self.assertEqual(3, len(set(bytes(n.content) for n in protected_notifications)))
+        with self.assertRaisesRegex(oscore.OscoreError, 'replayed notification'):
+            self.server_ctx.unprotect(protected_notifications[1])
+
+        # tampered ciphertext
+        protected_req = self.server_ctx.protect(self.make_request(msg_id=0x1237))
+        protected_req.content = bytes(protected_req.content[:-1]) + bytes(
+            [protected_req.content[-1] ^ 1])
+        with self.assertRaisesRegex(oscore.OscoreError, 'could not decrypt'):
+            self.client_ctx.unprotect(protected_req)
+
+
+class OscoreServerRetransmissionTest(Test.OscoreServerTest):
+    def runTest(self):
+        data = self.request_response(self.make_request())
+
+        # without a response cache, a retransmission reuses the sequence
+        # number of the original and is rejected as a replay
+        self.client.send(data)
+        with self.assertRaisesRegex(oscore.OscoreError, 'replayed request'):
+            self.serv.recv()
+
+
+class OscoreServerCachedRetransmissionTest(Test.OscoreServerTest):
+    def setUp(self):
+        super().setUp(response_cache_size=16)
+
+    def runTest(self):
+        data = self.request_response(self.make_request())
+
+        # the retransmission is answered from the cache, before it would be
+        # checked for replay
+        self.client.send(data)
+        with self.assertRaises(socket.timeout):
+            self.serv.recv(timeout_s=0.5)
+        cached_res = coap.Packet.parse(self.client.recv(65536))
+        self.assertEqual(0x1234, cached_res.msg_id)
+        self.assertEqual(coap.Code.RES_CONTENT, self.client_ctx.unprotect(cached_res).code)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from framework.lwm2m.fanout import Fanout
+from framework.lwm2m_test import *
+
+
+class PipelinedReadTest(test_suite.Lwm2mSingleServerTest,
+                        test_suite.Lwm2mDmOperations):
+    def runTest(self):
+        paths = [ResPath.Device.Manufacturer,
+                 ResPath.Device.ModelNumber,
+                 ResPath.Device.SerialNumber,
+                 ResPath.Device.FirmwareVersion,
+                 ResPath.Server[1].Lifetime,
+                 ResPath.Server[1].Binding]
+        responses = self.read_paths(self.serv, paths)
+        self.assertEqual(len(paths), len(responses))
+
+        # synchronous operations still work while the receive pump is running
+        self.read_path(self.serv, '/%d/0' % OID.Test, expect_error_code=coap.Code.RES_NOT_FOUND)
+
+        # Updates arriving while the pump is running are still delivered by recv()
+        self.communicate('send-update')
+        self.assertDemoUpdatesRegistration()
+
+
+class CongestionControlledPipelinedReadTest(test_suite.Lwm2mSingleServerTest,
+                                            test_suite.Lwm2mDmOperations):
+    def setUp(self):
+        super().setUp(servers=[Lwm2mServer(coap.Server(nstart=1))])
+
+    def runTest(self):
+        paths = [ResPath.Device.Manufacturer,
+                 ResPath.Device.ModelNumber,
+                 ResPath.Device.SerialNumber,
+                 ResPath.Device.FirmwareVersion]
+        responses = self.read_paths(self.serv, paths)
+        self.assertEqual(len(paths), len(responses))
+
+        # requests sent while another one was outstanding were queued
+        self.assertGreater(self.serv.congestion.total_queued, 0)
+        self.assertEqual(1, self.serv.congestion.max_outstanding)
+        self.assertEqual(0, self.serv.congestion.queue_depth())
+        self.assertEqual(0, self.serv.congestion.outstanding())
+
+
+class FanoutReadTest(test_suite.Lwm2mTest):
+    def setUp(self):
+        self.setup_demo_with_servers(servers=2)
+
+    def runTest(self):
+        fanout = Fanout(max_in_flight_per_target=2, timeout_s=2)
+        results = list(fanout.run(self.servers, [Lwm2mRead(ResPath.Device.Manufacturer),
+                                                 Lwm2mRead(ResPath.Device.SerialNumber)]))
+        self.assertEqual(4, len(results))
+        self.assertEqual(set(self.servers), set(result.target for result in results))
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertMsgEqual(Lwm2mContent.matching(result.request)(), result.response)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017-2020 AVSystem <avsystem@avsystem.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import tempfile
+
+import pymbedtls
+
+from framework.lwm2m_test import *
+
+
+class PskStoreTest(test_suite.Lwm2mDtlsSingleServerTest,
+                   test_suite.Lwm2mDmOperations):
+    NUM_OTHER_IDENTITIES = 1000
+
+    def setUp(self):
+        self.psk_store = pymbedtls.PskStoreSecurity()
+        with tempfile.NamedTemporaryFile(mode='w') as f:
+            f.write('# identity:key\n')
+            for i in range(self.NUM_OTHER_IDENTITIES):
+                f.write('%s:%s\n' % (str(binascii.hexlify(b'other-%d' % (i,)), 'ascii'),
+                                     str(binascii.hexlify(b'other-key'), 'ascii')))
+            f.flush()
+            self.assertEqual(self.NUM_OTHER_IDENTITIES, self.psk_store.load(f.name))
+
+        # may be updated at runtime; the demo only connects after setUp
+        self.psk_store.set(self.PSK_IDENTITY, self.PSK_KEY)
+        self.assertIn(self.PSK_IDENTITY, self.psk_store)
+
+        super().setUp(servers=[Lwm2mServer(coap.DtlsServer(psk_store=self.psk_store))])
+
+    def runTest(self):
+        self.assertEqual(self.NUM_OTHER_IDENTITIES + 1, len(self.psk_store))
+        self.read_resource(self.serv, oid=OID.Device, iid=0, rid=RID.Device.Manufacturer)
@@ -17,10 +17,13 @@
 import concurrent.futures
 import os
 import socket
+import tempfile
 import unittest
 
 from framework.lwm2m.coap.server import SecurityMode
 from framework.lwm2m.coap.transport import Transport
+from framework.lwm2m.registration import RegistrationDirectory, parse_link_format
+from framework.lwm2m.store import Lwm2mStore
 from framework.lwm2m_test import *
 from suites.default import bootstrap_client
 
@@ -216,6 +219,63 @@ class RegisterWithLostSeparateAck(RegisterUdp.TestCase):
                             self.serv.recv())
 
 
+class RegisterWithRegistrationDirectory(RegisterUdp.TestCase):
+    def runTest(self):
+        self.serv.set_registrations(RegistrationDirectory(make_location=lambda _: '/rd/demo'))
+
+        # Register is answered by the directory and does not reach the test
+        with self.assertRaises(socket.timeout, msg='unexpected message'):
+            print(self.serv.recv(timeout_s=2))
+
+        registration = self.serv.registrations.by_endpoint(DEMO_ENDPOINT_NAME)
+        self.assertIsNotNone(registration)
+        self.assertEqual('/rd/demo', registration.location)
+        self.assertEqual(86400, registration.lifetime)
+        self.assertEqual('1.0', registration.lwm2m_version)
+        self.assertEqual(parse_link_format(expected_content()), registration.links)
+        self.assertIn(OID.Device, registration.objects)
+
+        self.communicate('send-update')
+        with self.assertRaises(socket.timeout, msg='unexpected message'):
+            print(self.serv.recv(timeout_s=2))
+        self.assertEqual(1, registration.updates)
+
+        # let the teardown handle De-register
+        self.serv.set_registrations(None)
+
+
+class RegisterWithPersistentStore(RegisterUdp.TestCase):
+    def setUp(self):
+        super().setUp()
+        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+            self.db_file_name = f.name
+
+    def tearDown(self):
+        super().tearDown()
+        os.unlink(self.db_file_name)
+
+    def runTest(self):
+        with Lwm2mStore(self.db_file_name) as store:
+            self.serv.set_registrations(RegistrationDirectory(make_location=lambda _: '/rd/demo',
+                                                              store=store))
+            with self.assertRaises(socket.timeout, msg='unexpected message'):
+                print(self.serv.recv(timeout_s=2))
+
+        # simulate server restart: the registration is only known to the store
+        with Lwm2mStore(self.db_file_name) as store:
+            self.serv.set_registrations(RegistrationDirectory(store=store))
+            self.communicate('send-update')
+            with self.assertRaises(socket.timeout, msg='unexpected message'):
+                print(self.serv.recv(timeout_s=2))
+
+            registration = self.serv.registrations.by_endpoint(DEMO_ENDPOINT_NAME)
+            self.assertEqual('/rd/demo', registration.location)
+            self.assertEqual(1, registration.updates)
+
+            # let the teardown handle De-register
+            self.serv.set_registrations(None)
+
+
 class RegisterWithBlock(test_suite.Lwm2mSingleServerTest):
     def setUp(self):
         extra_args = '-I 64 -O 128'.split()
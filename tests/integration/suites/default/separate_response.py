@@ -80,3 +80,50 @@ class SeparateResponseTest(test_suite.Lwm2mSingleServerTest):
         with self.assertRaises(socket.timeout, msg='unexpected message'):
             print(self.serv.recv(timeout_s=3))
 
+
+
+class ServerSeparateResponseTest(test_suite.Lwm2mTest):
+    """
+    Checks how a coap.Server with TX_PARAMS handles a Separate Response to
+    its own request. The demo does not send those, so a plain UDP socket
+    plays the client instead; the demo is not started.
+    """
+
+    def setUp(self):
+        self.tx_params = TxParams(ack_timeout=1.0)
+        self.serv = coap.Server(tx_params=self.tx_params)
+        self.serv.set_timeout(timeout_s=1)
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(('127.0.0.1', 0))
+        self.client.connect(('127.0.0.1', self.serv.get_listen_port()))
+        self.client.settimeout(1)
+        self.serv.connect_to_client(self.client.getsockname())
+
+    def tearDown(self):
+        self.client.close()
+        self.serv.close()
+
+    def runTest(self):
+        req = Lwm2mRead(ResPath.Device.Manufacturer)
+        req.fill_placeholders()
+        self.serv.send(req)
+        self.assertMsgEqual(req, coap.Packet.parse(self.client.recv(65536)))
+
+        # the empty ACK is consumed, and stops retransmissions of the request
+        self.client.send(Lwm2mEmpty.matching(req)().fill_placeholders().serialize())
+        with self.assertRaises(socket.timeout):
+            self.serv.recv(timeout_s=2 * self.tx_params.first_retransmission_timeout())
+        with self.assertRaises(socket.timeout):
+            self.client.recv(65536)
+        self.assertEqual(0, self.serv.reliability.pending)
+
+        # the Separate Response is returned from recv() and ACKed
+        res = Lwm2mContent(msg_id=(req.msg_id + 1) & 0xFFFF, token=req.token,
+                           content=b'Test', format=coap.ContentFormat.TEXT_PLAIN,
+                           type=coap.Type.CONFIRMABLE)
+        self.client.send(res.serialize())
+        self.assertMsgEqual(res, self.serv.recv())
+        self.assertMsgEqual(Lwm2mEmpty.matching(res)(), coap.Packet.parse(self.client.recv(65536)))
+
+        self.assertEqual(0, self.serv.reliability.retransmissions)
+        self.assertEqual(1, self.serv.reliability.acks_sent)
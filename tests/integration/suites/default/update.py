@@ -79,6 +79,19 @@ class ReconnectTest(test_suite.Lwm2mDtlsSingleServerTest):
         self.assertDtlsReconnect()
 
 
+class ReconnectResumesSessionTest(test_suite.Lwm2mDtlsSingleServerTest):
+    def runTest(self):
+        self.serv.set_timeout(timeout_s=1)
+
+        self.communicate('reconnect')
+        self.assertDtlsReconnect()
+
+        # the session established during registration should be resumed
+        stats = self.serv.handshake_stats()
+        self.assertEqual(1, stats.full)
+        self.assertEqual(1, stats.abbreviated)
+
+
 class ReconnectBootstrapTest(test_suite.Lwm2mSingleServerTest):
     def setUp(self):
         self.setup_demo_with_servers(servers=0, bootstrap_server=True)